@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from . import principals
+        from .models import User
+
+        post_save.connect(principals.user_changed, sender=User, dispatch_uid='accounts.principals.saved')
+        post_delete.connect(principals.user_changed, sender=User, dispatch_uid='accounts.principals.deleted')
@@ -14,9 +14,15 @@ Example usage:
 """
 
 from rest_framework_simplejwt import authentication as jwt_authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
 from django.conf import settings
 from rest_framework import authentication, exceptions as rest_exceptions
-from django.middleware.csrf import CsrfViewMiddleware
+
+from . import principals
+
+# A single validator for every request: the middleware only caches settings-derived values
+csrf_check = authentication.CSRFCheck(lambda request: None)
 
 
 def enforce_csrf(request):
@@ -30,10 +36,9 @@ def enforce_csrf(request):
     - PermissionDenied: If CSRF validation fails.
     """
 
-    csrf_middleware = CsrfViewMiddleware(request)
     csrf_token = request.META.get('HTTP_X_CSRFTOKEN', '')
     request.META['CSRF_COOKIE'] = csrf_token
-    reason = csrf_middleware.process_view(request, None, (), {})
+    reason = csrf_check.process_view(request, None, (), {})
 
     if reason:
         raise rest_exceptions.PermissionDenied('CSRF Failed: %s' % reason)
@@ -43,7 +48,8 @@ class CustomAuthentication(jwt_authentication.JWTAuthentication):
     Custom authentication class to authenticate users based on the httponly cookie access_token.
 
     This class extends `rest_framework_simplejwt.authentication.JWTAuthentication` and adds
-    CSRF validation enforcement.
+    CSRF validation enforcement. Users are read from the principal cache rather than the
+    database (see `accounts.principals`).
 
     Attributes:
     - authentication_classes: A list of authentication classes.
@@ -75,3 +81,23 @@ class CustomAuthentication(jwt_authentication.JWTAuthentication):
         enforce_csrf(request)
 
         return self.get_user(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        """
+        Return the user of a validated token from the principal cache.
+
+        Raises:
+        - AuthenticationFailed: If the user does not exist, is inactive, or the token was revoked.
+        """
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        user = principals.get(user_id, validated_token.get(principals.VERSION_CLAIM, 0))
+        if user is None:
+            raise AuthenticationFailed('User not found or token revoked', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
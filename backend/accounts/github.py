@@ -9,17 +9,154 @@ Example usage:
     >>> token = github.exchange_code_for_token("oauth_code")
     >>> user_data = github.get_github_user(token)
     >>> emails_data = github.get_github_emails(token)
+
+Requests share a pooled session, so that the TLS connections to GitHub are reused
+across sign-ins, and every request has (connect, read) timeouts of `GITHUB_API_TIMEOUT`
+seconds. Connection failures, and for the API lookups 502-504 responses, are retried up
+to `GITHUB_API_RETRIES` times; the code exchange is not retried once sent, as a code can
+only be exchanged once. `Github.fetch_account(code)` looks the user and their emails up
+concurrently after the exchange.
+
+`AsyncGithub` makes the same calls from the async views, on the pooled HTTP client of
+the event loop (see `core.async_http`).
+
+With `GITHUB_FIXTURES` set to a JSON file of recorded responses, keyed by URL (e.g.
+`accounts/github_fixtures.json`), both clients answer from it instead of calling GitHub, for
+development and tests.
 """
 
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 import requests
 from django.conf import settings
+from requests.adapters import BaseAdapter, HTTPAdapter
 from rest_framework import serializers, status
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from urllib3.util.retry import Retry
+
+from core import async_http
 
 from .models import User
 
+GITHUB_API_TIMEOUT = getattr(settings, 'GITHUB_API_TIMEOUT', (3, 10))
+GITHUB_API_RETRIES = getattr(settings, 'GITHUB_API_RETRIES', 2)
+GITHUB_API_POOL_SIZE = getattr(settings, 'GITHUB_API_POOL_SIZE', 10)
+GITHUB_FIXTURES = getattr(settings, 'GITHUB_FIXTURES', None)
+
+TOKEN_URL = 'https://github.com/login/oauth/access_token'
+USER_URL = 'https://api.github.com/user'
+EMAILS_URL = 'https://api.github.com/user/emails'
+
+logger = logging.getLogger(__name__)
+
+
+def load_fixtures(path):
+    """
+    Load recorded GitHub responses.
+
+    Parameters:
+        path (str): JSON file mapping URLs (without query) to `{"status": ..., "body": ...}`.
+
+    Returns:
+        dict: (status code, JSON body bytes) by URL.
+    """
+
+    with open(path) as file:
+        recorded = json.load(file)
+    return {url: (response.get('status', 200), json.dumps(response['body']).encode())
+            for url, response in recorded.items()}
+
+
+def fixture_response(fixtures, url):
+    """Return the recorded (status code, body) for a URL, or a GitHub-like 404."""
+
+    return fixtures.get(url.split('?')[0], (404, b'{"message": "Not Found"}'))
+
+
+class FixtureAdapter(BaseAdapter):
+    """`requests` transport adapter answering from recorded responses, without network access."""
+
+    def __init__(self, fixtures):
+        super().__init__()
+        self.fixtures = fixtures
+
+    def send(self, request, **kwargs):
+        status_code, body = fixture_response(self.fixtures, request.url)
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers['Content-Type'] = 'application/json'
+        response._content = body
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def _default_session():
+    session = requests.Session()
+    if GITHUB_FIXTURES:
+        adapter = FixtureAdapter(load_fixtures(GITHUB_FIXTURES))
+    else:
+        # Only GET requests are retried once sent (read errors and 502-504 responses)
+        retry = Retry(
+            total=GITHUB_API_RETRIES, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET'}), raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=GITHUB_API_POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    return session
+
+
+_session = None
+_executor = None
+_async_fixture_client = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Return the worker's shared GitHub session."""
+
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _default_session()
+        return _session
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GITHUB_API_POOL_SIZE, thread_name_prefix='github')
+        return _executor
+
+
+def get_async_client():
+    """Return the HTTP client for `AsyncGithub`: the pooled client, or one answering from fixtures."""
+
+    global _async_fixture_client
+    if not GITHUB_FIXTURES:
+        return async_http.get_client()
+    with _lock:
+        if _async_fixture_client is None:
+            fixtures = load_fixtures(GITHUB_FIXTURES)
+
+            def respond(request):
+                status_code, body = fixture_response(fixtures, str(request.url))
+                return httpx.Response(status_code, content=body, headers={'Content-Type': 'application/json'})
+
+            _async_fixture_client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+        return _async_fixture_client
+
 
 class Github():
     """
@@ -38,7 +175,7 @@ class Github():
         - code (str): The OAuth code obtained during authentication.
 
         Returns:
-        - token (str): The access token.
+        - token (str): The access token, or None if the code could not be exchanged.
         """
 
         params_payload = {
@@ -47,12 +184,17 @@ class Github():
             "code": code,
             "scope": "user:email"
         }
-        get_access_token = requests.post(
-            "https://github.com/login/oauth/access_token", 
-            params=params_payload, 
-            headers={'Accept': 'application/json'}
-        )
-        payload = get_access_token.json()
+        try:
+            get_access_token = get_session().post(
+                TOKEN_URL,
+                params=params_payload, 
+                headers={'Accept': 'application/json'},
+                timeout=GITHUB_API_TIMEOUT,
+            )
+            payload = get_access_token.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('Error exchanging GitHub code: %s', e)
+            return None
         token = payload.get('access_token')
         return token
     
@@ -66,16 +208,20 @@ class Github():
 
         Returns:
         - user_data (dict): Dictionary containing user information.
+
+        Raises:
+        - AuthenticationFailed: If GitHub rejects the token or cannot be reached.
         """
 
         try:
             headers = {
                 'Authorization': f'Bearer {access_token}'
             }
-            resp = requests.get('https://api.github.com/user', headers=headers)
+            resp = get_session().get(USER_URL, headers=headers, timeout=GITHUB_API_TIMEOUT)
+            resp.raise_for_status()
             user_data = resp.json()
             return user_data
-        except:
+        except (requests.RequestException, ValueError):
             raise AuthenticationFailed("Invalid access_token", 401)
 
     @staticmethod
@@ -94,9 +240,90 @@ class Github():
             headers = {
                 'Authorization': f'Bearer {access_token}'
             }
-            resp = requests.get('https://api.github.com/user/emails', headers=headers)
+            resp = get_session().get(EMAILS_URL, headers=headers, timeout=GITHUB_API_TIMEOUT)
+            resp.raise_for_status()
             emails_data = resp.json()
             return emails_data
-        except Exception as e:
-            print(f"Error fetching emails: {e}")
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('Error fetching GitHub emails: %s', e)
+            return []
+
+    @classmethod
+    def fetch_account(cls, code):
+        """
+        Exchange an OAuth code and fetch the user and their emails, the last two concurrently.
+
+        Returns:
+        - tuple or None: (user data, emails data), or None if the code was not exchanged
+          for an access token.
+        """
+
+        access_token = cls.exchange_code_for_token(code)
+        if not access_token:
+            return None
+        emails = get_executor().submit(cls.get_github_emails, access_token)
+        return cls.get_github_user(access_token), emails.result()
+
+
+class AsyncGithub:
+    """
+    Async counterpart of `Github`, with the same results and errors.
+    """
+
+    @staticmethod
+    async def exchange_code_for_token(code):
+        params_payload = {
+            "client_id": settings.GITHUB_CLIENT_ID,
+            "client_secret": settings.GITHUB_SECRET,
+            "code": code,
+            "scope": "user:email"
+        }
+        try:
+            response = await get_async_client().post(
+                TOKEN_URL,
+                params=params_payload,
+                headers={'Accept': 'application/json'},
+                timeout=async_http.timeout(*GITHUB_API_TIMEOUT),
+            )
+            return response.json().get('access_token')
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning('Error exchanging GitHub code: %s', e)
+            return None
+
+    @staticmethod
+    async def get_github_user(access_token):
+        try:
+            response = await get_async_client().get(
+                USER_URL, headers={'Authorization': f'Bearer {access_token}'},
+                timeout=async_http.timeout(*GITHUB_API_TIMEOUT))
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError):
+            raise AuthenticationFailed("Invalid access_token", 401)
+
+    @staticmethod
+    async def get_github_emails(access_token):
+        try:
+            response = await get_async_client().get(
+                EMAILS_URL, headers={'Authorization': f'Bearer {access_token}'},
+                timeout=async_http.timeout(*GITHUB_API_TIMEOUT))
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning('Error fetching GitHub emails: %s', e)
             return []
+
+    @classmethod
+    async def fetch_account(cls, code):
+        """
+        Exchange an OAuth code and fetch the user and their emails, the last two concurrently.
+
+        Returns:
+            tuple or None: (user data, emails data), or None if the code was not exchanged
+            for an access token.
+        """
+
+        access_token = await cls.exchange_code_for_token(code)
+        if not access_token:
+            return None
+        return await asyncio.gather(cls.get_github_user(access_token), cls.get_github_emails(access_token))
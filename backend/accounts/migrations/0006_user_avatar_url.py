@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_user_github_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_url',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
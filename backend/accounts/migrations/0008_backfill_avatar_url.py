@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:49
+
+from cloudinary.utils import cloudinary_url
+from django.db import migrations
+
+
+def backfill_avatar_urls(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+
+    users = User.objects.filter(avatar_url='').exclude(profile_picture=None).exclude(profile_picture='')
+    for user in users.only('id', 'profile_picture').iterator():
+        avatar_url = cloudinary_url(user.profile_picture.public_id)[0]
+        User.objects.filter(id=user.id).update(avatar_url=avatar_url)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_user_token_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_avatar_urls, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,10 @@ class User(AbstractUser):
     username = models.CharField(max_length=150, unique=True, blank=True)
     email = models.EmailField(unique=True)
     profile_picture = CloudinaryField('image', null=True, blank=True)
+    # URL of the profile picture: provisional while the upload is stored, see core.uploads
+    avatar_url = models.CharField(max_length=500, blank=True)
+    # Bumped to revoke every token issued so far, see accounts.principals
+    token_version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.username
@@ -0,0 +1,88 @@
+"""
+Cached user principals for cookie JWT authentication.
+
+Authenticating a request used to load the user row on every request. Instead, the
+fields that requests read from `request.user` are cached per user, and the user is
+rebuilt from them with `User.from_db`, without a query. Other fields are deferred and
+loaded on first access, like those of a `.only()` queryset.
+
+Access tokens carry a `ver` claim with the user's `token_version`. Logging out of every
+device (`LogoutAllView`) bumps the version, which revokes every token issued before, and
+a cached principal is only used for tokens of its own version. A plain logout only
+blacklists the session's refresh token and drops the cached principal.
+
+The entry is dropped whenever the user row changes: by the `post_save` and
+`post_delete` receivers for saves (the username and profile picture views, the admin),
+and explicitly by code that updates users with `QuerySet.update()`.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import User
+
+PRINCIPAL_CACHE_TTL = getattr(settings, 'PRINCIPAL_CACHE_TTL', 60 * 60)
+VERSION_CLAIM = 'ver'
+
+# Fields cached with the principal; the others are deferred
+CACHED_FIELDS = {
+    'id', 'username', 'email', 'is_active', 'is_staff', 'is_superuser', 'github_id',
+    'profile_picture', 'avatar_url', 'token_version',
+}
+# In model order, as Model.from_db expects for a subset of the fields
+FIELDS = tuple(field.attname for field in User._meta.concrete_fields if field.attname in CACHED_FIELDS)
+
+
+def _cache_key(user_id):
+    return f'principal:{user_id}'
+
+
+def get(user_id, version=0):
+    """
+    Return the user with the given id for a token of the given version.
+
+    Returns:
+        User or None: The user (active or not), or None if it does not exist or the token
+        version is outdated.
+    """
+
+    key = _cache_key(user_id)
+    values = cache.get(key)
+    if values is None:
+        values = User.objects.filter(id=user_id).values_list(*FIELDS).first()
+        if values is None:
+            return None
+        cache.set(key, values, PRINCIPAL_CACHE_TTL)
+
+    user = User.from_db(User.objects.db, FIELDS, values)
+    if user.token_version != version:
+        return None
+    return user
+
+
+def forget(user_id):
+    """Drop the cached principal of a user once the current transaction commits."""
+
+    transaction.on_commit(lambda: cache.delete(_cache_key(user_id)))
+
+
+def user_changed(sender, instance, **kwargs):
+    """`post_save`/`post_delete` receiver dropping the cached principal of a changed user."""
+
+    forget(instance.pk)
+
+
+def add_claims(token, user):
+    """Add the token version of a user to a refresh token (copied to its access tokens)."""
+
+    token[VERSION_CLAIM] = user.token_version
+    return token
+
+
+def revoke_tokens(user_id):
+    """Revoke every token of a user issued so far, by bumping the user's token version."""
+
+    User.objects.filter(id=user_id).update(token_version=F('token_version') + 1)
+    forget(user_id)
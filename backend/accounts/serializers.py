@@ -7,8 +7,8 @@ from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
-from cloudinary.utils import cloudinary_url
 
+from . import principals
 from .github import Github
 from .models import User
 
@@ -18,7 +18,12 @@ class UserSerializer(serializers.ModelSerializer):
     Serializer for the User model.
 
     This serializer is used to serialize user data, including the user's ID, username, email,
-    and profile picture URL (if available).
+    and profile picture URL (if available). The URL is stored on the user (`avatar_url`) when the
+    picture changes, so serializing a user reads its columns only.
+
+    The same users appear many times in one response (authors of posts and comments, creators,
+    members), so each user is serialized once per request: representations are kept in an
+    identity map on the request (or on the root serializer when there is no request).
 
     Attributes:
         profile_picture: Serializer method field to retrieve the URL of the user's profile picture.
@@ -31,16 +36,24 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'username', 'email', 'profile_picture',)
 
+    def to_representation(self, instance):
+        scope = self.context.get('request') or self.root
+        summaries = getattr(scope, '_user_summaries', None)
+        if summaries is None:
+            summaries = scope._user_summaries = {}
+
+        key = (type(self), instance.pk)
+        if key not in summaries:
+            summaries[key] = super().to_representation(instance)
+        return dict(summaries[key])
+
     # Get the URL of the user's profile picture.
     def get_profile_picture(self, obj):
-        if obj.profile_picture:
-            return cloudinary_url(obj.profile_picture.public_id)[0]
-
-        return None
+        return obj.avatar_url or None
 
 # Generate JWT tokens for the provided user
 def get_tokens_for_user(user):
-    refresh = RefreshToken.for_user(user)
+    refresh = principals.add_claims(RefreshToken.for_user(user), user)
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -66,41 +79,55 @@ class GithubLoginSerializer(serializers.Serializer):
             dict: A dictionary containing user data along with access and refresh tokens.
         """
 
-        access_token = Github.exchange_code_for_token(code)
+        account = Github.fetch_account(code)
         
-        if access_token:
-            user_data = Github.get_github_user(access_token)
-            github_username = user_data['login']
-            github_id = user_data['id']
-            emails_data = Github.get_github_emails(access_token)
+        if account:
+            user_data, emails_data = account
+            return sign_in_github_user(user_data, emails_data)
+        else:
+            raise serializers.ValidationError("Unable to fetch access token from GitHub.")
+
+def sign_in_github_user(user_data, emails_data):
+    """
+    Create or update the user of a GitHub account and issue their tokens.
 
-             # Find the primary email address associated with the user
-            primary_email = next((email for email in emails_data if email.get('primary')), None)
+    Parameters:
+        user_data (dict): The GitHub user, as returned by the GitHub API.
+        emails_data (list): The emails of the GitHub user.
 
-            if primary_email:
-                email = primary_email.get('email')
+    Returns:
+        dict: A dictionary containing user data along with access and refresh tokens.
+    """
 
-            try:
-                user = User.objects.get(github_id=github_id)
-                user.email = email
-                user.save()
-            except User.DoesNotExist:
-                user = User.objects.create_user(
-                    username=user_data['login'].lower(), 
-                    email=email, 
-                    github_id=github_id
-                )
+    github_username = user_data['login']
+    github_id = user_data['id']
 
-            serialized_user = UserSerializer(user).data
+    # Find the primary email address associated with the user
+    primary_email = next((email for email in emails_data if email.get('primary')), None)
 
-            token = get_tokens_for_user(user)
+    if not primary_email:
+        raise serializers.ValidationError("The GitHub account has no primary email address.")
+    email = primary_email.get('email')
 
-            access_token = token["access"]
-            refresh_token = token["refresh"]
+    try:
+        user = User.objects.get(github_id=github_id)
+        user.email = email
+        user.save()
+    except User.DoesNotExist:
+        user = User.objects.create_user(
+            username=github_username.lower(), 
+            email=email, 
+            github_id=github_id
+        )
 
-            serialized_user['access_token'] = access_token
-            serialized_user['refresh_token'] = refresh_token
+    serialized_user = UserSerializer(user).data
 
-            return serialized_user
-        else:
-            raise serializers.ValidationError("Unable to fetch access token from GitHub.")
+    token = get_tokens_for_user(user)
+
+    access_token = token["access"]
+    refresh_token = token["refresh"]
+
+    serialized_user['access_token'] = access_token
+    serialized_user['refresh_token'] = refresh_token
+
+    return serialized_user
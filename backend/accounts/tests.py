@@ -1,3 +1,188 @@
-from django.test import TestCase
+import asyncio
+import os
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from requests.adapters import HTTPAdapter
+from rest_framework.test import APIClient
+
+from . import github, principals
+from .models import User
+from .serializers import get_tokens_for_user
+
+FIXTURES = os.path.join(os.path.dirname(github.__file__), 'github_fixtures.json')
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class ConcurrencyAdapter(github.FixtureAdapter):
+    """Fixture adapter that holds every request for `delay` seconds and records how many overlap."""
+
+    def __init__(self, fixtures, delay=0.05, barrier=None):
+        super().__init__(fixtures)
+        self.delay = delay
+        self.barrier = barrier
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if self.barrier and request.method == 'GET':
+                # Both lookups must be in flight at once to get past the barrier
+                self.barrier.wait(timeout=5)
+            time.sleep(self.delay)
+            return super().send(request, **kwargs)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class GithubClientTests(TestCase):
+    def setUp(self):
+        # Fresh shared clients, answering from the recorded responses
+        patcher = mock.patch.multiple(github, GITHUB_FIXTURES=FIXTURES, _session=None, _executor=None,
+                                      _async_fixture_client=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: github._executor and github._executor.shutdown())
+
+    def mount(self, adapter):
+        github.get_session().mount('https://', adapter)
+        return adapter
+
+    def test_session_is_shared(self):
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(github.get_session())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(session) for session in sessions}), 1)
+        self.assertIs(github.get_session(), sessions[0])
+        self.assertIsInstance(sessions[0].get_adapter(github.USER_URL), github.FixtureAdapter)
+
+    def test_session_pools_and_retries_lookups_only(self):
+        with mock.patch.object(github, 'GITHUB_FIXTURES', None):
+            adapter = github.get_session().get_adapter(github.USER_URL)
+        self.assertIsInstance(adapter, HTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, github.GITHUB_API_POOL_SIZE)
+        self.assertEqual(adapter.max_retries.total, github.GITHUB_API_RETRIES)
+        # A code can only be exchanged once: the POST is not retried once sent
+        self.assertEqual(adapter.max_retries.allowed_methods, frozenset({'GET'}))
+
+    def test_fetch_account(self):
+        user, emails = github.Github.fetch_account('code')
+        self.assertEqual(user['login'], 'octocat')
+        self.assertEqual([email['email'] for email in emails if email['primary']], ['octocat@github.com'])
+
+    def test_fetch_account_without_token(self):
+        fixtures = github.load_fixtures(FIXTURES)
+        del fixtures[github.TOKEN_URL]
+        self.mount(github.FixtureAdapter(fixtures))
+        self.assertIsNone(github.Github.fetch_account('code'))
+
+    def test_emails_error(self):
+        fixtures = github.load_fixtures(FIXTURES)
+        del fixtures[github.EMAILS_URL]
+        self.mount(github.FixtureAdapter(fixtures))
+        with self.assertLogs('accounts.github', 'WARNING'):
+            user, emails = github.Github.fetch_account('code')
+        self.assertEqual(user['login'], 'octocat')
+        self.assertEqual(emails, [])
+
+    def test_lookups_run_in_parallel(self):
+        adapter = self.mount(ConcurrencyAdapter(github.load_fixtures(FIXTURES), barrier=threading.Barrier(2)))
+        user, emails = github.Github.fetch_account('code')
+        self.assertEqual(user['login'], 'octocat')
+        self.assertEqual(len(emails), 2)
+        self.assertEqual(adapter.peak, 2)
+
+    def test_executor_bounds_concurrency(self):
+        with mock.patch.object(github, 'GITHUB_API_POOL_SIZE', 2):
+            executor = github.get_executor()
+        adapter = self.mount(ConcurrencyAdapter(github.load_fixtures(FIXTURES)))
+        futures = [executor.submit(github.Github.get_github_emails, 'token') for _ in range(6)]
+        self.assertTrue(all(len(future.result()) == 2 for future in futures))
+        self.assertEqual(adapter.peak, 2)
+        self.assertIs(github.get_executor(), executor)
+
+    def test_async_fetch_account(self):
+        user, emails = asyncio.run(github.AsyncGithub.fetch_account('code'))
+        self.assertEqual(user['login'], 'octocat')
+        self.assertEqual(len(emails), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class GithubSignInTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(github, GITHUB_FIXTURES=FIXTURES, _session=None, _executor=None,
+                                      _async_fixture_client=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sign_in(self):
+        response = APIClient().post('/api/user/auth/github/', {'code': 'code'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        user = User.objects.get(github_id=583231)
+        self.assertEqual(user.email, 'octocat@github.com')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PrincipalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', github_id=1)
+
+    def session(self):
+        """Return a client signed in with the token cookies of a new session."""
+
+        tokens = get_tokens_for_user(self.user)
+        client = APIClient()
+        client.cookies['access_token'] = tokens['access']
+        client.cookies['refresh_token'] = tokens['refresh']
+        return client
+
+    def authenticated(self, client):
+        status_code = client.get('/api/viewer-state/').status_code
+        self.assertIn(status_code, (200, 401))
+        return status_code == 200
+
+    def test_principal_is_cached(self):
+        client = self.session()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticated(client))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.authenticated(client))
+
+    def test_changes_drop_the_principal(self):
+        client = self.session()
+        self.authenticated(client)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch('/api/user/username/', {'username': 'bob'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(principals.get(self.user.id).username, 'bob')
+
+    def test_logout_ends_only_its_session(self):
+        client, other = self.session(), self.session()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post('/api/user/logout/').status_code, 200)
+        self.assertTrue(self.authenticated(other))
+        self.assertEqual(client.post('/api/user/refresh/').status_code, 401)
+
+    def test_logout_all_revokes_every_token(self):
+        client, other = self.session(), self.session()
+        self.authenticated(other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post('/api/user/logout-all/').status_code, 200)
+        # Tokens issued before carry an outdated version, even with the principal cached again
+        self.assertFalse(self.authenticated(other))
+        self.assertFalse(self.authenticated(other))
+        self.assertIsNone(principals.get(self.user.id, 0))
+        self.user.refresh_from_db()
+        self.assertTrue(self.authenticated(self.session()))
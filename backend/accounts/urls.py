@@ -1,10 +1,15 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+
+# GitHub sign-in waits on three GitHub calls; see USE_ASYNC_VIEWS
+github_sign_in = views.github_oauth_sign_in_async if settings.USE_ASYNC_VIEWS else views.GithubOauthSignInView.as_view()
     
 urlpatterns = [
-    path('auth/github/', views.GithubOauthSignInView.as_view(), name='github'),
+    path('auth/github/', github_sign_in, name='github'),
     path('refresh/', views.RefreshTokenView.as_view(), name='token_refresh'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
+    path('logout-all/', views.LogoutAllView.as_view(), name='logout_all'),
     path('username/', views.UpdateUsernameView.as_view()),
     path('profile-picture/', views.UpdateProfilePictureView.as_view()),
 ]
@@ -1,9 +1,16 @@
+import json
+
 import requests
 from accounts.authenticate import CustomAuthentication
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import JsonResponse
 from django.middleware import csrf
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import exceptions, generics, serializers, status
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated
@@ -13,13 +20,51 @@ from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.settings import api_settings
+
+from core import uploads
+from core.models import UploadKind
+from core.serializers import UploadSerializer
 
+from . import principals
+from .github import AsyncGithub
 from .models import User
-from .serializers import GithubLoginSerializer, UserSerializer
+from .serializers import GithubLoginSerializer, UserSerializer, sign_in_github_user
 from django.core.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 
 
+def sign_in_payload(code_data):
+    """Return the body of a successful sign-in response from the signed-in user's data."""
+
+    return {
+        'user_id': code_data.get('id'),
+        'username': code_data.get('username'),
+        'email': code_data.get('email'),
+        'profile_picture': code_data.get('profile_picture'),
+    }
+
+def set_auth_cookies(response, access_token, refresh_token):
+    """Set the httponly cookies carrying the access and refresh tokens on a response."""
+
+    response.set_cookie(
+        key=settings.SIMPLE_JWT['AUTH_COOKIE'],
+        value=access_token,
+        expires=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
+        secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE'],
+        httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
+        samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE']
+    )
+
+    response.set_cookie(
+        key=settings.SIMPLE_JWT['AUTH_COOKIE_REFRESH'],
+        value=refresh_token,
+        expires=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
+        secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE'],
+        httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
+        samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE']
+    )
+
 class GithubOauthSignInView(APIView):
     """
     View for handling GitHub OAuth sign-in.
@@ -41,30 +86,8 @@ class GithubOauthSignInView(APIView):
 
             if access_token and refresh_token:
                 # Construct response with user data and set cookies for tokens
-                response = Response({
-                    'user_id': code_data.get('id'),
-                    'username': code_data.get('username'),
-                    'email': code_data.get('email'),
-                    'profile_picture': code_data.get('profile_picture'),
-                }, status=status.HTTP_200_OK)
-
-                response.set_cookie(
-                    key=settings.SIMPLE_JWT['AUTH_COOKIE'],
-                    value=access_token,
-                    expires=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
-                    secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE'],
-                    httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
-                    samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE']
-                )
-
-                response.set_cookie(
-                    key=settings.SIMPLE_JWT['AUTH_COOKIE_REFRESH'],
-                    value=refresh_token,
-                    expires=settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'],
-                    secure=settings.SIMPLE_JWT['AUTH_COOKIE_SECURE'],
-                    httponly=settings.SIMPLE_JWT['AUTH_COOKIE_HTTP_ONLY'],
-                    samesite=settings.SIMPLE_JWT['AUTH_COOKIE_SAMESITE']
-                )
+                response = Response(sign_in_payload(code_data), status=status.HTTP_200_OK)
+                set_auth_cookies(response, access_token, refresh_token)
 
                 # Generate and set CSRF token
                 csrf.get_token(request)
@@ -74,6 +97,40 @@ class GithubOauthSignInView(APIView):
                 return Response("No access token found in the response", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@csrf_exempt
+@require_POST
+async def github_oauth_sign_in_async(request):
+    """
+    Async version of `GithubOauthSignInView`, routed instead of it when `USE_ASYNC_VIEWS`
+    is enabled, with the same responses.
+
+    The GitHub calls run on the pooled async HTTP client, fetching the user and their
+    emails concurrently; only the user lookup and the token creation run in a thread.
+    """
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as e:
+        return JsonResponse({'detail': f'JSON parse error - {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    code = data.get('code') if isinstance(data, dict) else None
+    if not isinstance(code, str) or not code:
+        return JsonResponse({'code': ['This field is required.']}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    try:
+        account = await AsyncGithub.fetch_account(code)
+        if account is None:
+            raise serializers.ValidationError("Unable to fetch access token from GitHub.")
+        code_data = await sync_to_async(sign_in_github_user)(*account)
+    except serializers.ValidationError as e:
+        return JsonResponse({'code': e.detail}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': e.detail}, status=e.status_code)
+
+    response = JsonResponse(sign_in_payload(code_data), status=status.HTTP_200_OK)
+    set_auth_cookies(response, code_data['access_token'], code_data['refresh_token'])
+    csrf.get_token(request)
+    return response
+
 class RefreshTokenView(APIView):
     """
     View for refreshing JWT tokens.
@@ -124,13 +181,19 @@ class LogoutView(APIView):
     blacklists the token to invalidate it, and removes cookies related to authentication and CSRF token. 
     """
 
+    def end_session(self, token):
+        """Invalidate the session of a refresh token (the user's other sessions are kept)."""
+
+        token.blacklist()
+        principals.forget(token[api_settings.USER_ID_CLAIM])
+
     # Handle POST requests for logging out users
     def post(self, request):
         try:
             refreshToken = request.COOKIES.get(
                 settings.SIMPLE_JWT['AUTH_COOKIE_REFRESH'])
             token = tokens.RefreshToken(refreshToken)
-            token.blacklist()
+            self.end_session(token)
 
             response = Response({'LoggedOut'})
             response.delete_cookie(settings.SIMPLE_JWT['AUTH_COOKIE'])
@@ -152,6 +215,19 @@ class LogoutView(APIView):
         except Exception as e:
             raise exceptions.ParseError("Invalid token")
 
+class LogoutAllView(LogoutView):
+    """
+    View for logging out users from every device.
+
+    Like `LogoutView`, but it also revokes every other token of the user by bumping the
+    user's token version (see `accounts.principals`): the access tokens of the user's other
+    sessions, and those refreshed from them, stop authenticating requests at once.
+    """
+
+    def end_session(self, token):
+        super().end_session(token)
+        principals.revoke_tokens(token[api_settings.USER_ID_CLAIM])
+
 class UpdateUsernameView(generics.UpdateAPIView):
     """
     View for updating the username of the authenticated user.
@@ -170,7 +246,8 @@ class UpdateUsernameView(generics.UpdateAPIView):
         username = request.data.get('username')
         if not username:
             return Response('Invalid input', status=400)
-        user = request.user
+        # request.user is a cached principal with deferred fields; validate and save the full row
+        user = User.objects.get(pk=request.user.pk)
         try:
             user.full_clean()
             user.username = username
@@ -184,7 +261,9 @@ class UpdateProfilePictureView(generics.UpdateAPIView):
     View for updating the profile picture of the authenticated user.
 
     This view handles the PATCH requests for updating the profile picture of the authenticated user.
-    It requires authentication and permission of the authenticated user.
+    It requires authentication and permission of the authenticated user. The picture is stored in the
+    background (see `core.uploads`): the response carries a provisional URL, which becomes the user's
+    picture at once and is replaced by the stored URL when the upload completes.
     """
 
     queryset = User.objects.all()
@@ -195,17 +274,20 @@ class UpdateProfilePictureView(generics.UpdateAPIView):
     def update(self, request, *args, **kwargs):
         profile_picture = request.FILES.get('profile_picture')
 
-        if not profile_picture:
+        if not profile_picture or not (profile_picture.content_type or '').startswith('image/'):
             return Response('Invalid input', status=400)
 
-        user = request.user
-        user.profile_picture = profile_picture
-
+        user = User.objects.get(pk=request.user.pk)
         try:
-            user.full_clean()
-            user.save()
-            serializer = self.serializer_class(user)
-            profile_picture = serializer.data.get('profile_picture')
-            return Response({'profile_picture': profile_picture}, status=200)
+            with transaction.atomic():
+                upload = uploads.stage(profile_picture, UploadKind.PROFILE_PICTURE, owner=user)
+                user.avatar_url = uploads.provisional_url(upload, request)
+                user.full_clean()
+                user.save(update_fields=['avatar_url'])
         except ValidationError as e:
             return Response(str(e), status=400)
+
+        return Response({
+            'profile_picture': user.avatar_url,
+            'upload': UploadSerializer(upload, context={'request': request}).data,
+        }, status=200)
@@ -1,7 +1,14 @@
 from django.contrib import admin
-from .models import Subrabbit, Post, Comment, Vote
+from .models import Subrabbit, Post, Comment, Vote, Upload, FileBlob
+
+
+@admin.register(Subrabbit)
+class SubrabbitAdmin(admin.ModelAdmin):
+    # Prefix search, served by the subrabbit_name_prefix_idx index on PostgreSQL
+    search_fields = ['^name']
 
-admin.site.register(Subrabbit)
 admin.site.register(Post)
 admin.site.register(Comment)
 admin.site.register(Vote)
+admin.site.register(Upload)
+admin.site.register(FileBlob)
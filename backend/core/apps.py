@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.models.signals import m2m_changed
+
+        from core import memberships
+
+        m2m_changed.connect(memberships.memberships_changed, sender=memberships.Membership,
+                            dispatch_uid='core.memberships.subscribers')
+        m2m_changed.connect(memberships.memberships_changed, sender=memberships.Moderatorship,
+                            dispatch_uid='core.memberships.moderators')
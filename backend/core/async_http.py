@@ -0,0 +1,41 @@
+"""
+Pooled HTTP client for the async views.
+
+An `httpx.AsyncClient` keeps its connections (and their TLS sessions) open between
+requests, but it is bound to the event loop it is used in. `get_client()` returns the
+client of the running loop, created on first use. Under ASGI every worker runs one loop,
+so all the requests it serves share one connection pool, and hundreds of slow outbound
+calls can be in flight at once without holding a thread each.
+"""
+
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+
+ASYNC_HTTP_MAX_CONNECTIONS = getattr(settings, 'ASYNC_HTTP_MAX_CONNECTIONS', 100)
+# Default (connect, read) timeouts; callers can pass stricter ones per request
+ASYNC_HTTP_TIMEOUT = getattr(settings, 'ASYNC_HTTP_TIMEOUT', (5, 10))
+
+# Clients by event loop; a client goes away with its loop
+_clients = weakref.WeakKeyDictionary()
+
+
+def timeout(connect, read):
+    """Return an `httpx.Timeout` with the given connect and read timeouts."""
+
+    return httpx.Timeout(read, connect=connect)
+
+
+def get_client():
+    """Return the HTTP client of the running event loop."""
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=timeout(*ASYNC_HTTP_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS),
+        )
+    return client
@@ -0,0 +1,207 @@
+"""
+Per-worker prefix index for subrabbit name autocompletion.
+
+Every worker keeps the names of all subrabbits, lowercased, in a sorted array. The names
+starting with a prefix are then a contiguous slice found by binary search, and the top
+suggestions are picked from that slice by member count. Results for short prefixes,
+whose slices are the largest, are memoized until the next change.
+
+Changes (creation, rename, deletion, subscriptions) are appended to a journal in the
+shared cache, under an increasing version number, and applied to the local index by the
+worker that made them. Other workers replay the journal entries they have not seen yet,
+checking for new versions at most every `AUTOCOMPLETE_REFRESH_INTERVAL` seconds, and
+rebuild the index from the database only if entries expired or they fell too far behind.
+Suggestions are therefore answered from memory, without a database query.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.models import Subrabbit
+
+AUTOCOMPLETE_REFRESH_INTERVAL = getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 1)
+# Journal entries are kept long enough for idle workers to catch up; beyond that they rebuild
+JOURNAL_TTL = 60 * 60
+JOURNAL_REPLAY_LIMIT = 1000
+MEMO_PREFIX_LENGTH = 2
+
+VERSION_KEY = 'autocomplete:version'
+
+
+def _journal_key(version):
+    return f'autocomplete:journal:{version}'
+
+
+class PrefixIndex:
+    """
+    Sorted array of (lowercase name, id) pairs with the member count of each subrabbit.
+
+    Attributes:
+        keys: Sorted list of (lowercase name, subrabbit id).
+        entries: Subrabbit id to (name, member count).
+    """
+
+    def __init__(self, rows=()):
+        self.entries = {subrabbit_id: (name, count) for subrabbit_id, name, count in rows}
+        self.keys = sorted((name.lower(), subrabbit_id) for subrabbit_id, (name, _) in self.entries.items())
+        self.memo = {}
+
+    def upsert(self, subrabbit_id, name, count):
+        if subrabbit_id in self.entries:
+            self.remove(subrabbit_id)
+        self.entries[subrabbit_id] = (name, count)
+        bisect.insort(self.keys, (name.lower(), subrabbit_id))
+        self.memo.clear()
+
+    def add_members(self, subrabbit_id, delta):
+        if subrabbit_id in self.entries:
+            name, count = self.entries[subrabbit_id]
+            self.entries[subrabbit_id] = (name, count + delta)
+            self.memo.clear()
+
+    def remove(self, subrabbit_id):
+        name, _ = self.entries.pop(subrabbit_id, (None, 0))
+        if name is None:
+            return
+        key = (name.lower(), subrabbit_id)
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+        self.memo.clear()
+
+    def apply(self, entry):
+        action, subrabbit_id, *args = entry
+        if action == 'set':
+            self.upsert(subrabbit_id, *args)
+        elif action == 'members':
+            self.add_members(subrabbit_id, *args)
+        elif action == 'remove':
+            self.remove(subrabbit_id)
+
+    def suggest(self, prefix, limit):
+        """
+        Return up to `limit` (id, name, member count) tuples of subrabbits whose name starts
+        with `prefix` (case-insensitive): an exact match first, then the largest communities.
+        """
+
+        prefix = prefix.lower()
+        memoize = len(prefix) <= MEMO_PREFIX_LENGTH
+        if memoize and (prefix, limit) in self.memo:
+            return self.memo[(prefix, limit)]
+
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + '\uffff',), start)
+        best = heapq.nlargest(
+            limit,
+            (subrabbit_id for _, subrabbit_id in self.keys[start:end]),
+            key=lambda subrabbit_id: (self.entries[subrabbit_id][0].lower() == prefix,
+                                      self.entries[subrabbit_id][1], -subrabbit_id),
+        )
+        results = [(subrabbit_id, *self.entries[subrabbit_id]) for subrabbit_id in best]
+        if memoize:
+            self.memo[(prefix, limit)] = results
+        return results
+
+
+_index = None
+_version = 0
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _current_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def _rebuild():
+    global _index, _version
+    # Read the version first: changes racing with the load are replayed afterwards
+    version = _current_version()
+    _index = PrefixIndex(Subrabbit.objects.values_list('id', 'name', 'member_count'))
+    _version = version
+
+
+def _catch_up():
+    """Replay the journal entries written since this worker's index version."""
+
+    global _version
+    version = _current_version()
+    if version == _version:
+        return
+    if version < _version or version - _version > JOURNAL_REPLAY_LIMIT:
+        # The counter was reset (evicted), or replaying would cost more than rebuilding
+        _rebuild()
+        return
+    keys = [_journal_key(number) for number in range(_version + 1, version + 1)]
+    entries = cache.get_many(keys)
+    if len(entries) < len(keys):
+        # Some entries expired or were evicted
+        _rebuild()
+        return
+    for key in keys:
+        _index.apply(entries[key])
+    _version = version
+
+
+def get_index():
+    """Return this worker's index, built on first use and refreshed from the journal."""
+
+    global _checked_at
+    with _lock:
+        if _index is None:
+            _rebuild()
+            _checked_at = time.monotonic()
+        elif time.monotonic() - _checked_at >= AUTOCOMPLETE_REFRESH_INTERVAL:
+            _catch_up()
+            _checked_at = time.monotonic()
+        return _index
+
+
+def suggest(prefix, limit=5):
+    """Return the top `limit` subrabbits starting with `prefix` as lightweight dicts."""
+
+    return [
+        {'id': subrabbit_id, 'name': name, 'members_count': count}
+        for subrabbit_id, name, count in get_index().suggest(prefix, limit)
+    ]
+
+
+def _publish(entry):
+    """Append a change to the journal and apply it to this worker's index."""
+
+    global _version
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 0, None)
+        version = cache.incr(VERSION_KEY)
+    cache.set(_journal_key(version), entry, JOURNAL_TTL)
+    with _lock:
+        if _index is not None and _version == version - 1:
+            _index.apply(entry)
+            _version = version
+
+
+def subrabbit_saved(subrabbit):
+    """Index a created or renamed subrabbit once the current transaction commits."""
+
+    entry = ('set', subrabbit.id, subrabbit.name, subrabbit.member_count)
+    transaction.on_commit(lambda: _publish(entry))
+
+
+def subrabbit_deleted(subrabbit_id):
+    """Drop a deleted subrabbit from the index once the current transaction commits."""
+
+    transaction.on_commit(lambda: _publish(('remove', subrabbit_id)))
+
+
+def members_changed(subrabbit_id, delta):
+    """Apply a change of member count once the current transaction commits."""
+
+    transaction.on_commit(lambda: _publish(('members', subrabbit_id, delta)))
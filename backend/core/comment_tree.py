@@ -0,0 +1,213 @@
+"""
+Server-side threading of comments.
+
+Every comment stores its materialized path: the fixed-width base-36 ids of its ancestors
+and itself, joined by `/` (e.g. `0000002s/0000002u`). The subtree of a comment is then a
+single indexed range scan (`path LIKE '<path>/%'`), its ancestors can be read from its
+own path, and each comment stores its `descendant_count`, maintained on insert.
+
+`fetch_thread` loads the comments to show level by level, and `build_tree` nests them.
+Both are bounded in both directions:
+
+- at most `depth` levels below the starting point are loaded and expanded;
+- at most `limit` siblings are returned per level. The first level is one keyset page;
+  each further level is a single query over the path-prefix ranges of the comments
+  shown on the level above, capped at `limit + 1` rows per parent with a window
+  function.
+
+The queries therefore read a number of rows bounded by the response, not by the size
+of the thread. Every cut is replaced by a continuation: collapsed branches carry a
+`more` object with the number of hidden comments and an opaque cursor that resumes the
+listing at that branch after the last sibling shown, and the top level is continued
+through the paginated `next` link. Response size is bounded by `limit ** depth` nodes.
+"""
+
+import string
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from core.pagination import KeysetPagination, decode_cursor, encode_cursor, keyset_filter
+
+SEGMENT_WIDTH = 8
+SEPARATOR = '/'
+# Deepest reply allowed, so that paths fit Comment.path (9 characters per level)
+MAX_DEPTH = 100
+_DIGITS = string.digits + string.ascii_lowercase
+
+
+def encode_segment(comment_id):
+    """Encode a comment id as a fixed-width base-36 path segment, which sorts like the id."""
+
+    digits = ''
+    while comment_id:
+        comment_id, remainder = divmod(comment_id, 36)
+        digits = _DIGITS[remainder] + digits
+    return digits.rjust(SEGMENT_WIDTH, '0')
+
+
+def path_for(comment_id, parent_path=''):
+    """Build the path of a comment from the path of its parent ('' for top-level comments)."""
+
+    segment = encode_segment(comment_id)
+    return f'{parent_path}{SEPARATOR}{segment}' if parent_path else segment
+
+
+def ancestor_ids(path):
+    """Return the ids of the ancestors of the comment with the given path, root first."""
+
+    return [int(segment, 36) for segment in path.split(SEPARATOR)[:-1]]
+
+
+def continuation(parent, sort, after, seen):
+    """
+    Build the cursor that lists the children of `parent` after a sibling.
+
+    Parameters:
+        parent: The comment whose replies are continued, or None for the top level.
+        sort: Name of the sort mode the siblings are listed in.
+        after: Values of the sort ordering for the last sibling returned.
+        seen: Number of comments already returned under `parent` (siblings and replies).
+    """
+
+    payload = {'sort': sort, 'after': after, 'seen': seen}
+    if parent is not None:
+        payload.update(parent=parent.id, path=parent.path)
+    return encode_cursor(payload)
+
+
+def parse_continuation(cursor):
+    """
+    Decode a continuation cursor.
+
+    The cursor carries the path of the parent, so resuming a branch needs no lookup.
+
+    Returns:
+        tuple: (parent id or None for the top level, parent path, sort mode, ordering
+        values of the last sibling returned, number of comments already returned).
+    """
+
+    payload = decode_cursor(cursor)
+    if not isinstance(payload, dict):
+        raise ValueError('Invalid cursor')
+    parent_id = payload.get('parent')
+    path = payload.get('path', '')
+    sort = payload.get('sort')
+    after = payload.get('after')
+    seen = payload.get('seen', 0)
+    if parent_id is not None and (not isinstance(parent_id, int) or not isinstance(path, str)
+                                  or path != path_for(parent_id, path.rpartition(SEPARATOR)[0])):
+        raise ValueError('Invalid cursor')
+    if not isinstance(sort, str) or not isinstance(after, (list, type(None))) or not isinstance(seen, int) or seen < 0:
+        raise ValueError('Invalid cursor')
+    return parent_id, path, sort, after, seen
+
+
+def _ordering_expressions(ordering):
+    return [F(field[1:]).desc() if field.startswith('-') else F(field).asc() for field in ordering]
+
+
+def fetch_thread(comments, ordering, parent=None, after=None, depth=4, limit=10):
+    """
+    Load the comments of a (sub)thread that `build_tree` shows, level by level.
+
+    Parameters:
+        comments: Queryset of the comments of the post.
+        ordering: Total ordering of siblings (field names, '-' for descending).
+        parent: Comment whose replies are listed, or None for the top level.
+        after: Ordering values of the last sibling already returned, or None.
+        depth: Number of levels to load.
+        limit: Maximum number of siblings shown per level.
+
+    Returns:
+        dict: Parent comment id (None for the top level) to the list of its first
+        `limit + 1` child comments in order; the extra one tells that more follow.
+
+    Raises:
+        ValueError: If `after` does not match `ordering`.
+    """
+
+    if parent is not None:
+        level = comments.filter(path__startswith=parent.path + SEPARATOR, depth=parent.depth + 1)
+    else:
+        level = comments.filter(depth=0)
+    if after is not None:
+        if len(after) != len(ordering):
+            raise ValueError('Invalid cursor')
+        try:
+            position = [KeysetPagination.to_python(comments.model, field.lstrip('-'), value)
+                        for field, value in zip(ordering, after)]
+        except ValidationError:
+            raise ValueError('Invalid cursor')
+        level = level.filter(keyset_filter(ordering, position))
+
+    root_id = parent.id if parent is not None else None
+    children = {root_id: list(level.order_by(*ordering)[:limit + 1])}
+    shown = children[root_id][:limit]
+    rank = Window(RowNumber(), partition_by=F('parent_comment_id'), order_by=_ordering_expressions(ordering))
+
+    for _ in range(depth - 1):
+        if not shown:
+            break
+        # The replies of the comments shown, read from their path ranges
+        subtrees = Q()
+        for comment in shown:
+            subtrees |= Q(path__startswith=comment.path + SEPARATOR)
+        replies = comments.filter(subtrees, depth=shown[0].depth + 1) \
+                          .annotate(sibling_rank=rank) \
+                          .filter(sibling_rank__lte=limit + 1) \
+                          .order_by(*ordering)
+        shown = []
+        for reply in replies:
+            siblings = children.setdefault(reply.parent_comment_id, [])
+            siblings.append(reply)
+            if len(siblings) <= limit:
+                shown.append(reply)
+    return children
+
+
+def build_tree(children, serialize, parent=None, depth=4, limit=10, sort=None, ordering=(), seen=0, total=0):
+    """
+    Build the nested representation of the children of `parent`.
+
+    Hidden comment counts are read from the stored `descendant_count`, so the thread
+    only needs to be loaded down to the requested depth.
+
+    Parameters:
+        children: Mapping produced by `fetch_thread`.
+        serialize: Callable turning a comment into a dict.
+        parent: Comment whose replies are listed, or None for the top level.
+        depth: Number of levels to expand, including this one.
+        limit: Maximum number of siblings per level.
+        sort: Name of the sort mode, and `ordering` its fields, for continuations.
+        seen: Number of comments under `parent` returned by previous pages.
+        total: Number of comments under `parent` (its `descendant_count`, or the comment
+            count of the post for the top level).
+
+    Returns:
+        tuple: (list of nodes, continuation of this level or None). A continuation is a
+        dict with the number of hidden comments (`count`) and the `cursor` resuming them.
+    """
+
+    siblings = children.get(parent.id if parent else None, [])
+    nodes = []
+    for comment in siblings[:limit]:
+        node = serialize(comment)
+        if depth > 1:
+            node['replies'], node['more'] = build_tree(
+                children, serialize, comment, depth - 1, limit, sort, ordering, 0, comment.descendant_count)
+        else:
+            node['replies'] = []
+            hidden = comment.descendant_count
+            node['more'] = {'count': hidden, 'cursor': continuation(comment, sort, None, 0)} if hidden else None
+        nodes.append(node)
+
+    if len(siblings) <= limit:
+        return nodes, None
+    seen += sum(1 + comment.descendant_count for comment in siblings[:limit])
+    last = siblings[limit - 1]
+    after = [getattr(last, field.lstrip('-')) for field in ordering]
+    # Stored counts can lag behind, but at least the sibling fetched beyond the page is hidden
+    hidden = max(total - seen, 1)
+    return nodes, {'count': hidden, 'cursor': continuation(parent, sort, after, seen)}
@@ -0,0 +1,142 @@
+"""
+Cache of rendered post feed pages with event-driven invalidation.
+
+Each page is stored as the final JSON bytes produced for a (feed, sort, cursor) request,
+so a warm hit skips the database, the serializers and the renderer alike.
+
+Pages are never deleted explicitly. Instead, every page key embeds the current value of
+the version counters it depends on:
+
+- `global`: bumped when a post is created or deleted; the feed across all subrabbits and
+  every home feed depend on it. Updates to posts (votes, comments, edits) do not bump it,
+  so these feeds show scores up to `FEED_CACHE_TTL` seconds old, instead of every vote
+  on the site emptying their cache.
+- `subrabbit:<id>`: bumped by any change to posts of that subrabbit; subrabbit feeds depend on it.
+- `user:<id>`: bumped when the user subscribes or unsubscribes; the user's feeds depend on it.
+
+Bumping a counter makes every page that depends on it unreachable, and the stale entries
+simply expire after `FEED_CACHE_TTL` seconds.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.models import Subrabbit
+
+FEED_CACHE_TTL = getattr(settings, 'FEED_CACHE_TTL', 60)
+# Version counters must outlive every page that embeds them
+VERSION_TTL = None
+NAME_TTL = 60 * 60
+
+
+def _version_key(scope):
+    return f'feed:version:{scope}'
+
+
+def get_versions(scopes):
+    """Return the current version of each scope, initializing missing counters."""
+
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            cache.add(key, 1, VERSION_TTL)
+            found[key] = cache.get(key, 1)
+        versions.append(found[key])
+    return versions
+
+
+def bump(*scopes):
+    """Invalidate every cached page that depends on one of the given scopes."""
+
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter expired or was evicted: any value unseen by cached pages will do
+            cache.set(key, 2, VERSION_TTL)
+
+
+def subrabbit_changed(subrabbit_id):
+    """
+    Invalidate feeds containing posts of a subrabbit once the current transaction commits,
+    after a post was created or deleted.
+    """
+
+    transaction.on_commit(lambda: bump('global', f'subrabbit:{subrabbit_id}'))
+
+
+def posts_updated(subrabbit_id):
+    """
+    Invalidate the feeds of a subrabbit once the current transaction commits, after some of
+    its posts were updated. The global and home feeds catch up when their pages expire.
+    """
+
+    transaction.on_commit(lambda: bump(f'subrabbit:{subrabbit_id}'))
+
+
+def subscriptions_changed(user_id):
+    """Invalidate the feeds of a user whose subscriptions changed."""
+
+    transaction.on_commit(lambda: bump(f'user:{user_id}'))
+
+
+def subrabbit_id_for(name):
+    """Resolve a subrabbit name to its id through the cache."""
+
+    key = f'feed:subrabbit-id:{name}'
+    subrabbit_id = cache.get(key)
+    if subrabbit_id is None:
+        subrabbit_id = Subrabbit.objects.filter(name=name).values_list('id', flat=True).first() or 0
+        cache.set(key, subrabbit_id, NAME_TTL)
+    return subrabbit_id
+
+
+def forget_subrabbit_name(name):
+    """Drop the cached id of a subrabbit name, e.g. after a rename or deletion."""
+
+    cache.delete(f'feed:subrabbit-id:{name}')
+
+
+def page_key(request, subrabbit_name=None):
+    """
+    Build the cache key of the feed page requested by `request`.
+
+    Parameters:
+        request: The DRF request; its absolute URI (with normalized query) identifies the page.
+        subrabbit_name: Name of the subrabbit the feed is restricted to, if any.
+
+    Returns:
+        str: The versioned cache key.
+    """
+
+    user = request.user
+    scopes = [f'subrabbit:{subrabbit_id_for(subrabbit_name)}'] if subrabbit_name else ['global']
+    if user.is_authenticated:
+        scopes.append(f'user:{user.id}')
+
+    query = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+    identity = repr((
+        request.build_absolute_uri(request.path),
+        query,
+        user.id if user.is_authenticated else None,
+        list(zip(scopes, get_versions(scopes))),
+    ))
+    return 'feed:page:' + hashlib.sha1(identity.encode()).hexdigest()
+
+
+def get_page(key):
+    """Return the cached JSON bytes of a page, or None."""
+
+    return cache.get(key)
+
+
+def set_page(key, content):
+    """Store the JSON bytes of a page."""
+
+    cache.set(key, content, FEED_CACHE_TTL)
@@ -0,0 +1,305 @@
+"""
+Resumable, content-addressed file attachments.
+
+Large attachments are uploaded in chunks:
+
+1. `start()` (POST /api/upload-file/init/) opens a `ChunkedUpload` session.
+2. `append()` (PUT /api/upload-file/<id>/) streams one chunk from the request body to a
+   partial file in the staging directory, in `READ_SIZE` pieces, and advances the
+   session's offset. A chunk must start at the current offset: after a dropped
+   connection the client reads the offset back (GET /api/upload-file/<id>/) and resumes
+   from there instead of starting over.
+3. `finish()` (POST /api/upload-file/<id>/finalize/) stores the file.
+
+The SHA-256 of the file is computed as the chunks arrive. The running hash lives in
+the memory of the worker that received the previous chunk; a worker without it (another
+process, or after a restart) rehashes the partial file once and continues from there.
+
+Stored files are content-addressed `FileBlob`s: if a file with the same content is
+already stored, the partial file is dropped and the existing file is returned, so
+storage and I/O grow with unique content only. Single-request uploads (`store()`, used
+by `upload_file`) are hashed and deduplicated the same way.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import ChunkedUpload, FileBlob
+from core.uploads import UPLOAD_STAGING_ROOT
+
+# Largest chunk accepted by append(); a chunk is streamed, never held in memory
+CHUNKED_UPLOAD_MAX_CHUNK = getattr(settings, 'CHUNKED_UPLOAD_MAX_CHUNK', 16 * 1024 * 1024)
+# Largest file accepted, whether chunked or not
+CHUNKED_UPLOAD_MAX_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+# Seconds after which an idle chunked upload is discarded by the retry_uploads command
+CHUNKED_UPLOAD_EXPIRY = getattr(settings, 'CHUNKED_UPLOAD_EXPIRY', 60 * 60 * 24)
+READ_SIZE = 64 * 1024
+# Running hashes kept per worker; evicted hashes are rebuilt from the partial file
+MAX_HASHERS = 1000
+
+
+class UploadError(Exception):
+    """Raised when a chunk or a finalization request is not acceptable."""
+
+
+class OffsetMismatch(UploadError):
+    """Raised when a chunk does not start at the current offset of its upload."""
+
+    def __init__(self, offset):
+        super().__init__(f'Expected a chunk at offset {offset}')
+        self.offset = offset
+
+
+_hashers = OrderedDict()
+# Upload id -> [lock, number of requests holding or waiting for it]
+_locks = {}
+_lock = threading.Lock()
+
+
+def _partial_path(upload_id):
+    return os.path.join(UPLOAD_STAGING_ROOT, 'partial', f'{upload_id.hex}.part')
+
+
+@contextmanager
+def _upload_lock(upload_id):
+    """
+    Hold the lock of an upload.
+
+    The lock is only kept while requests hold or wait for it, so uploads that are
+    abandoned (and later discarded by another process) leave nothing behind.
+    """
+
+    with _lock:
+        entry = _locks.setdefault(upload_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[upload_id]
+
+
+def _hasher(upload, path):
+    """Return the running hash of an upload at its current offset, rehashing the partial file if needed."""
+
+    with _lock:
+        cached = _hashers.pop(upload.id, None)
+    if cached is not None and cached[0] == upload.offset:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as partial:
+        remaining = upload.offset
+        while remaining:
+            piece = partial.read(min(READ_SIZE, remaining))
+            if not piece:
+                break
+            hasher.update(piece)
+            remaining -= len(piece)
+    return hasher
+
+
+def _remember(upload_id, offset, hasher):
+    with _lock:
+        _hashers[upload_id] = (offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _forget(upload_id):
+    with _lock:
+        _hashers.pop(upload_id, None)
+
+
+def start(name, size=None, owner=None):
+    """
+    Open a chunked upload.
+
+    Parameters:
+        name: The name of the file.
+        size: The total size of the file, if known; finalization then checks it.
+        owner: The uploading user, if authenticated.
+
+    Returns:
+        ChunkedUpload: The new upload, at offset 0.
+    """
+
+    if size is not None and not 0 <= size <= CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadError('Invalid file size')
+    upload = ChunkedUpload.objects.create(
+        name=os.path.basename(name)[:255] or 'file',
+        size=size,
+        owner=owner if owner is not None and owner.is_authenticated else None,
+    )
+    path = _partial_path(upload.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def append(upload, offset, stream, length):
+    """
+    Write a chunk read from `stream` at `offset` of the partial file.
+
+    Parameters:
+        upload: The `ChunkedUpload`.
+        offset: Position of the chunk in the file, which must be the current offset.
+        stream: File-like object to read the chunk from (the request body).
+        length: Length of the chunk in bytes.
+
+    Returns:
+        int: The new offset.
+
+    Raises:
+        OffsetMismatch: If the chunk does not start at the current offset.
+        UploadError: If the chunk is too large or shorter than announced.
+    """
+
+    if not 0 < length <= CHUNKED_UPLOAD_MAX_CHUNK:
+        raise UploadError('Invalid chunk size')
+    limit = upload.size if upload.size is not None else CHUNKED_UPLOAD_MAX_SIZE
+    if offset + length > limit:
+        raise UploadError('Chunk exceeds the file size')
+
+    path = _partial_path(upload.id)
+    with _upload_lock(upload.id):
+        upload.refresh_from_db(fields=['offset'])
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+
+        hasher = _hasher(upload, path)
+        received = 0
+        with open(path, 'r+b') as partial:
+            partial.seek(offset)
+            while received < length:
+                piece = stream.read(min(READ_SIZE, length - received))
+                if not piece:
+                    break
+                partial.write(piece)
+                hasher.update(piece)
+                received += len(piece)
+            # Drop any bytes left past the new end by an earlier, interrupted chunk
+            partial.truncate(offset + received)
+        if received < length:
+            raise UploadError('Incomplete chunk')
+
+        # Advance only from the offset the chunk was written at, in case another worker
+        # appended the same chunk concurrently
+        advanced = ChunkedUpload.objects.filter(id=upload.id, offset=offset).update(
+            offset=F('offset') + received, updated_at=timezone.now())
+        if not advanced:
+            upload.refresh_from_db(fields=['offset'])
+            raise OffsetMismatch(upload.offset)
+        upload.offset = offset + received
+        _remember(upload.id, upload.offset, hasher)
+    return upload.offset
+
+
+def finish(upload, sha256=None):
+    """
+    Store a completely uploaded file, or return the stored file with the same content.
+
+    Parameters:
+        upload: The `ChunkedUpload`.
+        sha256: Optional hex digest computed by the client, checked against the upload.
+
+    Returns:
+        FileBlob: The stored file.
+
+    Raises:
+        UploadError: If the file is incomplete or does not match `sha256`.
+    """
+
+    path = _partial_path(upload.id)
+    with _upload_lock(upload.id):
+        upload.refresh_from_db(fields=['offset'])
+        if upload.size is not None and upload.offset != upload.size:
+            raise UploadError(f'Received {upload.offset} of {upload.size} bytes')
+        digest = _hasher(upload, path).hexdigest()
+        if sha256 and sha256.lower() != digest:
+            raise UploadError('Checksum mismatch')
+
+        blob = _store_blob(path, digest, upload.offset)
+    _forget(upload.id)
+    upload.delete()
+    return blob
+
+
+def discard(upload):
+    """Delete an upload and its partial file."""
+
+    path = _partial_path(upload.id)
+    _forget(upload.id)
+    upload.delete()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def store(uploaded_file):
+    """
+    Store a file uploaded in a single request, deduplicated by content.
+
+    The file is copied to the staging directory and hashed in one pass over its chunks.
+
+    Returns:
+        FileBlob: The stored file.
+    """
+
+    if uploaded_file.size > CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadError('File too large')
+    path = _partial_path(uuid.uuid4())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    hasher = hashlib.sha256()
+    with open(path, 'wb') as partial:
+        for chunk in uploaded_file.chunks(READ_SIZE):
+            partial.write(chunk)
+            hasher.update(chunk)
+    return _store_blob(path, hasher.hexdigest(), uploaded_file.size)
+
+
+def _store_blob(path, digest, size):
+    """
+    Move a complete file into storage under its digest, unless that content is stored already.
+
+    The stored name is the digest alone: the file is shared by everyone who uploads the
+    same content, so it must not carry the name given by its first uploader.
+    """
+
+    blob = FileBlob.objects.filter(sha256=digest).first()
+    if blob is not None:
+        os.remove(path)
+        return blob
+
+    storage = FileSystemStorage()
+    stored_name = storage.get_available_name(os.path.join('files', digest[:2], digest))
+    target = storage.path(stored_name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(path, target)
+    try:
+        with transaction.atomic():
+            return FileBlob.objects.create(sha256=digest, size=size, path=stored_name)
+    except IntegrityError:
+        # The same content was stored concurrently
+        os.remove(target)
+        return FileBlob.objects.get(sha256=digest)
+
+
+def file_url(blob):
+    """Return the public URL of a stored file."""
+
+    return FileSystemStorage().url(blob.path)
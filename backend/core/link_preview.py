@@ -0,0 +1,339 @@
+"""
+Link previews for the EditorJS Link tool.
+
+`fetch_preview(url)` returns the title, description and image of a web page, with every
+part of the work bounded:
+
+- URLs are normalized (scheme and host case, default ports, fragments, tracking
+  parameters), and results are cached under the normalized URL for `LINK_PREVIEW_TTL`
+  seconds. Failures are cached too, for `LINK_PREVIEW_NEGATIVE_TTL` seconds, so a dead
+  link is not fetched again by every author.
+- Concurrent requests for the same URL in a worker share a single download.
+- The page is streamed with strict connect and read timeouts and an overall deadline,
+  and the download stops at `</head>` or after `LINK_PREVIEW_MAX_BYTES`.
+- Only the head is parsed, with an incremental `HTMLParser` that stops at the body.
+
+The HTTP session can be injected, so the fetcher can be exercised against a local
+HTTP server or a stub session.
+
+`afetch_preview(url)` is the same for the async views: the page is downloaded with the
+pooled client of the event loop (see `core.async_http`), and requests for the same URL
+are coalesced within the loop.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from html.parser import HTMLParser
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import httpx
+import requests
+import urllib3
+from django.conf import settings
+from django.core.cache import cache
+
+from core import async_http
+
+LINK_PREVIEW_TTL = getattr(settings, 'LINK_PREVIEW_TTL', 60 * 60 * 24)
+LINK_PREVIEW_NEGATIVE_TTL = getattr(settings, 'LINK_PREVIEW_NEGATIVE_TTL', 60 * 5)
+LINK_PREVIEW_MAX_BYTES = getattr(settings, 'LINK_PREVIEW_MAX_BYTES', 512 * 1024)
+# (connect, read) timeouts of each request, and the deadline for the whole download
+LINK_PREVIEW_TIMEOUT = getattr(settings, 'LINK_PREVIEW_TIMEOUT', (3, 5))
+LINK_PREVIEW_DEADLINE = getattr(settings, 'LINK_PREVIEW_DEADLINE', 10)
+
+CHUNK_SIZE = 16 * 1024
+USER_AGENT = 'RabbitLinkPreview/1.0'
+HEADERS = {'User-Agent': USER_AGENT, 'Accept': 'text/html,application/xhtml+xml'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid')
+
+
+class PreviewError(Exception):
+    """Raised when a page cannot be fetched or is not an HTML page."""
+
+
+def normalize_url(url):
+    """
+    Normalize a URL so that equivalent spellings share a cache entry.
+
+    Raises:
+        ValueError: If the URL is not an absolute http(s) URL.
+    """
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        raise ValueError(f'Not an http(s) URL: {url!r}')
+
+    host = parts.hostname.encode('idna').decode('ascii').lower()
+    if parts.port and parts.port != DEFAULT_PORTS[scheme]:
+        host = f'{host}:{parts.port}'
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith(TRACKING_PARAMS)]
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(sorted(query)), ''))
+
+
+class HeadParser(HTMLParser):
+    """
+    Incremental parser collecting the title and the meta tags of an HTML head.
+
+    Feed it chunks of the document; `done` becomes True once the head is over.
+    """
+
+    META_KEYS = {
+        'og:title', 'og:description', 'og:image', 'og:image:url',
+        'twitter:title', 'twitter:description', 'twitter:image', 'description',
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta = {}
+        self.title = ''
+        self.in_title = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'body':
+            self.done = True
+        elif tag == 'title':
+            self.in_title = True
+        elif tag == 'meta':
+            attrs = dict(attrs)
+            key = (attrs.get('property') or attrs.get('name') or '').lower()
+            if key in self.META_KEYS and attrs.get('content') and key not in self.meta:
+                self.meta[key] = attrs['content'].strip()
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self.in_title = False
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title and not self.done:
+            self.title += data
+
+    def result(self, base_url):
+        """Return the preview fields, resolving the image against the page URL."""
+
+        meta = self.meta
+        image = meta.get('og:image') or meta.get('og:image:url') or meta.get('twitter:image') or ''
+        return {
+            'title': (meta.get('og:title') or meta.get('twitter:title') or ' '.join(self.title.split()))[:300],
+            'description': (meta.get('og:description') or meta.get('twitter:description')
+                            or meta.get('description') or '')[:1000],
+            'image': {'url': urljoin(base_url, image) if image else ''},
+        }
+
+
+def _default_session():
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the worker's shared HTTP session, whose connection pool is reused across previews."""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _default_session()
+        return _session
+
+
+def _codec(content_type):
+    """Return the codec named by the charset of a Content-Type header, defaulting to UTF-8."""
+
+    _, _, charset = content_type.partition('charset=')
+    try:
+        return codecs.lookup(charset.split(';')[0].strip(' "\'')).name if charset else 'utf-8'
+    except LookupError:
+        return 'utf-8'
+
+
+class HeadReader:
+    """Feeds the chunks of a page to a `HeadParser` until its head is over or the byte limit is hit."""
+
+    def __init__(self, status_code, content_type):
+        if status_code >= 400:
+            raise PreviewError(f'HTTP {status_code}')
+        content_type = (content_type or 'text/html').lower()
+        if 'html' not in content_type:
+            raise PreviewError(f'Not an HTML page: {content_type}')
+
+        self.parser = HeadParser()
+        self.decoder = codecs.getincrementaldecoder(_codec(content_type))(errors='replace')
+        self.received = 0
+
+    def feed(self, chunk):
+        """Parse a chunk; return True once no more of the page is needed."""
+
+        chunk = chunk[:LINK_PREVIEW_MAX_BYTES - self.received]
+        self.received += len(chunk)
+        self.parser.feed(self.decoder.decode(chunk))
+        return self.parser.done or self.received >= LINK_PREVIEW_MAX_BYTES
+
+
+def download_head(url, session):
+    """
+    Stream a page until the end of its head, the byte limit or the deadline, and parse it.
+
+    Returns:
+        dict: The preview fields.
+
+    Raises:
+        PreviewError: On network errors, error statuses and non-HTML responses.
+    """
+
+    deadline = time.monotonic() + LINK_PREVIEW_DEADLINE
+    try:
+        with session.get(url, stream=True, timeout=LINK_PREVIEW_TIMEOUT, allow_redirects=True) as response:
+            reader = HeadReader(response.status_code, response.headers.get('Content-Type'))
+            # read1 returns whatever has arrived, so a trickling server cannot hold the
+            # download past the deadline by more than one read timeout
+            while chunk := response.raw.read1(CHUNK_SIZE):
+                if reader.feed(chunk) or time.monotonic() > deadline:
+                    break
+            return reader.parser.result(response.url or url)
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+        raise PreviewError(str(e)) from e
+
+
+async def adownload_head(url, client):
+    """Async `download_head`, with an `httpx.AsyncClient`."""
+
+    deadline = asyncio.get_running_loop().time() + LINK_PREVIEW_DEADLINE
+    try:
+        async with client.stream('GET', url, headers=HEADERS, follow_redirects=True,
+                                 timeout=async_http.timeout(*LINK_PREVIEW_TIMEOUT)) as response:
+            reader = HeadReader(response.status_code, response.headers.get('Content-Type'))
+            try:
+                async with asyncio.timeout_at(deadline):
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        if reader.feed(chunk):
+                            break
+            except TimeoutError:
+                # Keep what was parsed before the deadline, like download_head
+                pass
+            return reader.parser.result(str(response.url))
+    except httpx.HTTPError as e:
+        raise PreviewError(str(e)) from e
+
+
+def _cache_key(normalized):
+    return 'link-preview:' + hashlib.sha1(normalized.encode()).hexdigest()
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def fetch_preview(url, session=None):
+    """
+    Return the preview of a URL, from the cache or by downloading its head.
+
+    Parameters:
+        url: The URL entered by the author.
+        session: Optional `requests.Session`-like object to fetch with.
+
+    Returns:
+        dict or None: The preview fields, or None if the page could not be previewed.
+
+    Raises:
+        ValueError: If the URL is not an absolute http(s) URL.
+    """
+
+    normalized = normalize_url(url)
+    key = _cache_key(normalized)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached or None
+
+    # Coalesce concurrent requests for the same URL onto one download
+    with _inflight_lock:
+        future = _inflight.get(normalized)
+        leader = future is None
+        if leader:
+            future = _inflight[normalized] = Future()
+
+    if not leader:
+        return future.result(timeout=LINK_PREVIEW_DEADLINE + sum(LINK_PREVIEW_TIMEOUT))
+
+    try:
+        try:
+            preview = download_head(normalized, session or get_session())
+        except PreviewError:
+            # Negative entry: an empty dict
+            cache.set(key, {}, LINK_PREVIEW_NEGATIVE_TTL)
+            preview = None
+        else:
+            cache.set(key, preview, LINK_PREVIEW_TTL)
+        future.set_result(preview)
+        return preview
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(normalized, None)
+
+
+# In-flight async downloads by event loop, then by normalized URL
+_ainflight = weakref.WeakKeyDictionary()
+
+
+async def afetch_preview(url, client=None):
+    """
+    Async `fetch_preview`, for the async views.
+
+    Parameters:
+        url: The URL entered by the author.
+        client: Optional `httpx.AsyncClient` to fetch with, instead of the pooled one.
+    """
+
+    normalized = normalize_url(url)
+    key = _cache_key(normalized)
+    cached = await cache.aget(key)
+    if cached is not None:
+        return cached or None
+
+    loop = asyncio.get_running_loop()
+    inflight = _ainflight.setdefault(loop, {})
+    future = inflight.get(normalized)
+    if future is not None:
+        # A waiter giving up must not cancel the shared download
+        return await asyncio.shield(future)
+
+    future = inflight[normalized] = loop.create_future()
+    # Mark a failure as retrieved, in case nobody else waited for it
+    future.add_done_callback(lambda done: done.cancelled() or done.exception())
+    try:
+        try:
+            preview = await adownload_head(normalized, client or async_http.get_client())
+        except PreviewError:
+            await cache.aset(key, {}, LINK_PREVIEW_NEGATIVE_TTL)
+            preview = None
+        else:
+            await cache.aset(key, preview, LINK_PREVIEW_TTL)
+        future.set_result(preview)
+        return preview
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        inflight.pop(normalized, None)
@@ -0,0 +1,152 @@
+import re
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory
+
+from accounts.models import User
+from core import ranking
+from core.models import CommentVote, Post, Subrabbit, Vote
+from core.views import post_views, subrabbit_views
+
+# Sequential scans in PostgreSQL and SQLite plans ("SCAN t USING INDEX i" is an index scan)
+SEQ_SCAN_RE = re.compile(r'Seq Scan on (\w+)|\bSCAN (\w+)(?!.*\bUSING\b)')
+
+
+def view_queryset(view_class, user=None, params=None, **kwargs):
+    """
+    Return the first page of the queryset a list view runs for a GET request.
+
+    Parameters:
+        view_class: A DRF generic view class.
+        user: The requesting user, anonymous by default.
+        params: Query parameters of the request.
+        kwargs: URL kwargs of the view.
+    """
+
+    request = RequestFactory().get('/', params or {})
+    view = view_class()
+    view.setup(request, **kwargs)
+    view.request = view.initialize_request(request)
+    view.request.user = user or AnonymousUser()
+    view.format_kwarg = None
+    page_size = getattr(view.pagination_class, 'page_size', None) or 10
+    return view.get_queryset()[:page_size + 1]
+
+
+def table_rows(table):
+    """Return the (estimated, on PostgreSQL) number of rows of a table."""
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first vacuumed or analyzed
+            if row and row[0] >= 0:
+                return row[0]
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    """
+    Run EXPLAIN on the queries of the list endpoints and flag sequential scans.
+
+    The queries are built by the views themselves (first page, sample posts, subrabbit
+    and user taken from the database), plus the vote lookups and aggregations and the
+    subrabbit name prefix match. A sequential scan is flagged when its table holds at
+    least --min-rows rows, as the planner rightly scans small tables. On a small
+    development database, --force-index disables sequential scans in PostgreSQL instead,
+    so that any scan left means no index can serve the query. Exits with an error if
+    any query is flagged, so it can run in CI against a seeded database.
+    """
+
+    help = 'EXPLAIN the list endpoint queries and flag sequential scans on large tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=10000,
+                            help='Flag sequential scans on tables with at least this many rows.')
+        parser.add_argument('--force-index', action='store_true',
+                            help='Disable sequential scans (PostgreSQL) and flag any that remain.')
+        parser.add_argument('--username',
+                            help='User whose feeds and votes are explained (default: creator of the largest subrabbit).')
+
+    def queries(self, username):
+        """Yield (label, queryset) for every query to explain."""
+
+        subrabbit = Subrabbit.objects.order_by('-member_count', '-id').first()
+        post = Post.objects.order_by('-comment_count', '-id').first()
+        if username:
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f'User "{username}" does not exist.')
+        else:
+            user = subrabbit.creator if subrabbit else None
+
+        for sort in ranking.SORT_ORDERINGS:
+            yield f'posts (sort={sort})', view_queryset(post_views.PostListView, params={'sort': sort})
+            if subrabbit:
+                yield (f'subrabbit posts (sort={sort})',
+                       view_queryset(post_views.PostListView, params={'sort': sort, 'subrabbitName': subrabbit.name}))
+            if user:
+                yield f'home feed (sort={sort})', view_queryset(post_views.PostListView, user, {'sort': sort})
+        yield 'post search', view_queryset(post_views.PostSearchView, params={'q': post.title if post else 'rabbit'})
+
+        if post:
+            for sort in ranking.COMMENT_SORT_ORDERINGS:
+                yield (f'comments (sort={sort})',
+                       view_queryset(post_views.CommentListView, params={'sort': sort}, post_id=post.id))
+            yield 'post vote counts', Vote.objects.filter(post=post).values('type').annotate(total=Count('id'))
+            comment = post.comments.order_by('-id').first()
+            if comment:
+                yield ('comment vote counts',
+                       CommentVote.objects.filter(comment=comment).values('type').annotate(total=Count('id')))
+
+        yield 'subrabbits', view_queryset(subrabbit_views.SubrabbitListCreateView)
+        if subrabbit:
+            yield 'subrabbit members', view_queryset(subrabbit_views.SubrabbitMembersView, name=subrabbit.name)
+            yield 'subrabbit moderators', view_queryset(subrabbit_views.SubrabbitModeratorsView, name=subrabbit.name)
+            yield 'subrabbit name prefix', Subrabbit.objects.filter(name__istartswith=subrabbit.name[:2])
+
+        if user and post:
+            post_ids = list(Post.objects.order_by('-hot_score', '-id').values_list('id', flat=True)[:10])
+            yield 'viewer post votes', Vote.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', 'type')
+            comment_ids = list(post.comments.values_list('id', flat=True)[:10])
+            if comment_ids:
+                yield ('viewer comment votes',
+                       CommentVote.objects.filter(user=user, comment_id__in=comment_ids).values_list('comment_id', 'type'))
+
+    def handle(self, *args, min_rows, force_index, username, **options):
+        if force_index and connection.vendor != 'postgresql':
+            raise CommandError('--force-index needs PostgreSQL.')
+
+        tables = set(connection.introspection.table_names())
+        rows = {}
+        flagged = 0
+        with transaction.atomic():
+            if force_index:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for label, queryset in self.queries(username):
+                plan = queryset.explain()
+                scanned = {next(filter(None, match.groups())) for match in SEQ_SCAN_RE.finditer(plan)} & tables
+                for table in scanned:
+                    if table not in rows:
+                        rows[table] = table_rows(table)
+                large = sorted(table for table in scanned if force_index or rows[table] >= min_rows)
+
+                if large:
+                    flagged += 1
+                    scans = ', '.join(f'{table} (~{rows[table]} rows)' for table in large)
+                    self.stdout.write(self.style.WARNING(f'SEQ SCAN  {label}: {scans}'))
+                else:
+                    self.stdout.write(f'ok        {label}')
+                if options['verbosity'] > 1:
+                    self.stdout.write(plan + '\n')
+
+        if flagged:
+            raise CommandError(f'{flagged} queries scan large tables sequentially.')
+        self.stdout.write(self.style.SUCCESS('No sequential scans on large tables.'))
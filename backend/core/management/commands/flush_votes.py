@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import vote_buffer
+
+
+class Command(BaseCommand):
+    """
+    Write the post votes buffered by the write-behind mode to the database.
+
+    Workers flush the buffer themselves every `VOTE_FLUSH_INTERVAL` seconds. Run this
+    command to drain it on demand, e.g. before a deploy, or with --interval as a
+    dedicated flusher process. It only reaches the buffer when it is kept in Redis.
+    """
+
+    help = 'Write buffered post votes to the database (repeatedly with --interval).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, flushing every this many seconds.')
+
+    def handle(self, *args, interval, **options):
+        while True:
+            written = vote_buffer.flush()
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} buffered vote(s).'))
+            if interval is None:
+                break
+            time.sleep(interval)
+            close_old_connections()
@@ -0,0 +1,132 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+
+from core import comment_tree, ranking
+from core.models import Comment, CommentVote, Post, Subrabbit, Vote, VoteType
+
+
+def _count_subquery(model, related_field, **filters):
+    """Build a correlated COUNT(*) subquery over `model` rows pointing at the outer row."""
+
+    rows = model.objects.filter(**{related_field: OuterRef('pk')}, **filters) \
+                        .order_by() \
+                        .values(related_field) \
+                        .annotate(total=Count('pk')) \
+                        .values('total')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+def _descendant_count_subquery():
+    """
+    Build a correlated COUNT(*) subquery over the comments below the outer comment.
+
+    The subtree is matched as the range of paths between `<path>/` and `<path>0` (the
+    character after the separator), which the (parent_post, path) index serves.
+    """
+
+    path = OuterRef('path')
+    rows = Comment.objects.filter(
+        parent_post=OuterRef('parent_post'),
+        path__gt=Concat(path, Value(comment_tree.SEPARATOR)),
+        path__lt=Concat(path, Value(chr(ord(comment_tree.SEPARATOR) + 1))),
+    ).order_by().values('parent_post').annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    """
+    Recompute the denormalized vote and comment counters on posts, the vote counters,
+    ranking scores and descendant counts of comments, and the member counts of subrabbits.
+
+    The counters are kept up to date by the write paths in `core.votes`; this command
+    repairs drift caused by rows removed outside of those paths (cascading deletes,
+    admin edits, manual SQL). Only rows whose counters differ are written.
+    """
+
+    help = ('Recompute Post.upvotes, Post.downvotes, Post.score, Post.comment_count, the '
+            'comment vote counters, Comment.descendant_count and Subrabbit.member_count from '
+            'the source rows.')
+    post_fields = ['upvotes', 'downvotes', 'score', 'comment_count']
+    comment_fields = ['upvotes', 'downvotes', 'score', 'best_score', 'controversy', 'descendant_count']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows to rewrite per UPDATE batch.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted rows without writing.')
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        actual = Post.objects.annotate(
+            actual_upvotes=_count_subquery(Vote, 'post', type=VoteType.UP),
+            actual_downvotes=_count_subquery(Vote, 'post', type=VoteType.DOWN),
+            actual_comments=_count_subquery(Comment, 'parent_post'),
+        )
+        drifted = actual.exclude(
+            Q(upvotes=F('actual_upvotes'))
+            & Q(downvotes=F('actual_downvotes'))
+            & Q(score=F('actual_upvotes') - F('actual_downvotes'))
+            & Q(comment_count=F('actual_comments'))
+        ).only('id', *self.post_fields)
+
+        fixed = []
+        total = 0
+        for post in drifted.iterator(chunk_size=batch_size):
+            post.upvotes = post.actual_upvotes
+            post.downvotes = post.actual_downvotes
+            post.score = post.actual_upvotes - post.actual_downvotes
+            post.comment_count = post.actual_comments
+            fixed.append(post)
+            if len(fixed) >= batch_size:
+                total += self._write(Post, fixed, self.post_fields, dry_run)
+                fixed = []
+        total += self._write(Post, fixed, self.post_fields, dry_run)
+
+        verb = 'Would repair' if dry_run else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} counters on {total} post(s).'))
+
+        actual = Comment.objects.annotate(
+            actual_upvotes=_count_subquery(CommentVote, 'comment', type=VoteType.UP),
+            actual_downvotes=_count_subquery(CommentVote, 'comment', type=VoteType.DOWN),
+            actual_descendants=_descendant_count_subquery(),
+        )
+        drifted = actual.exclude(
+            Q(upvotes=F('actual_upvotes'))
+            & Q(downvotes=F('actual_downvotes'))
+            & Q(score=F('actual_upvotes') - F('actual_downvotes'))
+            & Q(descendant_count=F('actual_descendants'))
+        ).only('id', *self.comment_fields)
+
+        fixed = []
+        total = 0
+        for comment in drifted.iterator(chunk_size=batch_size):
+            comment.upvotes = comment.actual_upvotes
+            comment.downvotes = comment.actual_downvotes
+            comment.score = comment.actual_upvotes - comment.actual_downvotes
+            comment.best_score = ranking.best(comment.upvotes, comment.downvotes)
+            comment.controversy = ranking.controversy(comment.upvotes, comment.downvotes)
+            comment.descendant_count = comment.actual_descendants
+            fixed.append(comment)
+            if len(fixed) >= batch_size:
+                total += self._write(Comment, fixed, self.comment_fields, dry_run)
+                fixed = []
+        total += self._write(Comment, fixed, self.comment_fields, dry_run)
+
+        self.stdout.write(self.style.SUCCESS(f'{verb} counters on {total} comment(s).'))
+
+        drifted = Subrabbit.objects.annotate(
+            actual_members=_count_subquery(Subrabbit.subscribers.through, 'subrabbit'),
+        ).exclude(member_count=F('actual_members')).only('id', 'member_count')
+
+        fixed = []
+        for subrabbit in drifted.iterator(chunk_size=batch_size):
+            subrabbit.member_count = subrabbit.actual_members
+            fixed.append(subrabbit)
+        total = self._write(Subrabbit, fixed, ['member_count'], dry_run)
+
+        self.stdout.write(self.style.SUCCESS(f'{verb} member counts on {total} subrabbit(s).'))
+
+    def _write(self, model, rows, fields, dry_run):
+        if rows and not dry_run:
+            model.objects.bulk_update(rows, fields)
+        return len(rows)
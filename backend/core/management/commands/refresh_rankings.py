@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from core import ranking
+from core.models import Post
+
+
+class Command(BaseCommand):
+    """
+    Refresh the stored ranking scores of posts.
+
+    Votes refresh the scores of the post they touch, but the rising score also decays
+    with age alone. Run this command periodically (e.g. every few minutes from cron)
+    to age posts through the rising window and drop expired ones from the rising feed.
+    Pass --all to also recompute hot scores, e.g. after changing the hot formula.
+    """
+
+    help = 'Recompute rising scores of recent posts (and hot scores of all posts with --all).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all_posts',
+                            help='Recompute hot and rising scores of every post.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of posts to rewrite per UPDATE batch.')
+
+    def handle(self, *args, all_posts, batch_size, **options):
+        now = timezone.now()
+        posts = Post.objects.only('id', 'score', 'created_at', 'hot_score', 'rising_score')
+        if not all_posts:
+            # Posts inside the window, plus expired posts that still carry a rising score
+            posts = posts.filter(Q(created_at__gte=now - ranking.RISING_WINDOW) | Q(rising_score__gt=0))
+
+        fields = ['hot_score', 'rising_score'] if all_posts else ['rising_score']
+        changed = []
+        total = 0
+        for post in posts.iterator(chunk_size=batch_size):
+            hot_score = ranking.hot(post.score, post.created_at) if all_posts else post.hot_score
+            rising_score = ranking.rising(post.score, post.created_at, now)
+            if hot_score == post.hot_score and rising_score == post.rising_score:
+                continue
+            post.hot_score = hot_score
+            post.rising_score = rising_score
+            changed.append(post)
+            if len(changed) >= batch_size:
+                Post.objects.bulk_update(changed, fields)
+                total += len(changed)
+                changed = []
+        if changed:
+            Post.objects.bulk_update(changed, fields)
+            total += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed rankings of {total} post(s).'))
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from core import file_uploads, uploads
+from core.models import ChunkedUpload, Upload, UploadStatus
+
+
+class Command(BaseCommand):
+    """
+    Store uploads that the background workers did not finish.
+
+    Workers run inside the web processes, so uploads queued when a process stops are
+    left pending (or storing, if the push was interrupted), and uploads whose attempts
+    all failed are left failed, with their staged file still served. Run this command
+    periodically (e.g. every few minutes from cron) to push them again.
+
+    Chunked file uploads left idle for `CHUNKED_UPLOAD_EXPIRY` seconds are discarded
+    along with their partial files.
+    """
+
+    help = 'Push stale pending and failed uploads to the storage backend, and discard abandoned chunked uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=300,
+                            help='Only retry uploads not updated for this many seconds.')
+
+    def handle(self, *args, older_than, **options):
+        stale = timezone.now() - timedelta(seconds=older_than)
+        # Interrupted pushes are claimed again like pending uploads
+        Upload.objects.filter(status=UploadStatus.STORING, updated_at__lt=stale).update(
+            status=UploadStatus.PENDING)
+
+        done = failed = 0
+        pending = Upload.objects.filter(
+            Q(status=UploadStatus.PENDING) | Q(status=UploadStatus.FAILED), updated_at__lt=stale,
+        ).values_list('id', flat=True)
+        for upload_id in list(pending):
+            upload = uploads.process(upload_id)
+            if upload is None:
+                continue
+            if upload.status == UploadStatus.DONE:
+                done += 1
+            else:
+                failed += 1
+
+        expired = 0
+        idle = timezone.now() - timedelta(seconds=file_uploads.CHUNKED_UPLOAD_EXPIRY)
+        for upload in ChunkedUpload.objects.filter(updated_at__lt=idle).iterator():
+            file_uploads.discard(upload)
+            expired += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {done} upload(s), {failed} still failing; discarded {expired} abandoned chunked upload(s).'))
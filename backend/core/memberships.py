@@ -0,0 +1,138 @@
+"""
+Subrabbit memberships: write paths and cached per-user membership sets.
+
+Subscribing and unsubscribing go through this module so that `Subrabbit.member_count`
+stays in sync with the subscribers table: the counter only moves when a membership row
+is actually created or deleted, inside the same transaction. The feed cache and the
+home timeline of the user are updated on the same occasions.
+
+The ids of the subrabbits a user subscribes to and moderates are cached as one entry
+per user, so viewer-relative flags (`isSubscriber`, `isModerator`, `joined`) cost a set
+lookup. The entry is dropped after every subscription change and, through the
+`m2m_changed` signal, after any other change to subscribers or moderators (subrabbit
+creation, the admin).
+"""
+
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from core import autocomplete, feed_cache, timelines
+from core.models import Subrabbit
+
+MEMBERSHIP_CACHE_TTL = getattr(settings, 'MEMBERSHIP_CACHE_TTL', 60 * 60 * 24)
+
+Membership = Subrabbit.subscribers.through
+Moderatorship = Subrabbit.moderators.through
+
+
+class Memberships(NamedTuple):
+    subscribed: frozenset
+    moderated: frozenset
+
+
+NO_MEMBERSHIPS = Memberships(frozenset(), frozenset())
+
+
+def _cache_key(user_id):
+    return f'memberships:{user_id}'
+
+
+def for_user(user):
+    """
+    Return the ids of the subrabbits a user subscribes to and moderates.
+
+    The sets are read from the cache (loading them on a miss) and memoized on the
+    user object, so they are fetched at most once per request.
+
+    Returns:
+        Memberships: Empty sets for anonymous users.
+    """
+
+    if not user.is_authenticated:
+        return NO_MEMBERSHIPS
+    memo = getattr(user, '_memberships', None)
+    if memo is not None:
+        return memo
+
+    key = _cache_key(user.id)
+    cached = cache.get(key)
+    if cached is None:
+        cached = (
+            list(Membership.objects.filter(user_id=user.id).values_list('subrabbit_id', flat=True)),
+            list(Moderatorship.objects.filter(user_id=user.id).values_list('subrabbit_id', flat=True)),
+        )
+        cache.set(key, cached, MEMBERSHIP_CACHE_TTL)
+    user._memberships = Memberships(frozenset(cached[0]), frozenset(cached[1]))
+    return user._memberships
+
+
+def forget(*user_ids):
+    """Drop the cached membership sets of users once the current transaction commits."""
+
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def memberships_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """`m2m_changed` receiver dropping the cached sets of the users whose memberships changed."""
+
+    if reverse:
+        # The relation was changed from the user's side
+        user_ids = [instance.pk] if action.startswith('post_') else []
+    elif action == 'pre_clear':
+        # pk_set is not provided on clear, so collect the users before they are removed
+        user_ids = list(sender.objects.filter(subrabbit_id=instance.pk).values_list('user_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        user_ids = pk_set or []
+    else:
+        user_ids = []
+    if user_ids:
+        forget(*user_ids)
+
+
+def subscribe(user, subrabbit):
+    """
+    Add a user to the subscribers of a subrabbit.
+
+    Returns:
+        bool: True if the user was not subscribed before.
+    """
+
+    with transaction.atomic():
+        _, created = Membership.objects.get_or_create(subrabbit_id=subrabbit.id, user_id=user.id)
+        if created:
+            Subrabbit.objects.filter(id=subrabbit.id).update(member_count=F('member_count') + 1)
+            feed_cache.subscriptions_changed(user.id)
+            autocomplete.members_changed(subrabbit.id, 1)
+            forget(user.id)
+            user._memberships = None
+
+    if created and timelines.enabled():
+        timelines.subscribed(user.id, subrabbit.id)
+    return created
+
+
+def unsubscribe(user, subrabbit):
+    """
+    Remove a user from the subscribers of a subrabbit.
+
+    Returns:
+        bool: True if the user was subscribed before.
+    """
+
+    with transaction.atomic():
+        deleted, _ = Membership.objects.filter(subrabbit_id=subrabbit.id, user_id=user.id).delete()
+        if deleted:
+            Subrabbit.objects.filter(id=subrabbit.id).update(member_count=F('member_count') - 1)
+            feed_cache.subscriptions_changed(user.id)
+            autocomplete.members_changed(subrabbit.id, -1)
+            forget(user.id)
+            user._memberships = None
+
+    if deleted and timelines.enabled():
+        timelines.unsubscribed(user.id, subrabbit.id)
+    return bool(deleted)
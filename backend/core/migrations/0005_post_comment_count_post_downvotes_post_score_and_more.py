@@ -0,0 +1,57 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Vote = apps.get_model('core', 'Vote')
+    Comment = apps.get_model('core', 'Comment')
+
+    counters = {}
+    for row in Vote.objects.values('post_id', 'type').annotate(total=Count('id')).order_by():
+        entry = counters.setdefault(row['post_id'], {'UP': 0, 'DOWN': 0, 'comments': 0})
+        entry[row['type']] = row['total']
+    for row in Comment.objects.values('parent_post_id').annotate(total=Count('id')).order_by():
+        entry = counters.setdefault(row['parent_post_id'], {'UP': 0, 'DOWN': 0, 'comments': 0})
+        entry['comments'] = row['total']
+
+    for post_id, entry in counters.items():
+        Post.objects.filter(id=post_id).update(
+            upvotes=entry['UP'],
+            downvotes=entry['DOWN'],
+            score=entry['UP'] - entry['DOWN'],
+            comment_count=entry['comments'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_remove_comment_parent_comment_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='downvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='upvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:21
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# The ranking functions of core.ranking when the scores were introduced
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+HOT_TIMESCALE = 45000
+RISING_WINDOW = timedelta(hours=24)
+
+
+def hot(score, created_at):
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    seconds = (created_at - EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_TIMESCALE, 7)
+
+
+def rising(score, created_at, now=None):
+    now = now or timezone.now()
+    age = now - created_at
+    if age > RISING_WINDOW or score <= 0:
+        return 0.0
+    hours = max(age.total_seconds() / 3600, 0) + 2
+    return round(score / hours ** 1.5, 7)
+
+
+def backfill_rankings(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    now = timezone.now()
+    posts = list(Post.objects.only('id', 'score', 'created_at'))
+    for post in posts:
+        post.hot_score = hot(post.score, post.created_at)
+        post.rising_score = rising(post.score, post.created_at, now)
+    Post.objects.bulk_update(posts, ['hot_score', 'rising_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_post_comment_count_post_downvotes_post_score_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rising_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='post_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-score', '-created_at', '-id'], name='post_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-rising_score', '-id'], name='post_rising_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['subrabbit', '-hot_score', '-id'], name='post_sub_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['subrabbit', '-created_at', '-id'], name='post_sub_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['subrabbit', '-score', '-created_at', '-id'], name='post_sub_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['subrabbit', '-rising_score', '-id'], name='post_sub_rising_idx'),
+        ),
+        migrations.RunPython(backfill_rankings, migrations.RunPython.noop),
+    ]
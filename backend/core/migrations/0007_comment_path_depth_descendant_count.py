@@ -0,0 +1,93 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:28
+
+import string
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Copies of the path helpers of core.comment_tree as of this migration, so that it keeps
+# writing the same paths whatever becomes of the app code
+SEGMENT_WIDTH = 8
+SEPARATOR = '/'
+_DIGITS = string.digits + string.ascii_lowercase
+
+
+def encode_segment(comment_id):
+    digits = ''
+    while comment_id:
+        comment_id, remainder = divmod(comment_id, 36)
+        digits = _DIGITS[remainder] + digits
+    return digits.rjust(SEGMENT_WIDTH, '0')
+
+
+def path_for(comment_id, parent_path=''):
+    segment = encode_segment(comment_id)
+    return f'{parent_path}{SEPARATOR}{segment}' if parent_path else segment
+
+
+def ancestor_ids(path):
+    return [int(segment, 36) for segment in path.split(SEPARATOR)[:-1]]
+
+
+def backfill_paths(apps, schema_editor):
+    Comment = apps.get_model('core', 'Comment')
+
+    parents = dict(Comment.objects.values_list('id', 'parent_comment_id'))
+    paths = {}
+
+    def resolve(comment_id):
+        # Walk up to the first ancestor with a known path, then fill the paths back down.
+        # Replies to deleted comments become top-level comments.
+        chain = []
+        current = comment_id
+        while current in parents and current not in paths and current not in chain:
+            chain.append(current)
+            current = parents[current]
+        parent_path = paths.get(current, '')
+        for chained_id in reversed(chain):
+            parent_path = paths[chained_id] = path_for(chained_id, parent_path)
+        return paths[comment_id]
+
+    descendants = dict.fromkeys(parents, 0)
+    for comment_id in parents:
+        for ancestor_id in ancestor_ids(resolve(comment_id)):
+            descendants[ancestor_id] += 1
+
+    comments = []
+    for comment in Comment.objects.only('id').iterator():
+        comment.path = paths[comment.id]
+        comment.depth = comment.path.count(SEPARATOR)
+        comment.descendant_count = descendants[comment.id]
+        comments.append(comment)
+    Comment.objects.bulk_update(comments, ['path', 'depth', 'descendant_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_post_hot_score_post_rising_score_and_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='descendant_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=1000),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_post', 'path'], name='comment_post_path_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
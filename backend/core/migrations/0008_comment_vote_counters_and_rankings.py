@@ -0,0 +1,103 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:31
+
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+# The comment ranking functions of core.ranking when the counters were introduced
+WILSON_Z = 1.281551565545
+
+
+def best(upvotes, downvotes):
+    total = upvotes + downvotes
+    if total <= 0:
+        return 0.0
+    z2 = WILSON_Z * WILSON_Z
+    ratio = upvotes / total
+    centre = ratio + z2 / (2 * total)
+    spread = WILSON_Z * math.sqrt((ratio * (1 - ratio) + z2 / (4 * total)) / total)
+    return round((centre - spread) / (1 + z2 / total), 7)
+
+
+def controversy(upvotes, downvotes):
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    balance = min(upvotes, downvotes) / max(upvotes, downvotes)
+    return round((upvotes + downvotes) ** balance, 7)
+
+
+def backfill_comment_counters(apps, schema_editor):
+    Comment = apps.get_model('core', 'Comment')
+    CommentVote = apps.get_model('core', 'CommentVote')
+
+    counters = {}
+    rows = CommentVote.objects.filter(comment__isnull=False) \
+                              .values('comment_id', 'type').annotate(total=Count('id')).order_by()
+    for row in rows:
+        entry = counters.setdefault(row['comment_id'], {'UP': 0, 'DOWN': 0})
+        entry[row['type']] = row['total']
+
+    for comment_id, entry in counters.items():
+        up, down = entry['UP'], entry['DOWN']
+        Comment.objects.filter(id=comment_id).update(
+            upvotes=up,
+            downvotes=down,
+            score=up - down,
+            best_score=best(up, down),
+            controversy=controversy(up, down),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_comment_path_depth_descendant_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='best_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='controversy',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='downvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='upvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_post', '-best_score', '-created_at', '-id'], name='comment_best_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_post', '-score', '-created_at', '-id'], name='comment_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_post', '-created_at', '-id'], name='comment_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_post', '-controversy', '-created_at', '-id'], name='comment_controversial_idx'),
+        ),
+        migrations.RunPython(backfill_comment_counters, migrations.RunPython.noop),
+    ]
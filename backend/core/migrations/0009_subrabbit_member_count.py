@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_member_counts(apps, schema_editor):
+    Subrabbit = apps.get_model('core', 'Subrabbit')
+    Membership = Subrabbit.subscribers.through
+
+    rows = Membership.objects.values('subrabbit_id').annotate(total=Count('id')).order_by()
+    for row in rows:
+        Subrabbit.objects.filter(id=row['subrabbit_id']).update(member_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_comment_vote_counters_and_rankings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subrabbit',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='subrabbit',
+            index=models.Index(fields=['-member_count', '-created_at', '-id'], name='subrabbit_members_idx'),
+        ),
+        migrations.RunPython(backfill_member_counts, migrations.RunPython.noop),
+    ]
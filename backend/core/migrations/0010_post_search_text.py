@@ -0,0 +1,104 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:36
+
+import html
+import json
+import re
+
+from django.db import migrations, models
+
+# Copy of core.search.extract_text as of this migration, so that it keeps backfilling the
+# same text whatever becomes of the app code
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _strip_html(text):
+    return html.unescape(_TAG_RE.sub(' ', text)) if isinstance(text, str) else ''
+
+
+def _list_items(items):
+    for item in items or []:
+        if isinstance(item, dict):
+            yield _strip_html(item.get('content') or item.get('text'))
+            yield from _list_items(item.get('items'))
+        else:
+            yield _strip_html(item)
+
+
+def extract_text(content):
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            return _strip_html(content)
+    if not isinstance(content, dict):
+        return ''
+
+    parts = []
+    for block in content.get('blocks') or []:
+        if not isinstance(block, dict):
+            continue
+        data = block.get('data') or {}
+        kind = block.get('type')
+        if kind in ('paragraph', 'header'):
+            parts.append(_strip_html(data.get('text')))
+        elif kind in ('list', 'checklist'):
+            parts.extend(_list_items(data.get('items')))
+        elif kind == 'table':
+            parts.extend(_strip_html(cell) for row in data.get('content') or [] for cell in row or [])
+        elif kind == 'code':
+            parts.append(data.get('code') or '')
+        elif kind == 'quote':
+            parts.extend((_strip_html(data.get('text')), _strip_html(data.get('caption'))))
+        elif kind in ('image', 'embed'):
+            parts.append(_strip_html(data.get('caption')))
+        elif kind == 'linkTool':
+            meta = data.get('meta') or {}
+            parts.extend((_strip_html(meta.get('title')), _strip_html(meta.get('description'))))
+    return '\n'.join(' '.join(part.split()) for part in parts if part and part.strip())
+
+
+def backfill_search_text(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+
+    posts = []
+    for post in Post.objects.only('id', 'content').iterator():
+        post.search_text = extract_text(post.content)
+        posts.append(post)
+    Post.objects.bulk_update(posts, ['search_text'], batch_size=500)
+
+
+def add_search_vector(apps, schema_editor):
+    # The tsvector column and its GIN index only exist on PostgreSQL; other databases
+    # are searched with the in-memory index of core.search.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("""
+        ALTER TABLE core_post ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(search_text, '')), 'B')
+        ) STORED
+    """)
+    schema_editor.execute('CREATE INDEX post_search_vector_idx ON core_post USING GIN (search_vector)')
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE core_post DROP COLUMN search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_subrabbit_member_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
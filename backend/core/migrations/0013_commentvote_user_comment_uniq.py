@@ -0,0 +1,71 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:51
+
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+# The comment ranking functions of core.ranking at the time of this migration
+WILSON_Z = 1.281551565545
+
+
+def best(upvotes, downvotes):
+    total = upvotes + downvotes
+    if total <= 0:
+        return 0.0
+    z2 = WILSON_Z * WILSON_Z
+    ratio = upvotes / total
+    centre = ratio + z2 / (2 * total)
+    spread = WILSON_Z * math.sqrt((ratio * (1 - ratio) + z2 / (4 * total)) / total)
+    return round((centre - spread) / (1 + z2 / total), 7)
+
+
+def controversy(upvotes, downvotes):
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    balance = min(upvotes, downvotes) / max(upvotes, downvotes)
+    return round((upvotes + downvotes) ** balance, 7)
+
+
+def remove_duplicate_comment_votes(apps, schema_editor):
+    """Keep only the latest vote of each user on a comment, and recount the comments concerned."""
+
+    Comment = apps.get_model('core', 'Comment')
+    CommentVote = apps.get_model('core', 'CommentVote')
+
+    duplicates = CommentVote.objects.filter(comment__isnull=False).values('user_id', 'comment_id') \
+                                    .annotate(total=Count('id'), latest=Max('id')).filter(total__gt=1).order_by()
+    comment_ids = set()
+    for row in duplicates:
+        CommentVote.objects.filter(user_id=row['user_id'], comment_id=row['comment_id']) \
+                           .exclude(id=row['latest']).delete()
+        comment_ids.add(row['comment_id'])
+
+    for comment_id in comment_ids:
+        votes = CommentVote.objects.filter(comment_id=comment_id)
+        up = votes.filter(type='UP').count()
+        down = votes.filter(type='DOWN').count()
+        Comment.objects.filter(id=comment_id).update(
+            upvotes=up,
+            downvotes=down,
+            score=up - down,
+            best_score=best(up, down),
+            controversy=controversy(up, down),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_chunked_uploads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_comment_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='commentvote',
+            constraint=models.UniqueConstraint(condition=models.Q(('comment__isnull', False)), fields=('user', 'comment'), name='commentvote_user_comment_uniq'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.2 on 2026-10-18 18:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def add_name_prefix_index(apps, schema_editor):
+    """
+    Index subrabbit names for case-insensitive prefix matching (`name__istartswith`), which
+    PostgreSQL runs as `UPPER(name::text) LIKE UPPER('prefix%')`. The pattern operator
+    class lets the index serve it in any collation; other databases have no equivalent.
+    """
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS subrabbit_name_prefix_idx '
+            'ON core_subrabbit (UPPER(name::text) text_pattern_ops)'
+        )
+
+
+def drop_name_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS subrabbit_name_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_commentvote_user_comment_uniq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_rising_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_sub_rising_idx',
+        ),
+        migrations.AddIndex(
+            model_name='commentvote',
+            index=models.Index(condition=models.Q(('comment__isnull', False)), fields=['comment', 'type'], name='commentvote_comment_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('rising_score__gt', 0)), fields=['-rising_score', '-id'], name='post_rising_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('rising_score__gt', 0)), fields=['subrabbit', '-rising_score', '-id'], name='post_sub_rising_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['post', 'type'], name='vote_post_type_idx'),
+        ),
+        migrations.AlterField(
+            model_name='commentvote',
+            name='comment',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='comment_votes', to='core.comment'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='post',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='core.post'),
+        ),
+        migrations.RunPython(add_name_prefix_index, drop_name_prefix_index),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from accounts.models import User
 from django_editorjs_fields import EditorJsJSONField
@@ -14,6 +16,13 @@ class Subrabbit(models.Model):
     rules = models.CharField(max_length=500, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized number of subscribers, maintained by core.memberships
+    member_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-member_count', '-created_at', '-id'], name='subrabbit_members_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -54,6 +63,32 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     subrabbit = models.ForeignKey(Subrabbit, related_name='posts', on_delete=models.CASCADE)
+    # Plain text of the EditorJS content, extracted on write for full-text search (see core.search)
+    search_text = models.TextField(blank=True, default='', editable=False)
+    # Denormalized counters, maintained by core.votes and repaired by `reconcile_counters`
+    upvotes = models.IntegerField(default=0)
+    downvotes = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    # Precomputed ranking scores, see core.ranking
+    hot_score = models.FloatField(default=0)
+    rising_score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+            models.Index(fields=['-created_at', '-id'], name='post_new_idx'),
+            models.Index(fields=['-score', '-created_at', '-id'], name='post_top_idx'),
+            # Rising only lists posts with a positive rising score, most of them have none
+            models.Index(fields=['-rising_score', '-id'], name='post_rising_idx',
+                         condition=models.Q(rising_score__gt=0)),
+            models.Index(fields=['subrabbit', '-hot_score', '-id'], name='post_sub_hot_idx'),
+            models.Index(fields=['subrabbit', '-created_at', '-id'], name='post_sub_new_idx'),
+            models.Index(fields=['subrabbit', '-score', '-created_at', '-id'], name='post_sub_top_idx'),
+            models.Index(fields=['subrabbit', '-rising_score', '-id'], name='post_sub_rising_idx',
+                         condition=models.Q(rising_score__gt=0)),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -63,11 +98,16 @@ class VoteType(models.TextChoices):
 
 class Vote(models.Model):
     user = models.ForeignKey(User, related_name='votes', on_delete=models.CASCADE)
-    post = models.ForeignKey(Post, related_name='votes', on_delete=models.CASCADE)
+    # Indexed by vote_post_type_idx
+    post = models.ForeignKey(Post, related_name='votes', on_delete=models.CASCADE, db_index=False)
     type = models.CharField(max_length=4, choices=VoteType.choices)
 
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            # Counting the votes of a post by type reads only this index
+            models.Index(fields=['post', 'type'], name='vote_post_type_idx'),
+        ]
 
 class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -76,6 +116,27 @@ class Comment(models.Model):
     parent_comment_id = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Materialized path of the comment in its thread, see core.comment_tree
+    path = models.CharField(max_length=1000, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    descendant_count = models.IntegerField(default=0)
+    # Denormalized vote counters and ranking scores, maintained by core.votes
+    upvotes = models.IntegerField(default=0)
+    downvotes = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+    best_score = models.FloatField(default=0)
+    controversy = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['parent_post', 'path'], name='comment_post_path_idx',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['parent_post', '-best_score', '-created_at', '-id'], name='comment_best_idx'),
+            models.Index(fields=['parent_post', '-score', '-created_at', '-id'], name='comment_top_idx'),
+            models.Index(fields=['parent_post', '-created_at', '-id'], name='comment_new_idx'),
+            models.Index(fields=['parent_post', '-controversy', '-created_at', '-id'],
+                         name='comment_controversial_idx'),
+        ]
 
     def __str__(self):
         return f"{self.author}'s comment on \"{self.parent_post}\""
@@ -84,9 +145,89 @@ class CommentVote(models.Model):
     user = models.ForeignKey(User, related_name='user_votes', on_delete=models.CASCADE)
     post = models.ForeignKey(Post, related_name='post_votes', null=True, 
                                                     blank=True, on_delete=models.CASCADE)
+    # Indexed by commentvote_comment_type_idx
     comment = models.ForeignKey(Comment, related_name='comment_votes', 
-                                        null=True, blank=True, on_delete=models.CASCADE)
+                                        null=True, blank=True, on_delete=models.CASCADE, db_index=False)
     type = models.CharField(max_length=4, choices=VoteType.choices)
 
     class Meta:
         unique_together = ('user', 'post', 'comment')
+        constraints = [
+            # Comment votes leave `post` null, which the unique_together above never matches
+            models.UniqueConstraint(fields=['user', 'comment'], condition=models.Q(comment__isnull=False),
+                                    name='commentvote_user_comment_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['comment', 'type'], name='commentvote_comment_type_idx',
+                         condition=models.Q(comment__isnull=False)),
+        ]
+
+class UploadKind(models.TextChoices):
+    IMAGE = 'image', 'Post image'
+    PROFILE_PICTURE = 'profile_picture', 'Profile picture'
+
+class UploadStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending'
+    STORING = 'storing', 'Storing'
+    DONE = 'done', 'Done'
+    FAILED = 'failed', 'Failed'
+
+class Upload(models.Model):
+    """An image staged on local disk until a worker pushes it to storage, see core.uploads."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='uploads', null=True, blank=True, on_delete=models.SET_NULL)
+    kind = models.CharField(max_length=20, choices=UploadKind.choices, default=UploadKind.IMAGE)
+    status = models.CharField(max_length=10, choices=UploadStatus.choices, default=UploadStatus.PENDING)
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField(default=0)
+    staged_path = models.CharField(max_length=500, blank=True)
+    # URL of the stored file, once done
+    url = models.CharField(max_length=500, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='upload_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+class FileBlob(models.Model):
+    """A stored attachment, unique by content, see core.file_uploads."""
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    # Name of the file in the default file system storage
+    path = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.path
+
+class ChunkedUpload(models.Model):
+    """An attachment being uploaded in chunks, see core.file_uploads."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='chunked_uploads', null=True, blank=True,
+                              on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    # Declared total size, if known
+    size = models.BigIntegerField(null=True, blank=True)
+    # Number of bytes received so far
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='chunked_upload_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.offset} bytes)'
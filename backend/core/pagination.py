@@ -0,0 +1,175 @@
+"""
+Keyset (cursor) pagination.
+
+`KeysetPagination` pages through a queryset by remembering the ordering values of the
+last row of the previous page, and asks the database for rows strictly after it:
+
+    WHERE (score < :s) OR (score = :s AND created_at < :c) OR (... AND id < :i)
+    ORDER BY score DESC, created_at DESC, id DESC
+    LIMIT page_size + 1
+
+This makes every page an index range scan of the same cost, with no OFFSET and no
+COUNT(*), and the cursor stays valid when rows are re-ranked between page loads.
+The ordering is read from the queryset itself, so the same class serves every sort
+mode as long as the ordering is total (ends with `id`) and the columns are not null.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(payload):
+    """Encode a JSON-serializable payload into an opaque, URL-safe cursor string."""
+
+    def default(value):
+        if isinstance(value, (datetime, date)):
+            # Keep full microsecond precision, which DjangoJSONEncoder truncates
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+    raw = json.dumps(payload, default=default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by `encode_cursor`. Raises NotFound if it is malformed."""
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the filter selecting rows that sort strictly after `position`.
+
+    Parameters:
+        ordering: Field names of a total ordering, prefixed with '-' when descending.
+        position: Values of these fields for the last row already returned.
+    """
+
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over the (total) ordering of the paginated queryset.
+
+    Attributes:
+        page_size: Default number of results per page.
+        page_size_query_param: Query parameter clients may use to pick a page size.
+        max_page_size: Upper bound for client-selected page sizes.
+        cursor_query_param: Query parameter that carries the opaque cursor.
+    """
+
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        size = self.get_page_size(request)
+
+        position = self.get_position(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        # Fetch one extra row to know whether there is a next page without counting
+        results = list(queryset[:size + 1])
+        self.page = results[:size]
+        self.has_next = len(results) > size
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """Return the ordering of the queryset, checking that it can be used as a keyset."""
+
+        ordering = tuple(queryset.query.order_by)
+        assert ordering and ordering[-1].lstrip('-') in ('id', 'pk'), (
+            f'{self.__class__.__name__} requires a queryset ordered by a total ordering '
+            f'ending with "id", got {ordering!r}.'
+        )
+        assert not any('__' in field for field in ordering), (
+            f'{self.__class__.__name__} only supports orderings on local fields and annotations.'
+        )
+        return ordering
+
+    def get_position(self, request, model):
+        """Decode the cursor of the request into ordering values, or None on the first page."""
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        values = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        try:
+            return [self.to_python(model, field.lstrip('-'), value)
+                    for field, value in zip(self.ordering, values)]
+        except DjangoValidationError:
+            raise NotFound('Invalid cursor')
+
+    @staticmethod
+    def to_python(model, name, value):
+        try:
+            field = model._meta.get_field('id' if name == 'pk' else name)
+        except FieldDoesNotExist:
+            # Annotations are compared as plain JSON scalars
+            return value
+        return field.to_python(value)
+
+    def after(self, position):
+        """Build the filter selecting rows that sort strictly after `position`."""
+
+        return keyset_filter(self.ordering, position)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip('-')) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(values))
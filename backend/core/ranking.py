@@ -0,0 +1,166 @@
+"""
+Ranking functions for the post feed.
+
+Scores are computed in Python when a post changes and stored on the row, so every
+sort mode of `/api/posts/` is served by an index instead of an expression evaluated
+at query time.
+
+- hot: log-scaled net score plus a creation-time term. A post needs ten times the
+  votes to outrank a post created `HOT_TIMESCALE` seconds later, so old posts sink
+  without the stored value ever having to be rewritten.
+- rising: vote velocity over the first `RISING_WINDOW`. It does depend on the
+  current time and is refreshed periodically by `refresh_rankings`.
+
+Comments are ranked the same way, from their stored vote counters:
+
+- best: lower bound of the Wilson score interval of the upvote ratio, so a comment
+  with few votes does not outrank a comment with many slightly less positive ones.
+- controversial: many votes, split close to evenly.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+HOT_TIMESCALE = 45000
+RISING_WINDOW = timedelta(hours=24)
+
+# Orderings used by PostListView for each `sort` query parameter.
+# The trailing `-id` makes every ordering total, so pages never overlap on ties.
+SORT_ORDERINGS = {
+    'hot': ('-hot_score', '-id'),
+    'new': ('-created_at', '-id'),
+    'top': ('-score', '-created_at', '-id'),
+    'rising': ('-rising_score', '-id'),
+}
+DEFAULT_SORT = 'hot'
+
+# Orderings used by the comment listings for each `sort` query parameter.
+COMMENT_SORT_ORDERINGS = {
+    'best': ('-best_score', '-created_at', '-id'),
+    'top': ('-score', '-created_at', '-id'),
+    'new': ('-created_at', '-id'),
+    'controversial': ('-controversy', '-created_at', '-id'),
+}
+DEFAULT_COMMENT_SORT = 'best'
+
+# z-score of the confidence level used by `best` (80%)
+WILSON_Z = 1.281551565545
+
+
+def hot(score, created_at):
+    """
+    Compute the hot score of a post.
+
+    Parameters:
+        score: Net votes of the post.
+        created_at: Creation time of the post.
+
+    Returns:
+        float: The hot score.
+    """
+
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    seconds = (created_at - EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_TIMESCALE, 7)
+
+
+def rising(score, created_at, now=None):
+    """
+    Compute the rising score of a post: net votes per hour of age.
+
+    Posts older than `RISING_WINDOW` get a score of 0 and drop out of the rising feed.
+    """
+
+    now = now or timezone.now()
+    age = now - created_at
+    if age > RISING_WINDOW or score <= 0:
+        return 0.0
+    hours = max(age.total_seconds() / 3600, 0) + 2
+    return round(score / hours ** 1.5, 7)
+
+
+def best(upvotes, downvotes):
+    """
+    Compute the best score of a comment: the lower bound of the Wilson score
+    confidence interval for its upvote ratio.
+
+    Parameters:
+        upvotes: Number of upvotes of the comment.
+        downvotes: Number of downvotes of the comment.
+
+    Returns:
+        float: The best score, between 0 and 1.
+    """
+
+    total = upvotes + downvotes
+    if total <= 0:
+        return 0.0
+    z2 = WILSON_Z * WILSON_Z
+    ratio = upvotes / total
+    centre = ratio + z2 / (2 * total)
+    spread = WILSON_Z * math.sqrt((ratio * (1 - ratio) + z2 / (4 * total)) / total)
+    return round((centre - spread) / (1 + z2 / total), 7)
+
+
+def controversy(upvotes, downvotes):
+    """
+    Compute the controversy score of a comment: its vote count, weighted by how
+    evenly the votes are split. One-sided comments score 0.
+    """
+
+    if upvotes <= 0 or downvotes <= 0:
+        return 0.0
+    balance = min(upvotes, downvotes) / max(upvotes, downvotes)
+    return round((upvotes + downvotes) ** balance, 7)
+
+
+# PostgreSQL expressions computing the same scores, for statements that update the counters
+# and the scores together (see `core.votes`). Their arguments are SQL expressions.
+
+def _operands(*expressions):
+    return [f'({expression})' for expression in expressions]
+
+
+def hot_sql(score, created_at):
+    """SQL counterpart of `hot`."""
+
+    score, created_at = _operands(score, created_at)
+    seconds = f"extract(epoch FROM {created_at} - '{EPOCH.isoformat()}'::timestamptz)::float8"
+    order = f"log(greatest(abs({score}), 1)::float8)"
+    return f"round((sign({score}::float8) * {order} + {seconds} / {HOT_TIMESCALE})::numeric, 7)::float8"
+
+
+def rising_sql(score, created_at):
+    """SQL counterpart of `rising`, at the time of the transaction (`now()`)."""
+
+    score, created_at = _operands(score, created_at)
+    hours = f"greatest(extract(epoch FROM now() - {created_at})::float8, 0) / 3600 + 2"
+    return (f"CASE WHEN now() - {created_at} > interval '{RISING_WINDOW.total_seconds():.0f} seconds' "
+            f"OR {score} <= 0 THEN 0::float8 "
+            f"ELSE round(({score} / power({hours}, 1.5))::numeric, 7)::float8 END")
+
+
+def best_sql(upvotes, downvotes):
+    """SQL counterpart of `best`."""
+
+    upvotes, downvotes = _operands(upvotes, downvotes)
+    z2 = WILSON_Z * WILSON_Z
+    total = f"({upvotes} + {downvotes})::float8"
+    ratio = f"({upvotes} / {total})"
+    centre = f"{ratio} + {z2 / 2} / {total}"
+    spread = f"{WILSON_Z} * sqrt(({ratio} * (1 - {ratio}) + {z2 / 4} / {total}) / {total})"
+    return (f"CASE WHEN {upvotes} + {downvotes} <= 0 THEN 0::float8 "
+            f"ELSE round((({centre} - {spread}) / (1 + {z2} / {total}))::numeric, 7)::float8 END")
+
+
+def controversy_sql(upvotes, downvotes):
+    """SQL counterpart of `controversy`."""
+
+    upvotes, downvotes = _operands(upvotes, downvotes)
+    balance = f"least({upvotes}, {downvotes})::float8 / greatest({upvotes}, {downvotes})"
+    return (f"CASE WHEN {upvotes} <= 0 OR {downvotes} <= 0 THEN 0::float8 "
+            f"ELSE round(power(({upvotes} + {downvotes})::float8, {balance})::numeric, 7)::float8 END")
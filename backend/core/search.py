@@ -0,0 +1,285 @@
+"""
+Full-text search over posts.
+
+The plain text of a post is extracted from its EditorJS blocks when the post is written
+and stored in `Post.search_text`. Two backends rank the matches:
+
+- PostgreSQL: a stored, generated `search_vector` column (title weighted above the body)
+  with a GIN index, created by migration 0010. Queries use `websearch_to_tsquery` and
+  are ranked with `ts_rank_cd`.
+- Any other database (SQLite in tests and local development): an in-memory inverted
+  index scored with BM25. Each process builds it lazily from `search_text` and keeps it
+  up to date with its own writes; writes from other processes bump a version counter
+  in the cache, which makes every other process rebuild its index on the next search.
+  Scores are passed to the database in the query, so only the best
+  `SEARCH_MAX_RESULTS` matches are returned.
+
+Both backends return a queryset annotated with `rank` and ordered by `('-rank', '-id')`,
+so results can be filtered further and paginated with `KeysetPagination`.
+"""
+
+import heapq
+import html
+import json
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import BooleanField, Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+from core.models import Post
+
+SEARCH_CONFIG = 'english'
+# Relative weight of a title occurrence over a body occurrence (in-memory backend)
+TITLE_WEIGHT = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Matches ranked by the in-memory backend, each one a parameter of the query
+SEARCH_MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+VERSION_KEY = 'search:version'
+
+# Values of the `t` filter of the search endpoint
+TIME_WINDOWS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+    'month': timedelta(days=30),
+    'year': timedelta(days=365),
+    'all': None,
+}
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have in is it its of on or that the this to '
+    'was were will with'.split()
+)
+
+
+def _strip_html(text):
+    return html.unescape(_TAG_RE.sub(' ', text)) if isinstance(text, str) else ''
+
+
+def _list_items(items):
+    """Yield the text of EditorJS list items, which are strings or nested item objects."""
+
+    for item in items or []:
+        if isinstance(item, dict):
+            yield _strip_html(item.get('content') or item.get('text'))
+            yield from _list_items(item.get('items'))
+        else:
+            yield _strip_html(item)
+
+
+def extract_text(content):
+    """
+    Extract the searchable plain text of EditorJS content.
+
+    Parameters:
+        content: The EditorJS output (dict with `blocks`, or its JSON encoding).
+
+    Returns:
+        str: The text of headers, paragraphs, lists, tables, quotes, code and captions,
+        one block per line.
+    """
+
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            return _strip_html(content)
+    if not isinstance(content, dict):
+        return ''
+
+    parts = []
+    for block in content.get('blocks') or []:
+        if not isinstance(block, dict):
+            continue
+        data = block.get('data') or {}
+        kind = block.get('type')
+        if kind in ('paragraph', 'header'):
+            parts.append(_strip_html(data.get('text')))
+        elif kind in ('list', 'checklist'):
+            parts.extend(_list_items(data.get('items')))
+        elif kind == 'table':
+            parts.extend(_strip_html(cell) for row in data.get('content') or [] for cell in row or [])
+        elif kind == 'code':
+            parts.append(data.get('code') or '')
+        elif kind == 'quote':
+            parts.extend((_strip_html(data.get('text')), _strip_html(data.get('caption'))))
+        elif kind in ('image', 'embed'):
+            parts.append(_strip_html(data.get('caption')))
+        elif kind == 'linkTool':
+            meta = data.get('meta') or {}
+            parts.extend((_strip_html(meta.get('title')), _strip_html(meta.get('description'))))
+    return '\n'.join(' '.join(part.split()) for part in parts if part and part.strip())
+
+
+def tokenize(text):
+    """Split text into lowercase terms, dropping stopwords."""
+
+    return [token for token in _TOKEN_RE.findall((text or '').lower()) if token not in STOPWORDS]
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index of post titles and texts, scored with BM25.
+
+    Attributes:
+        postings: Term to {post id: weighted term frequency}.
+        lengths: Post id to weighted document length.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.terms = {}
+        self.total_length = 0
+
+    def add(self, post_id, title, text):
+        self.remove(post_id)
+        frequencies = Counter(tokenize(text))
+        for term in tokenize(title):
+            frequencies[term] += TITLE_WEIGHT
+        for term, frequency in frequencies.items():
+            self.postings[term][post_id] = frequency
+        self.terms[post_id] = list(frequencies)
+        self.lengths[post_id] = sum(frequencies.values())
+        self.total_length += self.lengths[post_id]
+
+    def remove(self, post_id):
+        for term in self.terms.pop(post_id, []):
+            postings = self.postings[term]
+            postings.pop(post_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(post_id, 0)
+
+    def search(self, query):
+        """
+        Return {post id: score} for the posts containing every term of the query.
+        """
+
+        terms = set(tokenize(query))
+        if not terms or not self.lengths:
+            return {}
+        postings = sorted((self.postings.get(term, {}) for term in terms), key=len)
+        matches = set(postings[0]).intersection(*postings[1:])
+
+        documents = len(self.lengths)
+        average = self.total_length / documents or 1
+        scores = {}
+        for post_id in matches:
+            length = self.lengths[post_id]
+            score = 0.0
+            for posting in postings:
+                frequency = posting[post_id]
+                idf = math.log(1 + (documents - len(posting) + 0.5) / (len(posting) + 0.5))
+                norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+                score += idf * frequency * (BM25_K1 + 1) / norm
+            scores[post_id] = round(score, 6)
+        return scores
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def get_index():
+    """Return this process's inverted index, (re)building it if another process wrote posts."""
+
+    global _index, _index_version
+    version = _current_version()
+    with _index_lock:
+        if _index is None or _index_version != version:
+            index = InvertedIndex()
+            for post_id, title, text in Post.objects.values_list('id', 'title', 'search_text').iterator():
+                index.add(post_id, title, text)
+            _index, _index_version = index, version
+        return _index
+
+
+def _bump_version(update):
+    """Apply `update` to the local index and publish a new index version to other processes."""
+
+    global _index_version
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+        version = 1
+    with _index_lock:
+        if _index is not None and _index_version == version - 1:
+            update(_index)
+            _index_version = version
+
+
+def post_saved(post):
+    """Keep the in-memory index in sync with a created or updated post, once committed."""
+
+    if uses_postgres():
+        # The generated search_vector column follows the row
+        return
+    post_id, title, text = post.id, post.title, post.search_text
+    transaction.on_commit(lambda: _bump_version(lambda index: index.add(post_id, title, text)))
+
+
+def post_deleted(post_id):
+    """Drop a deleted post from the in-memory index, once committed."""
+
+    if uses_postgres():
+        return
+    transaction.on_commit(lambda: _bump_version(lambda index: index.remove(post_id)))
+
+
+def search_posts(queryset, query):
+    """
+    Restrict a post queryset to the posts matching `query` and rank them.
+
+    Parameters:
+        queryset: The posts to search, possibly already filtered.
+        query: The user's search query (web search syntax on PostgreSQL).
+
+    Returns:
+        QuerySet: Matching posts annotated with `rank`, ordered by `('-rank', '-id')`.
+    """
+
+    if uses_postgres():
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        table = Post._meta.db_table
+        matches = RawSQL(f'"{table}"."search_vector" @@ {tsquery}', (query,), output_field=BooleanField())
+        # ts_rank_cd returns a real: compare it as a double precision, like the cursor value
+        # read back from Python, or rows tied with the cursor would be skipped or repeated
+        rank = RawSQL(f'ts_rank_cd("{table}"."search_vector", {tsquery})', (query,), output_field=FloatField())
+        return queryset.filter(matches).annotate(rank=Cast(rank, FloatField())).order_by('-rank', '-id')
+
+    scores = get_index().search(query)
+    if not scores:
+        return queryset.none().annotate(rank=Value(0.0, output_field=FloatField())).order_by('-rank', '-id')
+    if len(scores) > SEARCH_MAX_RESULTS:
+        # In the order of the results, so the best matches are kept
+        best = heapq.nlargest(SEARCH_MAX_RESULTS, scores.items(), key=lambda item: (item[1], item[0]))
+        scores = dict(best)
+    rank = Case(*[When(id=post_id, then=Value(score)) for post_id, score in scores.items()],
+                default=Value(0.0), output_field=FloatField())
+    return queryset.filter(id__in=scores).annotate(rank=rank).order_by('-rank', '-id')
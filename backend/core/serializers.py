@@ -1,60 +1,110 @@
 from rest_framework import serializers
-from .models import Subrabbit, Vote, Post, VoteType, Comment
+from .models import Subrabbit, Post, VoteType, Comment, Upload, UploadStatus
+from core import uploads
 from accounts.serializers import UserSerializer
 from accounts.models import User
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models
 from django.db.models import Count, Q, F
 
 
-class VoteSerializer(serializers.ModelSerializer):
+def query_guard_enabled():
+    """Whether serializers should fail on lazy queries (defaults to the DEBUG setting)."""
+
+    return getattr(settings, 'SERIALIZER_QUERY_GUARD', settings.DEBUG)
+
+def _forbid_queries(execute, sql, params, many, context):
+    raise ImproperlyConfigured(
+        f'Lazy query while serializing a list, add select_related/prefetch_related '
+        f'or an annotation to the queryset: {sql}'
+    )
+
+class GuardedListSerializer(serializers.ListSerializer):
     """
-    Serializer for handling vote objects.
+    List serializer that forbids queries while serializing already-fetched rows.
 
-    This serializer serializes Vote objects, converting them into JSON format.
+    The list (and its prefetches) is evaluated first; any query issued afterwards comes
+    from a field reading a relation or a count lazily, which makes list endpoints cost
+    one query per item. With the query guard enabled such queries raise instead of
+    running, so they are caught in development rather than in production.
     """
 
-    class Meta:
-        model = Vote
-        fields = '__all__'
+    def to_representation(self, data):
+        if not query_guard_enabled():
+            return super().to_representation(data)
+
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        iterable = list(iterable)
+        with connection.execute_wrapper(_forbid_queries):
+            return super().to_representation(iterable)
+
 
 class SubrabbitSerializer(serializers.ModelSerializer):
     """
     Serializer for Subrabbit objects.
 
     This serializer serializes Subrabbit objects, converting them into JSON format.
+    Subscribers and moderators are not embedded; they are listed by the paginated
+    member and moderator endpoints.
     """
 
     creator = UserSerializer(read_only=True)
-    subscribers = UserSerializer(many=True, read_only=True)
-    moderators = UserSerializer(many=True, read_only=True)
+    members_count = serializers.IntegerField(source='member_count', read_only=True)
+    joined = serializers.SerializerMethodField()
+
     class Meta:
         model = Subrabbit
-        exclude = ('rules', 'description', )
+        fields = ('id', 'name', 'creator', 'members_count', 'joined', 'created_at', 'updated_at')
+        list_serializer_class = GuardedListSerializer
+
+    def get_joined(self, obj):
+        """
+        Method to get whether the requesting user subscribes to the subrabbit, from the
+        `memberships` the view put in the serializer context (None for anonymous viewers).
+        """
+
+        memberships = self.context.get('memberships')
+        return obj.id in memberships.subscribed if memberships is not None else None
+
+class MemberSerializer(UserSerializer):
+    """
+    Serializer for the members and moderators of a subrabbit, without private fields.
+    """
+
+    class Meta(UserSerializer.Meta):
+        fields = ('id', 'username', 'profile_picture',)
+        list_serializer_class = GuardedListSerializer
 
 class CommentSerializer(serializers.ModelSerializer):
     """
     Serializer for comment objects.
 
     This serializer serializes comment objects, converting them into JSON format.
+    Votes are represented by the stored counters; the requesting user's own votes are
+    served separately by `ViewerStateView`, so the output is the same for every viewer.
     """
 
-    comment_votes = VoteSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
 
     class Meta:
         model = Comment
         fields = '__all__'
+        read_only_fields = ('path', 'depth', 'descendant_count', 'upvotes', 'downvotes', 'score',
+                            'best_score', 'controversy')
+        list_serializer_class = GuardedListSerializer
 
 class PostSerializer(serializers.ModelSerializer):
     """
     Serializer for post objects.
 
     This serializer serializes post objects, converting them into JSON format.
+    Votes are represented by the stored counters (see `CommentSerializer`).
     """
 
     content = serializers.JSONField(read_only=True)
     author = UserSerializer(read_only=True)
     comments_count = serializers.SerializerMethodField()
-    votes = VoteSerializer(many=True, read_only=True)
     subrabbit = SubrabbitSerializer(read_only=True)
 
     class Meta:
@@ -64,37 +114,105 @@ class PostSerializer(serializers.ModelSerializer):
             'title',
             'content', 
             'author', 
+            'score',
+            'upvotes',
+            'downvotes',
             'comments_count', 
-            'votes', 
             'subrabbit', 
             'created_at'
         ]
+        read_only_fields = ('score', 'upvotes', 'downvotes')
 
     def get_comments_count(self, obj):
         """
-        Method to get the number of comments.
+        Method to get the number of comments, read from the stored counter.
         """
 
-        return Comment.objects.filter(parent_post=obj).count()
+        return obj.comment_count
+
+class PostListSerializer(serializers.ModelSerializer):
+    """
+    Compact serializer for posts in feeds.
+
+    Instead of embedding every vote row and the full community (with all of its
+    subscribers and moderators), it returns the stored vote and comment counters and
+    a small summary of the subrabbit, the same for every viewer. It expects the
+    queryset to select the related author and subrabbit (see `PostListView.fetch_posts`).
+    The full representation stays available through `PostSerializer` on the detail
+    endpoint.
+    """
+
+    content = serializers.JSONField(read_only=True)
+    author = UserSerializer(read_only=True)
+    comments_count = serializers.IntegerField(source='comment_count', read_only=True)
+    subrabbit = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Post
+        fields = [
+            'id',
+            'title',
+            'content',
+            'author',
+            'score',
+            'upvotes',
+            'downvotes',
+            'comments_count',
+            'subrabbit',
+            'created_at'
+        ]
+        list_serializer_class = GuardedListSerializer
+
+    def get_subrabbit(self, obj):
+        """
+        Method to get a summary of the post's subrabbit.
+        """
+
+        return {
+            'id': obj.subrabbit_id,
+            'name': obj.subrabbit.name,
+            'members_count': obj.subrabbit.member_count,
+        }
 
 class SubrabbitSerializer_detailed(serializers.ModelSerializer):
     """
     Detailed serializer for subrabbit objects.
 
     This serializer provides detailed information about subrabbit objects, including creator,
-    subscribers, moderators, and the count of members.
+    description, rules, and the stored count of members.
     """
 
     creator = UserSerializer(read_only=True)
-    subscribers = UserSerializer(many=True, read_only=True)
-    moderators = UserSerializer(many=True, read_only=True)
-    members_count = serializers.SerializerMethodField()
+    members_count = serializers.IntegerField(source='member_count', read_only=True)
+    joined = serializers.SerializerMethodField()
 
     class Meta:
         model = Subrabbit
-        fields = '__all__'
+        fields = ('id', 'name', 'description', 'rules', 'creator', 'members_count', 'joined',
+                  'created_at', 'updated_at')
+        list_serializer_class = GuardedListSerializer
+
+    def get_joined(self, obj):
+        """Method to get whether the requesting user subscribes to the subrabbit."""
+
+        memberships = self.context.get('memberships')
+        return obj.id in memberships.subscribed if memberships is not None else None
+
+class UploadSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the status of an asynchronous upload.
+
+    `file_url` is the URL to use for the image: the stored file once the upload is done,
+    the provisional URL serving the staged file before that.
+    """
 
-    def get_members_count(self, obj):
-        """Get the count of members in the subrabbit."""
+    file_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Upload
+        fields = ('id', 'status', 'name', 'size', 'file_url', 'attempts', 'error', 'created_at', 'updated_at')
 
-        return obj.subscribers.count()
+    def get_file_url(self, obj):
+        if obj.status == UploadStatus.DONE:
+            return obj.url
+        return uploads.provisional_url(obj, self.context.get('request'))
@@ -1,3 +1,1055 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from accounts.serializers import get_tokens_for_user
+from core import (
+    autocomplete, comment_tree, feed_cache, file_uploads, link_preview, memberships, ranking, search, timelines,
+    uploads, vote_buffer, votes,
+)
+from core.models import (
+    ChunkedUpload, Comment, CommentVote, FileBlob, Post, Subrabbit, Upload, UploadStatus, Vote, VoteType,
+)
+from core.views import editorjs_views
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Redis-backed cache (timelines, shared vote buffer) on an in-process fake server
+FAKE_REDIS_CACHE = {'default': {
+    'BACKEND': 'django_redis.cache.RedisCache',
+    'LOCATION': 'redis://fakeredis:6379/0',
+    'OPTIONS': {
+        'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection} if fakeredis else {},
+    },
+}}
+
+
+def cookie_client(user):
+    """Return a client signed in with the access token cookie, like the frontend."""
+
+    client = APIClient()
+    client.cookies['access_token'] = get_tokens_for_user(user)['access']
+    return client
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PostSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com')
+        cls.subrabbit = Subrabbit.objects.create(name='python', creator=cls.user)
+        # Groups of posts with the same text rank the same: pages must break the ties by id
+        texts = ['rabbit'] * 5 + ['rabbit rabbit'] * 4 + ['rabbit burrow carrot'] * 3 + ['carrot']
+        for number, text in enumerate(texts):
+            Post.objects.create(author=cls.user, subrabbit=cls.subrabbit, title=f'Post {number}',
+                                content={'blocks': []}, search_text=text)
+
+    def setUp(self):
+        # Rebuild the in-memory index from this test's posts
+        search._index = None
+        self.client = APIClient()
+
+    def walk(self, url):
+        """Follow the `next` links from `url` and return the ids of every page."""
+
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([post['id'] for post in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_ranking(self):
+        ranked = search.search_posts(Post.objects.all(), 'rabbit')
+        ids = list(ranked.values_list('id', flat=True))
+        self.assertEqual(len(ids), 12)
+        ranks = list(ranked.values_list('rank', flat=True))
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+        self.assertNotIn(Post.objects.get(search_text='carrot').id, ids)
+
+    def test_pages_cover_every_match_once(self):
+        expected = list(search.search_posts(Post.objects.all(), 'rabbit').values_list('id', flat=True))
+        for page_size in (1, 2, 3, 4, 5, 12, 20):
+            with self.subTest(page_size=page_size):
+                pages = self.walk(f'/api/search/posts/?q=rabbit&page_size={page_size}')
+                self.assertTrue(all(len(page) <= page_size for page in pages))
+                self.assertEqual([post_id for page in pages for post_id in page], expected)
+
+    def test_pages_of_tied_ranks(self):
+        expected = list(Post.objects.filter(search_text__contains='burrow').order_by('-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/search/posts/?q=burrow carrot&page_size=2'), [expected[:2], expected[2:]])
+
+    def test_no_match(self):
+        self.assertEqual(self.walk('/api/search/posts/?q=hedgehog'), [[]])
+
+    def test_in_memory_results_are_bounded(self):
+        if search.uses_postgres():
+            self.skipTest('PostgreSQL ranks every match in the database')
+        expected = list(search.search_posts(Post.objects.all(), 'rabbit').values_list('id', flat=True))
+        with mock.patch.object(search, 'SEARCH_MAX_RESULTS', 5):
+            self.assertEqual(self.walk('/api/search/posts/?q=rabbit&page_size=2'),
+                             [expected[0:2], expected[2:4], expected[4:5]])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class VoteTests(TestCase):
+    """Vote toggling, run by a single statement on PostgreSQL and by separate ones elsewhere."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        subrabbit = Subrabbit.objects.create(name='python', creator=cls.alice)
+        cls.post = Post.objects.create(author=cls.alice, subrabbit=subrabbit, title='Post', content={'blocks': []})
+        cls.comment = Comment.objects.create(author=cls.alice, parent_post=cls.post, content='Comment')
+
+    def assertRanked(self, post):
+        post.refresh_from_db()
+        self.assertAlmostEqual(post.hot_score, ranking.hot(post.score, post.created_at), places=6)
+        self.assertAlmostEqual(post.rising_score, ranking.rising(post.score, post.created_at), places=3)
+
+    def test_post_votes(self):
+        steps = [
+            (self.alice, VoteType.UP, (VoteType.UP, 1, 1, 0)),
+            (self.alice, VoteType.UP, (None, 0, 0, 0)),
+            (self.alice, VoteType.DOWN, (VoteType.DOWN, -1, 0, 1)),
+            (self.alice, VoteType.UP, (VoteType.UP, 1, 1, 0)),
+            (self.bob, VoteType.UP, (VoteType.UP, 2, 2, 0)),
+            (self.bob, VoteType.DOWN, (VoteType.DOWN, 0, 1, 1)),
+            (self.alice, VoteType.DOWN, (VoteType.DOWN, -2, 0, 2)),
+            (self.bob, VoteType.DOWN, (None, -1, 0, 1)),
+        ]
+        for user, vote_type, expected in steps:
+            with self.subTest(user=user.username, vote_type=vote_type):
+                result = votes.toggle_post_vote(user, self.post.id, vote_type)
+                self.assertEqual(tuple(result), expected)
+                vote = Vote.objects.filter(user=user, post=self.post).values_list('type', flat=True).first()
+                self.assertEqual(vote, result.vote_type)
+                post = Post.objects.get(id=self.post.id)
+                self.assertEqual((post.score, post.upvotes, post.downvotes), expected[1:])
+                self.assertRanked(post)
+
+    def test_rising_post(self):
+        for user in (self.alice, self.bob):
+            votes.toggle_post_vote(user, self.post.id, VoteType.UP)
+        post = Post.objects.get(id=self.post.id)
+        self.assertGreater(post.rising_score, 0)
+        self.assertRanked(post)
+
+    def test_missing_post(self):
+        self.assertIsNone(votes.toggle_post_vote(self.alice, 0, VoteType.UP))
+
+    def test_comment_votes(self):
+        steps = [
+            (self.alice, VoteType.DOWN, (VoteType.DOWN, -1, 0, 1)),
+            (self.alice, VoteType.DOWN, (None, 0, 0, 0)),
+            (self.alice, VoteType.UP, (VoteType.UP, 1, 1, 0)),
+            (self.bob, VoteType.DOWN, (VoteType.DOWN, 0, 1, 1)),
+            (self.bob, VoteType.UP, (VoteType.UP, 2, 2, 0)),
+        ]
+        for user, vote_type, expected in steps:
+            with self.subTest(user=user.username, vote_type=vote_type):
+                result = votes.toggle_comment_vote(user, self.comment.id, vote_type)
+                self.assertEqual(tuple(result), expected)
+                vote = CommentVote.objects.filter(user=user, comment=self.comment).values_list('type', flat=True)
+                self.assertEqual(vote.first(), result.vote_type)
+                comment = Comment.objects.get(id=self.comment.id)
+                self.assertEqual((comment.score, comment.upvotes, comment.downvotes), expected[1:])
+                self.assertAlmostEqual(comment.best_score, ranking.best(comment.upvotes, comment.downvotes), places=6)
+                self.assertAlmostEqual(comment.controversy, ranking.controversy(comment.upvotes, comment.downvotes),
+                                       places=6)
+
+    def test_missing_comment(self):
+        self.assertIsNone(votes.toggle_comment_vote(self.alice, 0, VoteType.UP))
+
+    def test_comment_vote_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        url = '/api/subrabbit/post/comment/vote/'
+        with mock.patch.object(votes, 'toggle_comment_vote', wraps=votes.toggle_comment_vote) as toggle:
+            response = client.patch(url, {'commentId': 'first', 'voteType': VoteType.UP}, format='json')
+            self.assertEqual((response.status_code, response.data['detail']), (400, 'Invalid comment id'))
+            toggle.assert_not_called()
+
+            response = client.patch(url, {'commentId': str(self.comment.id), 'voteType': VoteType.UP}, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+            toggle.assert_called_once_with(self.alice, self.comment.id, VoteType.UP)
+
+            # Errors of the vote itself are not reported as an invalid id
+            toggle.side_effect = ValueError('invalid input syntax')
+            with self.assertRaises(ValueError):
+                client.patch(url, {'commentId': self.comment.id, 'voteType': VoteType.UP}, format='json')
+        response = client.patch(url, {'commentId': self.comment.id + 100, 'voteType': VoteType.UP}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FeedCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        self.subrabbit = Subrabbit.objects.create(name='python', creator=self.user)
+        self.post = Post.objects.create(author=self.user, subrabbit=self.subrabbit, title='Post',
+                                        content={'blocks': []})
+        self.scopes = ['global', f'subrabbit:{self.subrabbit.id}']
+
+    def versions(self):
+        return feed_cache.get_versions(self.scopes)
+
+    def test_votes_only_invalidate_the_subrabbit(self):
+        global_version, subrabbit_version = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            votes.toggle_post_vote(self.user, self.post.id, VoteType.UP)
+        self.assertEqual(self.versions(), [global_version, subrabbit_version + 1])
+
+    def test_new_posts_invalidate_every_feed(self):
+        self.subrabbit.subscribers.add(self.user)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        global_version, subrabbit_version = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/create-post/', {'title': 'New', 'content': {'blocks': []},
+                                                         'subrabbitId': self.subrabbit.id}, format='json')
+        self.assertEqual(response.status_code, 204, response.content)
+        self.assertEqual(self.versions(), [global_version + 1, subrabbit_version + 1])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PostCountersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=name, email=f'{name}@example.com')
+                      for name in ('alice', 'bob', 'carol')]
+        self.subrabbit = Subrabbit.objects.create(name='python', creator=self.users[0])
+        self.post = Post.objects.create(author=self.users[0], subrabbit=self.subrabbit, title='Post',
+                                        content={'blocks': []})
+
+    def act(self, user, url, data, method='post'):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = getattr(client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content)
+        return response
+
+    def counters(self):
+        return Post.objects.values_list('score', 'upvotes', 'downvotes', 'comment_count').get(id=self.post.id)
+
+    def test_write_paths_keep_the_counters(self):
+        comment = self.act(self.users[1], '/api/subrabbit/post/comment/', {'postId': self.post.id, 'content': 'Hi'})
+        self.act(self.users[2], '/api/subrabbit/post/comment/',
+                 {'postId': self.post.id, 'replyToId': comment.data['id'], 'content': 'Hello'})
+        for user, vote_type in [(self.users[0], VoteType.UP), (self.users[1], VoteType.UP),
+                                (self.users[2], VoteType.DOWN)]:
+            self.act(user, '/api/subrabbit/post/vote/', {'postId': self.post.id, 'voteType': vote_type}, 'patch')
+        self.assertEqual(self.counters(), (1, 2, 1, 2))
+
+        listed = APIClient().get('/api/posts/?sort=new').json()['results'][0]
+        self.assertEqual((listed['score'], listed['upvotes'], listed['downvotes'], listed['comments_count']),
+                         (1, 2, 1, 2))
+
+    def test_reconcile_repairs_drift(self):
+        Vote.objects.create(user=self.users[0], post=self.post, type=VoteType.UP)
+        Vote.objects.create(user=self.users[1], post=self.post, type=VoteType.DOWN)
+        Vote.objects.create(user=self.users[2], post=self.post, type=VoteType.DOWN)
+        Comment.objects.create(author=self.users[1], parent_post=self.post, content='Hi')
+        Post.objects.filter(id=self.post.id).update(score=40, upvotes=40, downvotes=0, comment_count=9)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), (-1, 1, 2, 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FeedSortTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='alice', email='alice@example.com')
+        subrabbit = Subrabbit.objects.create(name='python', creator=user)
+        now = timezone.now()
+        cls.posts = {}
+        for name, score, age in [('old', 50, timedelta(days=3)), ('recent', 10, timedelta(hours=2)),
+                                 ('new', 2, timedelta(0))]:
+            post = Post.objects.create(author=user, subrabbit=subrabbit, title=name, content={'blocks': []})
+            created_at = now - age
+            Post.objects.filter(id=post.id).update(
+                created_at=created_at, score=score, upvotes=score,
+                hot_score=ranking.hot(score, created_at), rising_score=ranking.rising(score, created_at, now),
+            )
+            cls.posts[name] = post.id
+
+    def setUp(self):
+        # Pages cached by other tests
+        cache.clear()
+
+    def titles(self, sort):
+        response = APIClient().get(f'/api/posts/?sort={sort}&page_size=10')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [post['title'] for post in response.json()['results']]
+
+    def test_sort_modes(self):
+        # A post needs ten times the votes to outrank a post HOT_TIMESCALE seconds newer
+        self.assertEqual(self.titles('hot'), ['recent', 'new', 'old'])
+        self.assertEqual(self.titles('top'), ['old', 'recent', 'new'])
+        self.assertEqual(self.titles('new'), ['new', 'recent', 'old'])
+        # Posts older than the rising window are not rising
+        self.assertEqual(self.titles('rising'), ['recent', 'new'])
+        self.assertEqual(self.titles('hot'), self.titles(ranking.DEFAULT_SORT))
+
+    def test_invalid_sort(self):
+        self.assertEqual(APIClient().get('/api/posts/?sort=best').status_code, 400)
+
+    def test_refresh_rankings_ages_rising_posts(self):
+        expired = timezone.now() - ranking.RISING_WINDOW - timedelta(minutes=1)
+        Post.objects.filter(id=self.posts['recent']).update(created_at=expired)
+        call_command('refresh_rankings', stdout=StringIO())
+        self.assertEqual(Post.objects.get(id=self.posts['recent']).rising_score, 0)
+        self.assertEqual(self.titles('rising'), ['new'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com')
+        cls.subrabbit = Subrabbit.objects.create(name='python', creator=cls.user)
+        # Ties on the score must be broken by the rest of the ordering
+        for number, score in enumerate([1, 1, 1, 2, 2, 0, 0]):
+            Post.objects.create(author=cls.user, subrabbit=cls.subrabbit, title=f'Post {number}',
+                                content={'blocks': []}, score=score)
+        cls.post = Post.objects.first()
+        for score in [3, 1, 1, 0, 1]:
+            Comment.objects.create(author=cls.user, parent_post=cls.post, content='Reply', score=score)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            self.assertNotIn('count', data)
+            pages.append([item['id'] for item in data['results']])
+            url = data['next']
+        return pages
+
+    def test_post_pages(self):
+        expected = list(Post.objects.order_by(*ranking.SORT_ORDERINGS['top']).values_list('id', flat=True))
+        pages = self.walk('/api/posts/?sort=top&page_size=2')
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:6], expected[6:]])
+        self.assertEqual([len(page) for page in self.walk('/api/posts/?sort=top')], [3, 3, 1])
+
+    def test_pages_are_stable_under_new_posts(self):
+        first = self.client.get('/api/posts/?sort=new&page_size=3').json()
+        Post.objects.create(author=self.user, subrabbit=self.subrabbit, title='Newer', content={'blocks': []})
+        rest = self.walk(first['next'])
+        listed = [post['id'] for post in first['results']] + [post_id for page in rest for post_id in page]
+        self.assertEqual(listed, list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))[1:])
+
+    def test_comment_pages(self):
+        comments = Comment.objects.filter(parent_post=self.post)
+        expected = list(comments.order_by(*ranking.COMMENT_SORT_ORDERINGS['top']).values_list('id', flat=True))
+        pages = self.walk(f'/api/posts/{self.post.id}/comments/?sort=top&page_size=2')
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:]])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/posts/?cursor=garbage').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        subrabbit = Subrabbit.objects.create(name='python', creator=self.user)
+        self.post = Post.objects.create(author=self.user, subrabbit=subrabbit, title='Post', content={'blocks': []})
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ids = {}
+        # Sorted by new, the top level is a, c, b and the replies of a are a3, a2, a1
+        for name, parent in [('b', None), ('c', None), ('a', None), ('a1', 'a'), ('a1a', 'a1'),
+                             ('a1ai', 'a1a'), ('a2', 'a'), ('a3', 'a')]:
+            self.reply(name, parent)
+
+    def reply(self, name, parent=None):
+        data = {'postId': self.post.id, 'content': name}
+        if parent:
+            data['replyToId'] = self.ids[parent]
+        response = self.client.post('/api/subrabbit/post/comment/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.ids[name] = response.data['id']
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def shape(self, nodes):
+        """Return the nodes as (content, replies, hidden count) tuples."""
+
+        return [(node['content'], self.shape(node['replies']), node['more'] and node['more']['count'])
+                for node in nodes]
+
+    def test_tree(self):
+        url = f'/api/posts/{self.post.id}/comments/tree/'
+        page = self.get(f'{url}?sort=new&depth=2&limit=2')
+        self.assertEqual(self.shape(page['results']), [
+            ('a', [('a3', [], None), ('a2', [], None)], 3),
+            ('c', [], None),
+        ])
+        self.assertEqual(page['more_count'], 1)
+        self.assertEqual(self.shape(self.get(page['next'])['results']), [('b', [], None)])
+
+        # The collapsed replies of a resume after a2, down to the depth limit
+        cursor = page['results'][0]['more']['cursor']
+        branch = self.get(f'{url}?depth=2&limit=2&cursor={cursor}')
+        self.assertEqual(self.shape(branch['results']), [('a1', [('a1a', [], 1)], None)])
+        self.assertIsNone(branch['next'])
+
+    def test_replies_are_threaded(self):
+        comments = Comment.objects.in_bulk(self.ids.values())
+        deepest = comments[self.ids['a1ai']]
+        self.assertEqual(deepest.depth, 3)
+        self.assertEqual(comment_tree.ancestor_ids(deepest.path), [self.ids['a'], self.ids['a1'], self.ids['a1a']])
+        self.assertEqual(comments[self.ids['a']].descendant_count, 5)
+        self.assertEqual(Post.objects.get(id=self.post.id).comment_count, 8)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(f'/api/posts/{self.post.id}/comments/tree/?cursor=garbage').status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CommentSortTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='alice', email='alice@example.com')
+        subrabbit = Subrabbit.objects.create(name='python', creator=user)
+        cls.post = Post.objects.create(author=user, subrabbit=subrabbit, title='Post', content={'blocks': []})
+        for name, upvotes, downvotes in [('unanimous', 4, 0), ('liked', 40, 4), ('split', 30, 25), ('disliked', 0, 5)]:
+            Comment.objects.create(
+                author=user, parent_post=cls.post, content=name, upvotes=upvotes, downvotes=downvotes,
+                score=upvotes - downvotes, best_score=ranking.best(upvotes, downvotes),
+                controversy=ranking.controversy(upvotes, downvotes),
+            )
+
+    def contents(self, sort=None):
+        url = f'/api/posts/{self.post.id}/comments/'
+        response = APIClient().get(f'{url}?sort={sort}' if sort else url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [comment['content'] for comment in response.data['results']]
+
+    def test_sort_modes(self):
+        # Best ranks by the confident upvote ratio, top by net score
+        self.assertEqual(self.contents('best'), ['liked', 'unanimous', 'split', 'disliked'])
+        self.assertEqual(self.contents(), self.contents('best'))
+        self.assertEqual(self.contents('top'), ['liked', 'split', 'unanimous', 'disliked'])
+        self.assertEqual(self.contents('new'), ['disliked', 'split', 'liked', 'unanimous'])
+        # Many votes split close to evenly come first
+        self.assertEqual(self.contents('controversial')[:2], ['split', 'liked'])
+        self.assertEqual(APIClient().get(f'/api/posts/{self.post.id}/comments/?sort=hot').status_code, 400)
+
+
+class ReconcileCountersTests(TestCase):
+    def test_descendant_counts(self):
+        user = User.objects.create_user(username='alice', email='alice@example.com')
+        subrabbit = Subrabbit.objects.create(name='python', creator=user)
+        posts = [Post.objects.create(author=user, subrabbit=subrabbit, title=f'Post {number}', content={'blocks': []})
+                 for number in range(2)]
+
+        def reply(post, parent=None):
+            comment = Comment.objects.create(author=user, parent_post=post, content='Reply',
+                                             parent_comment_id=parent.id if parent else None,
+                                             descendant_count=7)
+            comment.path = comment_tree.path_for(comment.id, parent.path if parent else '')
+            comment.save(update_fields=['path'])
+            return comment
+
+        root = reply(posts[0])
+        child = reply(posts[0], root)
+        reply(posts[0], child)
+        reply(posts[0], root)
+        sibling = reply(posts[0])
+        # Same path prefix in another post
+        other = reply(posts[1])
+        Comment.objects.filter(id=other.id).update(path=root.path)
+
+        call_command('reconcile_counters', stdout=StringIO())
+        counts = dict(Comment.objects.values_list('id', 'descendant_count'))
+        self.assertEqual((counts[root.id], counts[child.id], counts[sibling.id], counts[other.id]), (3, 1, 0, 0))
+        self.assertEqual(Post.objects.get(id=posts[0].id).comment_count, 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class VoteBufferTests(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(vote_buffer, _buffer=vote_buffer.MemoryBuffer(), start_flusher=mock.DEFAULT,
+                                      FLUSH_BATCH_SIZE=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = [User.objects.create_user(username=name, email=f'{name}@example.com')
+                      for name in ('alice', 'bob', 'carol')]
+        subrabbit = Subrabbit.objects.create(name='python', creator=self.users[0])
+        self.post = Post.objects.create(author=self.users[0], subrabbit=subrabbit, title='Post', content={'blocks': []})
+
+    def displayed(self):
+        """Return the counters shown for the post: the stored ones plus the buffered deltas."""
+
+        post = Post.objects.values('id', 'score', 'upvotes', 'downvotes').get(id=self.post.id)
+        vote_buffer.merge_posts([post])
+        return post['score'], post['upvotes'], post['downvotes']
+
+    def test_flush_counts_votes_once(self):
+        Vote.objects.create(user=self.users[2], post=self.post, type=VoteType.DOWN)
+        Post.objects.filter(id=self.post.id).update(score=-1, downvotes=1)
+        for user in self.users:
+            vote_buffer.record(user, self.post.id, VoteType.UP)
+        self.assertEqual(self.displayed(), (3, 3, 0))
+
+        # Every batch is one intent: check the counters shown after each commit
+        shown = []
+        write = vote_buffer._write
+
+        def write_and_read(buffer, intents):
+            write(buffer, intents)
+            shown.append(self.displayed())
+
+        with mock.patch.object(vote_buffer, '_write', write_and_read):
+            self.assertEqual(vote_buffer.flush(), 3)
+        self.assertEqual(shown, [(3, 3, 0)] * 3)
+        self.assertEqual(self.displayed(), (3, 3, 0))
+        self.assertEqual(Post.objects.values_list('score', 'upvotes', 'downvotes').get(id=self.post.id), (3, 3, 0))
+        self.assertEqual(Vote.objects.filter(post=self.post, type=VoteType.UP).count(), 3)
+
+    def test_flush_between_reading_and_buffering_a_vote(self):
+        alice = self.users[0]
+        vote_buffer.record(alice, self.post.id, VoteType.UP)
+        buffer = vote_buffer.get_buffer()
+        record = buffer.record
+        flushed = []
+
+        def flush_and_record(*args):
+            # The pending upvote is written after the stored vote (none) was read
+            if not flushed:
+                flushed.append(vote_buffer.flush())
+            return record(*args)
+
+        with mock.patch.object(buffer, 'record', flush_and_record):
+            result = vote_buffer.record(alice, self.post.id, VoteType.UP)
+        self.assertEqual(flushed, [1])
+        # The second upvote withdraws the first one
+        self.assertEqual(tuple(result), (None, 0, 0, 0))
+        self.assertEqual(self.displayed(), (0, 0, 0))
+        vote_buffer.flush()
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(Post.objects.values_list('score', 'upvotes', 'downvotes').get(id=self.post.id), (0, 0, 0))
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(CACHES=FAKE_REDIS_CACHE)
+class RedisVoteBufferTests(VoteBufferTests):
+    """The same scenarios on the buffer shared through Redis."""
+
+    def setUp(self):
+        timelines._redis().flushdb()
+        super().setUp()
+        patcher = mock.patch.object(vote_buffer, '_buffer', vote_buffer.RedisBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ViewerStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        cls.python = Subrabbit.objects.create(name='python', creator=cls.alice)
+        cls.rust = Subrabbit.objects.create(name='rust', creator=cls.alice)
+        cls.python.subscribers.add(cls.alice)
+        cls.posts = [Post.objects.create(author=cls.alice, subrabbit=cls.python, title=f'Post {number}',
+                                         content={'blocks': []}) for number in range(3)]
+        cls.comment = Comment.objects.create(author=cls.bob, parent_post=cls.posts[0], content='Reply')
+        Vote.objects.create(user=cls.alice, post=cls.posts[0], type=VoteType.UP)
+        Vote.objects.create(user=cls.alice, post=cls.posts[1], type=VoteType.DOWN)
+        Vote.objects.create(user=cls.bob, post=cls.posts[2], type=VoteType.UP)
+        CommentVote.objects.create(user=cls.alice, comment=cls.comment, type=VoteType.DOWN)
+
+    def setUp(self):
+        cache.clear()
+
+    def state(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/viewer-state/', params)
+
+    def test_state(self):
+        post_ids = ','.join(str(post.id) for post in self.posts)
+        response = self.state(self.alice, posts=post_ids, comments=f'{self.comment.id},0',
+                              subrabbits='python,rust,missing')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json(), {
+            'posts': {str(self.posts[0].id): 'UP', str(self.posts[1].id): 'DOWN', str(self.posts[2].id): None},
+            'comments': {str(self.comment.id): 'DOWN', '0': None},
+            'subrabbits': {'python': True, 'rust': False, 'missing': False},
+        })
+        # One query per kind, once the viewer's memberships are cached
+        self.state(self.bob, subrabbits='python')
+        with self.assertNumQueries(3):
+            self.state(self.bob, posts=post_ids, comments=str(self.comment.id), subrabbits='python')
+
+    def test_pending_votes(self):
+        with mock.patch.multiple(vote_buffer, VOTE_WRITE_BEHIND=True, _buffer=vote_buffer.MemoryBuffer(),
+                                 start_flusher=mock.DEFAULT):
+            vote_buffer.record(self.alice, self.posts[0].id, VoteType.UP)
+            vote_buffer.record(self.alice, self.posts[2].id, VoteType.DOWN)
+            response = self.state(self.alice, posts=f'{self.posts[0].id},{self.posts[2].id}')
+        self.assertEqual(response.json()['posts'], {str(self.posts[0].id): None, str(self.posts[2].id): 'DOWN'})
+
+    def test_feed_is_the_same_for_every_viewer(self):
+        self.python.subscribers.add(self.bob)
+        pages = []
+        for user in (self.alice, self.bob):
+            client = APIClient()
+            client.force_authenticate(user)
+            pages.append(client.get('/api/posts/?sort=top').json())
+        self.assertEqual(len(pages[0]['results']), 3)
+        self.assertEqual(pages[0], pages[1])
+        self.assertNotIn('votes', pages[0]['results'][0])
+
+    def test_invalid_items(self):
+        self.assertEqual(self.state(self.alice, posts='1,two').status_code, 400)
+        self.assertEqual(self.state(self.alice, posts=','.join(map(str, range(101)))).status_code, 400)
+        self.assertEqual(APIClient().get('/api/viewer-state/', {'posts': '1'}).status_code, 401)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # A fresh index for this worker
+        patcher = mock.patch.multiple(autocomplete, _index=None, _version=0, _checked_at=0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        for name, count in [('pytest', 3), ('Python', 2), ('pyramid', 1), ('rust', 9)]:
+            Subrabbit.objects.create(name=name, creator=self.user, member_count=count)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def names(self, q, limit=None):
+        response = self.client.get('/api/search/', {'q': q, **({'limit': limit} if limit else {})})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [subrabbit['name'] for subrabbit in response.data]
+
+    def test_suggestions(self):
+        self.assertEqual(self.names('PY'), ['pytest', 'Python', 'pyramid'])
+        self.assertEqual(self.names('py', limit=2), ['pytest', 'Python'])
+        # An exact match comes first
+        self.assertEqual(self.names('python'), ['Python'])
+        self.assertEqual(self.names('go'), [])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/search/', {'q': 'r'})
+        self.assertEqual(response.data, [{'id': Subrabbit.objects.get(name='rust').id, 'name': 'rust',
+                                          'members_count': 9}])
+
+    def test_changes_are_indexed(self):
+        self.names('py')
+        with self.captureOnCommitCallbacks(execute=True):
+            for name in ('bob', 'carol', 'dave'):
+                user = User.objects.create_user(username=name, email=f'{name}@example.com')
+                memberships.subscribe(user, Subrabbit.objects.get(name='pyramid'))
+            response = self.client.post('/api/subrabbits/', {'name': 'pycon'}, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(self.client.delete('/api/subrabbit/pytest/').status_code, 204)
+        self.assertEqual(self.names('py'), ['pyramid', 'Python', 'pycon'])
+
+    def test_other_workers_replay_the_journal(self):
+        self.names('py')
+        stale = autocomplete.PrefixIndex(Subrabbit.objects.values_list('id', 'name', 'member_count'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/subrabbits/', {'name': 'pypy'}, format='json')
+        # A worker that has not seen the new subrabbit catches up without rebuilding
+        with mock.patch.multiple(autocomplete, _index=stale, _version=0, _checked_at=0.0):
+            with mock.patch.object(autocomplete, '_rebuild') as rebuild:
+                self.assertEqual(self.names('pyp'), ['pypy'])
+            rebuild.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SubrabbitJoinedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', email='alice@example.com')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        cls.subrabbit = Subrabbit.objects.create(name='python', creator=cls.alice)
+        cls.subrabbit.subscribers.add(cls.alice)
+
+    def joined(self, user=None):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        listed = client.get('/api/subrabbits/').data['results'][0]['joined']
+        detailed = client.get(f'/api/subrabbit/{self.subrabbit.name}/').data['joined']
+        return listed, detailed
+
+    def test_joined(self):
+        self.assertEqual(self.joined(self.alice), (True, True))
+        self.assertEqual(self.joined(self.bob), (False, False))
+
+    def test_joined_is_unknown_for_anonymous_viewers(self):
+        self.assertEqual(self.joined(), (None, None))
+
+
+@skipUnless(fakeredis, 'fakeredis is not installed')
+@override_settings(CACHES=FAKE_REDIS_CACHE)
+class HomeTimelineTests(TestCase):
+    def setUp(self):
+        timelines._redis().flushdb()
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        self.subrabbit = Subrabbit.objects.create(name='python', creator=self.user)
+        self.subrabbit.subscribers.add(self.user)
+        self.posts = [Post.objects.create(author=self.user, subrabbit=self.subrabbit, title=f'Post {number}',
+                                          content={'blocks': []}) for number in range(7)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self):
+        """Return the pages of the user's home feed sorted by new."""
+
+        pages = []
+        url = '/api/posts/?sort=new&page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            pages.append([post['id'] for post in page['results']])
+            url = page['next']
+        return pages
+
+    def test_pages(self):
+        newest = [post.id for post in reversed(self.posts)]
+        self.assertEqual(self.walk(), [newest[0:2], newest[2:4], newest[4:6], newest[6:]])
+        self.assertEqual(timelines._redis().zcard(timelines.user_key(self.user.id)), 7)
+
+    def test_deleted_posts_leave_the_timeline(self):
+        self.walk()
+        deleted = {self.posts[5].id, self.posts[2].id}
+        for post_id in deleted:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.delete(f'/api/post-detail/{post_id}/').status_code, 204)
+
+        newest = [post.id for post in reversed(self.posts) if post.id not in deleted]
+        self.assertEqual(self.walk(), [newest[0:2], newest[2:4], newest[4:]])
+        members = timelines._redis().zrange(timelines.user_key(self.user.id), 0, -1)
+        self.assertFalse(deleted & {int(member) for member in members})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ChunkedUploadTests(TestCase):
+    CONTENT = b'0123456789' * 10
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(file_uploads, 'UPLOAD_STAGING_ROOT', os.path.join(media_root, 'staging'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        self.client = cookie_client(self.user)
+
+    def start(self):
+        response = self.client.post('/api/upload-file/init/', {'name': 'notes.txt', 'size': len(self.CONTENT)},
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['offset'], 0)
+        return response.data['id']
+
+    def put(self, upload_id, offset, chunk):
+        return self.client.put(f'/api/upload-file/{upload_id}/', chunk, content_type='application/octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset))
+
+    def finish(self, upload_id):
+        response = self.client.post(f'/api/upload-file/{upload_id}/finalize/',
+                                    {'sha256': hashlib.sha256(self.CONTENT).hexdigest()}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data['file']
+
+    def upload(self):
+        upload_id = self.start()
+        for offset in range(0, len(self.CONTENT), 40):
+            self.assertEqual(self.put(upload_id, offset, self.CONTENT[offset:offset + 40]).status_code, 200)
+        return self.finish(upload_id)
+
+    def test_requires_the_access_token_cookie(self):
+        response = APIClient().post('/api/upload-file/init/', {'name': 'notes.txt'}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_upload(self):
+        file = self.upload()
+        self.assertEqual((file['name'], file['size']), ('notes.txt', len(self.CONTENT)))
+        blob = FileBlob.objects.get()
+        with open(file_uploads.FileSystemStorage().path(blob.path), 'rb') as stored:
+            self.assertEqual(stored.read(), self.CONTENT)
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(file_uploads._locks, {})
+
+    def test_resume(self):
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, self.CONTENT[:40]).status_code, 200)
+        # A chunk sent again after a dropped connection is rejected with the offset to resume from
+        response = self.put(upload_id, 0, self.CONTENT[:40])
+        self.assertEqual((response.status_code, response.data['offset']), (409, 40))
+        self.assertEqual(self.client.get(f'/api/upload-file/{upload_id}/').data['offset'], 40)
+
+        # Another worker, without the running hash, rehashes the partial file
+        file_uploads._hashers.clear()
+        self.assertEqual(self.put(upload_id, 40, self.CONTENT[40:]).data['offset'], len(self.CONTENT))
+        self.assertEqual(self.finish(upload_id)['size'], len(self.CONTENT))
+
+    def test_incomplete_upload(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:40])
+        response = self.client.post(f'/api/upload-file/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(file_uploads._locks, {})
+
+    def test_same_content_is_stored_once(self):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first['url'], second['url'])
+        self.assertEqual(FileBlob.objects.count(), 1)
+        self.assertEqual(os.listdir(os.path.join(file_uploads.UPLOAD_STAGING_ROOT, 'partial')), [])
+
+    def test_uploads_are_private(self):
+        upload_id = self.start()
+        other = cookie_client(User.objects.create_user(username='bob', email='bob@example.com'))
+        self.assertEqual(other.get(f'/api/upload-file/{upload_id}/').status_code, 404)
+
+    def test_abandoned_uploads_are_discarded(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:40])
+        idle = timedelta(seconds=file_uploads.CHUNKED_UPLOAD_EXPIRY + 1)
+        ChunkedUpload.objects.update(updated_at=timezone.now() - idle)
+        call_command('retry_uploads', stdout=StringIO())
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(file_uploads.UPLOAD_STAGING_ROOT, 'partial')), [])
+
+
+class InlineExecutor:
+    """Runs the submitted upload in the calling thread, on the test's database connection."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ImageUploadTests(TestCase):
+    IMAGE = b'\x89PNG\r\n\x1a\n' + b'0' * 64
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.backend = mock.Mock()
+        self.backend.store.return_value = uploads.StoredFile('https://cdn.example.com/image.png')
+        patcher = mock.patch.multiple(uploads, UPLOAD_STAGING_ROOT=os.path.join(media_root, 'staging'),
+                                      UPLOAD_RETRY_DELAY=0, get_backend=lambda: self.backend,
+                                      get_executor=InlineExecutor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username='alice', email='alice@example.com')
+        self.client = cookie_client(self.user)
+
+    def image(self):
+        return SimpleUploadedFile('cat.png', self.IMAGE, content_type='image/png')
+
+    def upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/upload-image/', {'image': self.image()}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def status(self, upload_id):
+        return self.client.get(f'/api/uploads/{upload_id}/').data
+
+    def test_upload(self):
+        data = self.upload()
+        upload = Upload.objects.get(id=data['upload']['id'])
+        self.assertEqual(upload.owner, self.user)
+        # The response does not wait for the storage backend: the image is served from its staged file
+        self.assertEqual(data['upload']['status'], UploadStatus.PENDING)
+        self.assertTrue(data['file']['url'].endswith(f'/api/uploads/{upload.id}/content/'))
+
+        status = self.status(upload.id)
+        self.assertEqual(status['status'], UploadStatus.DONE)
+        self.assertEqual(status['file_url'], 'https://cdn.example.com/image.png')
+        self.backend.store.assert_called_once_with(upload.staged_path, 'cat.png')
+        self.assertFalse(os.path.exists(upload.staged_path))
+        response = self.client.get(data['file']['url'])
+        self.assertEqual((response.status_code, response['Location']), (302, 'https://cdn.example.com/image.png'))
+
+    def test_retry(self):
+        self.backend.store.side_effect = OSError('Storage unavailable')
+        with self.assertLogs('core.uploads', 'WARNING'):
+            upload_id = self.upload()['upload']['id']
+        status = self.status(upload_id)
+        self.assertEqual((status['status'], status['attempts']), (UploadStatus.FAILED, uploads.UPLOAD_MAX_ATTEMPTS))
+        # The staged image is served until the upload is stored
+        response = self.client.get(f'/api/uploads/{upload_id}/content/')
+        self.assertEqual(b''.join(response.streaming_content), self.IMAGE)
+
+        self.backend.store.side_effect = None
+        call_command('retry_uploads', older_than=0, stdout=StringIO())
+        status = self.status(upload_id)
+        self.assertEqual((status['status'], status['error']), (UploadStatus.DONE, ''))
+        self.assertEqual(status['attempts'], uploads.UPLOAD_MAX_ATTEMPTS + 1)
+
+    def test_async_view_reads_the_access_token_cookie(self):
+        request = RequestFactory().post('/api/upload-image/', {'image': self.image()})
+        request.COOKIES['access_token'] = get_tokens_for_user(self.user)['access']
+        request._dont_enforce_csrf_checks = True
+        with self.captureOnCommitCallbacks(execute=True):
+            response = async_to_sync(editorjs_views.upload_image_async)(request)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Upload.objects.get().owner, self.user)
+
+
+class StubResponse:
+    """Streamed response of `StubSession`, recording how much of the body was read."""
+
+    def __init__(self, url, status_code, content_type, body):
+        self.url = url
+        self.status_code = status_code
+        self.headers = {'Content-Type': content_type}
+        self.raw = self
+        self.body = body
+        self.read = 0
+
+    def read1(self, size):
+        chunk = self.body[self.read:self.read + size]
+        self.read += len(chunk)
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class StubSession:
+    """`requests.Session` stand-in serving pages from a dict of URL to (status, content type, body)."""
+
+    def __init__(self, pages, gate=None):
+        self.pages = pages
+        self.gate = gate
+        self.responses = []
+
+    def get(self, url, **kwargs):
+        if self.gate:
+            self.gate.wait(timeout=5)
+        response = StubResponse(url, *self.pages.get(url, (404, 'text/html', b'')))
+        self.responses.append(response)
+        return response
+
+
+PAGE = (
+    b'<html><head><title>  A   rabbit </title>'
+    b'<meta property="og:description" content="All about rabbits">'
+    b'<meta name="description" content="Ignored">'
+    b'<meta property="og:image" content="/rabbit.png">'
+    b'</head><body>' + b'<p>Burrow</p>' * 100000 + b'</body></html>'
+)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LinkPreviewTests(TestCase):
+    URL = 'https://example.com/rabbits'
+
+    def setUp(self):
+        cache.clear()
+        self.session = StubSession({self.URL: (200, 'text/html; charset=utf-8', PAGE)})
+
+    def test_normalize_url(self):
+        self.assertEqual(link_preview.normalize_url('HTTPS://Example.COM:443/rabbits?utm_source=feed&b=2&a=1#top'),
+                         'https://example.com/rabbits?a=1&b=2')
+        self.assertEqual(link_preview.normalize_url('http://example.com:8080'), 'http://example.com:8080/')
+        with self.assertRaises(ValueError):
+            link_preview.normalize_url('ftp://example.com/rabbits')
+
+    def test_preview(self):
+        preview = link_preview.fetch_preview(self.URL, self.session)
+        self.assertEqual(preview, {
+            'title': 'A rabbit',
+            'description': 'All about rabbits',
+            'image': {'url': 'https://example.com/rabbit.png'},
+        })
+        # The download stops at the end of the head
+        self.assertLessEqual(self.session.responses[0].read, link_preview.CHUNK_SIZE)
+
+    def test_previews_are_cached_by_normalized_url(self):
+        first = link_preview.fetch_preview(self.URL, self.session)
+        self.assertEqual(link_preview.fetch_preview('https://EXAMPLE.com/rabbits?utm_campaign=x#top', self.session),
+                         first)
+        self.assertEqual(len(self.session.responses), 1)
+
+    def test_failures_are_cached(self):
+        url = 'https://example.com/missing'
+        self.assertIsNone(link_preview.fetch_preview(url, self.session))
+        self.assertIsNone(link_preview.fetch_preview(url, self.session))
+        self.assertEqual(len(self.session.responses), 1)
+
+        self.session.pages[url] = (200, 'application/pdf', b'%PDF')
+        self.assertIsNone(link_preview.fetch_preview(url + '.pdf', self.session))
+
+    def test_download_is_bounded(self):
+        self.session.pages[self.URL] = (200, 'text/html', b'<html><head>' + b'<meta name="x">' * 100000)
+        with mock.patch.object(link_preview, 'LINK_PREVIEW_MAX_BYTES', 64 * 1024):
+            self.assertEqual(link_preview.fetch_preview(self.URL, self.session)['title'], '')
+        self.assertLessEqual(self.session.responses[0].read, 64 * 1024 + link_preview.CHUNK_SIZE)
+
+    def test_concurrent_requests_share_a_download(self):
+        gate = threading.Event()
+        self.session.gate = gate
+        previews = []
+        threads = [threading.Thread(target=lambda: previews.append(link_preview.fetch_preview(self.URL, self.session)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        # Let the followers find the leader's download in flight
+        while not link_preview._inflight:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.session.responses), 1)
+        self.assertEqual([preview['title'] for preview in previews], ['A rabbit'] * 3)
+
+    def test_endpoint(self):
+        with mock.patch.object(link_preview, '_session', self.session):
+            response = APIClient().get('/api/link/', {'url': self.URL})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['success'], response.data['meta']['title']), (1, 'A rabbit'))
+        self.assertEqual(APIClient().get('/api/link/', {'url': 'javascript:alert(1)'}).status_code, 400)
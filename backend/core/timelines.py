@@ -0,0 +1,274 @@
+"""
+Materialized home timelines in Redis sorted sets.
+
+Every user's home feed is backed by a sorted set of the ids of the most recent posts of
+the subrabbits they subscribe to, scored by creation time:
+
+- On write (fan-out-on-write), a new post is pushed into the timeline of every
+  subscriber that currently has one, and into a per-subrabbit timeline.
+- Subrabbits with more than `TIMELINE_FANOUT_LIMIT` members are not fanned out. Their
+  posts only go to the per-subrabbit timeline, which is merged into the home timeline
+  at read time (fan-out-on-read).
+- Subscribing backfills the timeline with the recent posts of the subrabbit, and
+  unsubscribing trims them out.
+- Deleted posts are removed from the subrabbit timeline and from the timelines of its
+  subscribers, so that pages are not cut short by ids of posts that no longer exist.
+- Timelines are built lazily from the database on first read and expire after
+  `TIMELINE_TTL` seconds without reads, so inactive users cost no memory and no fan-out.
+
+Only the home feed sorted by new reads timelines: each page is a `ZREVRANGEBYSCORE` of
+`page size + 1` entries after the cursor, so its cost does not depend on the length of
+the timeline, and only the posts of the page are then loaded. The other sorts rank every
+subscribed post and are queried with the indexed ranking columns instead, as are pages
+past the end of a full (trimmed) timeline.
+
+Timelines require the `django_redis` cache backend. With any other backend `enabled()`
+is False and the feed falls back to querying posts by subscription.
+"""
+
+from django.conf import settings
+
+from core.models import Post, Subrabbit
+
+TIMELINE_LENGTH = getattr(settings, 'TIMELINE_LENGTH', 800)
+TIMELINE_FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+TIMELINE_TTL = getattr(settings, 'TIMELINE_TTL', 60 * 60 * 24 * 7)
+FANOUT_BATCH_SIZE = 500
+
+LARGE_SUBRABBITS_KEY = 'timeline:large-subrabbits'
+
+# Push a post into every listed timeline that is already materialized, then trim it.
+# KEYS are (timeline, ready marker) pairs; ARGV is (score, post id, length).
+FANOUT_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        redis.call('ZADD', KEYS[i], ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -tonumber(ARGV[3]) - 1)
+    end
+end
+return 1
+"""
+
+
+def enabled():
+    """Return True if the default cache is Redis, which timelines are stored in."""
+
+    return settings.CACHES['default']['BACKEND'].startswith('django_redis.')
+
+
+def _redis():
+    from django_redis import get_redis_connection
+
+    return get_redis_connection('default')
+
+
+def user_key(user_id):
+    return f'timeline:user:{user_id}'
+
+
+def subrabbit_key(subrabbit_id):
+    return f'timeline:subrabbit:{subrabbit_id}'
+
+
+def _ready_key(key):
+    return f'{key}:ready'
+
+
+def _score(created_at):
+    return created_at.timestamp()
+
+
+def _subscriber_ids(subrabbit_id):
+    through = Subrabbit.subscribers.through
+    return through.objects.filter(subrabbit_id=subrabbit_id).values_list('user_id', flat=True)
+
+
+def _recent_posts(subrabbit_ids):
+    return Post.objects.filter(subrabbit_id__in=subrabbit_ids) \
+                       .order_by('-created_at', '-id') \
+                       .values_list('id', 'created_at')[:TIMELINE_LENGTH]
+
+
+def _store(pipe, key, rows):
+    """Replace the timeline stored at `key` with `rows` and mark it as materialized."""
+
+    pipe.delete(key)
+    if rows:
+        pipe.zadd(key, {post_id: _score(created_at) for post_id, created_at in rows})
+    pipe.set(_ready_key(key), 1, ex=TIMELINE_TTL)
+    pipe.expire(key, TIMELINE_TTL)
+
+
+def _is_large(subrabbit_id):
+    member_count = Subrabbit.objects.filter(id=subrabbit_id).values_list('member_count', flat=True).first()
+    return (member_count or 0) > TIMELINE_FANOUT_LIMIT
+
+
+def publish(post):
+    """
+    Push a newly created post into the timelines that should contain it.
+
+    Call it once the post is committed, e.g. from `transaction.on_commit`.
+    """
+
+    redis = _redis()
+    score = _score(post.created_at)
+    subrabbit_id = post.subrabbit_id
+
+    fanout = redis.register_script(FANOUT_SCRIPT)
+    sub_key = subrabbit_key(subrabbit_id)
+    fanout(keys=[sub_key, _ready_key(sub_key)], args=[score, post.id, TIMELINE_LENGTH])
+
+    if _is_large(subrabbit_id):
+        # Readers merge this subrabbit's own timeline instead
+        redis.sadd(LARGE_SUBRABBITS_KEY, subrabbit_id)
+        return
+    redis.srem(LARGE_SUBRABBITS_KEY, subrabbit_id)
+
+    keys = []
+    for user_id in _subscriber_ids(subrabbit_id).iterator(chunk_size=FANOUT_BATCH_SIZE):
+        key = user_key(user_id)
+        keys += [key, _ready_key(key)]
+        if len(keys) >= 2 * FANOUT_BATCH_SIZE:
+            fanout(keys=keys, args=[score, post.id, TIMELINE_LENGTH])
+            keys = []
+    if keys:
+        fanout(keys=keys, args=[score, post.id, TIMELINE_LENGTH])
+
+
+def retract(subrabbit_id, post_ids, subscriber_ids=None):
+    """
+    Remove deleted posts of a subrabbit from the timelines that may contain them.
+
+    Call it once the deletion is committed, e.g. from `transaction.on_commit`.
+
+    Parameters:
+        subrabbit_id: Id of the subrabbit of the posts.
+        post_ids: Ids of the deleted posts.
+        subscriber_ids: Ids of the subscribers whose timelines to update, by default the
+            current subscribers (pass them when the subrabbit itself is deleted).
+    """
+
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    if subscriber_ids is None:
+        subscriber_ids = _subscriber_ids(subrabbit_id).iterator(chunk_size=FANOUT_BATCH_SIZE)
+
+    pipe = _redis().pipeline(transaction=False)
+    pipe.zrem(subrabbit_key(subrabbit_id), *post_ids)
+    for count, user_id in enumerate(subscriber_ids, 1):
+        pipe.zrem(user_key(user_id), *post_ids)
+        if count % FANOUT_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def _build_subrabbit_timeline(redis, subrabbit_id):
+    """Return the key of a subrabbit timeline, building it if needed."""
+
+    key = subrabbit_key(subrabbit_id)
+    if not redis.exists(_ready_key(key)):
+        pipe = redis.pipeline()
+        _store(pipe, key, list(_recent_posts([subrabbit_id])))
+        pipe.execute()
+    return key
+
+
+def _subrabbit_timeline(redis, subrabbit_id):
+    """Return (post id, score) pairs of a subrabbit timeline, building it if needed."""
+
+    key = _build_subrabbit_timeline(redis, subrabbit_id)
+    return redis.zrevrange(key, 0, TIMELINE_LENGTH - 1, withscores=True)
+
+
+def _page(redis, key, limit, after):
+    """
+    Return up to `limit` entries of a timeline after a position, and whether it has more.
+
+    Entries are (score, post id) pairs; `after` is the (score, post id) of the last entry
+    of the previous page, or None. Posts created in the same microsecond share a score,
+    so the range starts at that score (inclusive) and the entries up to the position are
+    skipped.
+    """
+
+    max_score = after[0] if after is not None else '+inf'
+    entries = []
+    start = 0
+    while True:
+        batch = redis.zrevrangebyscore(key, max_score, '-inf', start=start, num=limit, withscores=True)
+        start += len(batch)
+        entries += [(score, int(member)) for member, score in batch
+                    if after is None or (score, int(member)) < after]
+        if len(batch) < limit:
+            return entries, False
+        if len(entries) >= limit:
+            return entries, True
+
+
+def home_post_ids(user_id, subscribed_ids, limit, after=None):
+    """
+    Return the ids of a page of a user's home feed, newest first.
+
+    Parameters:
+        user_id: Id of the user.
+        subscribed_ids: Ids of the subrabbits the user subscribes to.
+        limit: Number of posts to return (the page size, plus one to detect a next page).
+        after: (created_at, id) of the last post of the previous page, or None.
+
+    Returns:
+        list or None: At most `limit` post ids, or None if the page reaches past the
+        posts kept in a full timeline, which only the database has.
+    """
+
+    redis = _redis()
+    key = user_key(user_id)
+    large = {int(subrabbit_id) for subrabbit_id in redis.smembers(LARGE_SUBRABBITS_KEY)}
+    subscribed_large = large.intersection(subscribed_ids)
+
+    if not redis.exists(_ready_key(key)):
+        pipe = redis.pipeline()
+        _store(pipe, key, list(_recent_posts(set(subscribed_ids) - subscribed_large)))
+        pipe.execute()
+    else:
+        redis.expire(key, TIMELINE_TTL)
+        redis.expire(_ready_key(key), TIMELINE_TTL)
+
+    position = (_score(after[0]), after[1]) if after is not None else None
+    keys = [key] + [_build_subrabbit_timeline(redis, subrabbit_id) for subrabbit_id in subscribed_large]
+    # A subrabbit that grew past the fan-out limit can be in several timelines
+    entries = set()
+    for source in keys:
+        page, more = _page(redis, source, limit, position)
+        if not more and redis.zcard(source) >= TIMELINE_LENGTH:
+            # The timeline was trimmed: older posts are only in the database
+            return None
+        entries.update(page)
+    return [post_id for _, post_id in sorted(entries, reverse=True)[:limit]]
+
+
+def subscribed(user_id, subrabbit_id):
+    """Backfill a user's timeline with the recent posts of a subrabbit they just joined."""
+
+    redis = _redis()
+    key = user_key(user_id)
+    if not redis.exists(_ready_key(key)) or redis.sismember(LARGE_SUBRABBITS_KEY, subrabbit_id):
+        return
+    rows = _subrabbit_timeline(redis, subrabbit_id)
+    if rows:
+        pipe = redis.pipeline()
+        pipe.zadd(key, dict(rows))
+        pipe.zremrangebyrank(key, 0, -TIMELINE_LENGTH - 1)
+        pipe.execute()
+
+
+def unsubscribed(user_id, subrabbit_id):
+    """Trim the posts of a subrabbit a user just left out of their timeline."""
+
+    redis = _redis()
+    key = user_key(user_id)
+    if not redis.exists(_ready_key(key)):
+        return
+    post_ids = [post_id for post_id, _ in _recent_posts([subrabbit_id])]
+    if post_ids:
+        redis.zrem(key, *post_ids)
@@ -0,0 +1,206 @@
+"""
+Asynchronous image uploads.
+
+Uploading an image to remote storage takes a full round trip to the storage service,
+which used to happen inside the request. Instead, `stage()` writes the file to local
+disk, records an `Upload` row and returns at once; the file is served from a provisional
+URL (`/api/uploads/<id>/content/`) until a background worker has pushed it to the
+storage backend, after which that URL redirects to the stored file. Provisional URLs
+embedded in posts therefore keep working once the upload completes.
+
+Workers are a per-process thread pool (`UPLOAD_WORKERS` threads). A failed push is
+retried with exponential backoff up to `UPLOAD_MAX_ATTEMPTS` times; uploads that are
+still pending after a restart, or that failed, are picked up again by the
+`retry_uploads` management command. The status of an upload can be polled at
+`/api/uploads/<id>/`.
+
+The storage backend is set by `UPLOAD_BACKEND`: `CloudinaryBackend` in production, or
+`LocalBackend`, which stores files under `MEDIA_ROOT` and needs no remote service.
+"""
+
+import logging
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import cloudinary.uploader
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from accounts import principals
+from accounts.models import User
+from core.models import Upload, UploadKind, UploadStatus
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_BACKEND = getattr(settings, 'UPLOAD_BACKEND', 'core.uploads.CloudinaryBackend')
+UPLOAD_STAGING_ROOT = getattr(settings, 'UPLOAD_STAGING_ROOT', os.path.join(settings.MEDIA_ROOT, 'staging'))
+UPLOAD_WORKERS = getattr(settings, 'UPLOAD_WORKERS', 4)
+UPLOAD_MAX_ATTEMPTS = getattr(settings, 'UPLOAD_MAX_ATTEMPTS', 5)
+# Seconds before the first retry, doubled after every failed attempt
+UPLOAD_RETRY_DELAY = getattr(settings, 'UPLOAD_RETRY_DELAY', 2)
+
+
+class StoredFile(NamedTuple):
+    """
+    Result of pushing a file to a storage backend.
+
+    Attributes:
+        url: Public URL of the stored file.
+        resource: Value for a `CloudinaryField` (e.g. `User.profile_picture`), or None if
+            the backend does not store files on Cloudinary.
+    """
+
+    url: str
+    resource: object = None
+
+
+class CloudinaryBackend:
+    """Stores files on Cloudinary, the default file storage of the project."""
+
+    def store(self, path, name):
+        result = cloudinary.uploader.upload_resource(path)
+        return StoredFile(result.build_url(secure=True), result)
+
+
+class LocalBackend:
+    """Stores files under `MEDIA_ROOT/uploads`, for development and tests."""
+
+    def __init__(self):
+        self.storage = FileSystemStorage()
+
+    def store(self, path, name):
+        with open(path, 'rb') as file:
+            stored = self.storage.save(os.path.join('uploads', name), file)
+        return StoredFile(self.storage.url(stored))
+
+
+_backend = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = import_string(UPLOAD_BACKEND)()
+        return _backend
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+        return _executor
+
+
+def stage(uploaded_file, kind, owner=None):
+    """
+    Write an uploaded file to the staging directory and queue it for storage.
+
+    The worker is started once the current transaction commits.
+
+    Parameters:
+        uploaded_file: The `UploadedFile` from `request.FILES`.
+        kind: An `UploadKind`; profile pictures are assigned to `owner` when stored.
+        owner: The uploading user, if authenticated.
+
+    Returns:
+        Upload: The pending upload.
+    """
+
+    os.makedirs(UPLOAD_STAGING_ROOT, exist_ok=True)
+    name = os.path.basename(uploaded_file.name or '')[:100] or 'upload'
+    upload = Upload.objects.create(
+        owner=owner if owner is not None and owner.is_authenticated else None,
+        kind=kind,
+        name=name,
+        content_type=uploaded_file.content_type or mimetypes.guess_type(name)[0] or '',
+        size=uploaded_file.size,
+    )
+    upload.staged_path = os.path.join(UPLOAD_STAGING_ROOT, upload.id.hex + os.path.splitext(name)[1].lower())
+    with open(upload.staged_path, 'wb') as staged:
+        for chunk in uploaded_file.chunks():
+            staged.write(chunk)
+    upload.save(update_fields=['staged_path'])
+
+    enqueue(upload.id)
+    return upload
+
+
+def enqueue(upload_id):
+    """Submit an upload to the worker pool once the current transaction commits."""
+
+    transaction.on_commit(lambda: get_executor().submit(process, upload_id))
+
+
+def provisional_url(upload, request=None):
+    """Return the URL serving an upload: its staged file, then a redirect to the stored file."""
+
+    path = reverse('upload-content', args=[upload.id])
+    return request.build_absolute_uri(path) if request is not None else path
+
+
+def process(upload_id):
+    """
+    Push a staged upload to the storage backend, retrying failures with backoff.
+
+    Returns:
+        Upload or None: The upload in its final state (None if it does not exist or is
+        already being processed).
+    """
+
+    # Claim the upload, so that concurrent retries cannot store it twice
+    claimed = Upload.objects.filter(
+        id=upload_id, status__in=[UploadStatus.PENDING, UploadStatus.FAILED],
+    ).update(status=UploadStatus.STORING, updated_at=timezone.now())
+    if not claimed:
+        return None
+    upload = Upload.objects.get(id=upload_id)
+
+    delay = UPLOAD_RETRY_DELAY
+    while True:
+        upload.attempts += 1
+        try:
+            stored = get_backend().store(upload.staged_path, upload.name)
+        except Exception as e:
+            logger.warning('Upload %s failed (attempt %d): %s', upload.id, upload.attempts, e)
+            upload.error = str(e)[:500]
+            # Each round (first run, then every retry_uploads run) makes UPLOAD_MAX_ATTEMPTS attempts
+            if upload.attempts % UPLOAD_MAX_ATTEMPTS == 0:
+                # The staged file keeps being served until a later retry succeeds
+                upload.status = UploadStatus.FAILED
+                upload.save(update_fields=['status', 'attempts', 'error', 'updated_at'])
+                return upload
+            upload.save(update_fields=['attempts', 'error', 'updated_at'])
+            time.sleep(delay)
+            delay *= 2
+        else:
+            break
+
+    with transaction.atomic():
+        upload.status = UploadStatus.DONE
+        upload.url = stored.url
+        upload.error = ''
+        upload.save(update_fields=['status', 'url', 'attempts', 'error', 'updated_at'])
+        if upload.kind == UploadKind.PROFILE_PICTURE and upload.owner_id:
+            # Unless the user picked another picture in the meantime
+            User.objects.filter(id=upload.owner_id, avatar_url__endswith=provisional_url(upload)).update(
+                avatar_url=stored.url, profile_picture=stored.resource,
+            )
+            principals.forget(upload.owner_id)
+
+    try:
+        os.remove(upload.staged_path)
+    except OSError:
+        pass
+    return upload
@@ -1,25 +1,45 @@
+from django.conf import settings
 from django.urls import path
 from .views import editorjs_views, post_views, subrabbit_views
 
+# Views waiting on remote services; see USE_ASYNC_VIEWS
+if settings.USE_ASYNC_VIEWS:
+    fetch_url_metadata = editorjs_views.fetch_url_metadata_async
+    upload_image = editorjs_views.upload_image_async
+else:
+    fetch_url_metadata = editorjs_views.fetch_url_metadata
+    upload_image = editorjs_views.upload_image
+
 
 urlpatterns = [
     path('subrabbits/', subrabbit_views.SubrabbitListCreateView.as_view(), name='subrabbits'),
     path('subrabbit/<str:name>/', subrabbit_views.SubrabbitDetail.as_view(), name='subrabbit-detail'),
     path('subrabbit/<str:name>/subscribe/', subrabbit_views.SubscribeView.as_view(), name='subscribe'),
     path('subrabbit/<str:name>/unsubscribe/', subrabbit_views.UnsubscribeView.as_view(), name='unsubcribe'),
+    path('subrabbit/<str:name>/members/', subrabbit_views.SubrabbitMembersView.as_view(), name='subrabbit-members'),
+    path('subrabbit/<str:name>/moderators/', subrabbit_views.SubrabbitModeratorsView.as_view(),
+         name='subrabbit-moderators'),
     path('search/', subrabbit_views.SearchView.as_view(), name='search'),
+    path('search/posts/', post_views.PostSearchView.as_view(), name='search-posts'),
 
     path('create-post/', post_views.CreatePostView.as_view(), name='create-post'),
     path('subrabbit/post/vote/', post_views.VoteView.as_view(), name='post-vote'),
     path('posts/', post_views.PostListView.as_view(), name='posts'),
     path('posts/<int:post_id>/comments/', post_views.CommentListView.as_view(), name='post-comments'),
+    path('posts/<int:post_id>/comments/tree/', post_views.CommentTreeView.as_view(), name='post-comment-tree'),
     path('post-detail/<str:pk>/', post_views.PostDetailView.as_view(), name='post-detail'),
     path('subrabbit/post/comment/', post_views.CreateComment.as_view(), name='create-comment'),
     path('subrabbit/post/comment/vote/', post_views.CommentVoteView.as_view(), name='comment-vote'),
+    path('viewer-state/', post_views.ViewerStateView.as_view(), name='viewer-state'),
 
-    path('link/', editorjs_views.fetch_url_metadata, name='link'),
-    path('upload-image/', editorjs_views.upload_image, name='image-upload'),
+    path('link/', fetch_url_metadata, name='link'),
+    path('upload-image/', upload_image, name='image-upload'),
+    path('uploads/<uuid:upload_id>/', editorjs_views.upload_status, name='upload-status'),
+    path('uploads/<uuid:upload_id>/content/', editorjs_views.upload_content, name='upload-content'),
     path('upload-file/', editorjs_views.upload_file, name='file-upload'),
+    path('upload-file/init/', editorjs_views.start_file_upload, name='file-upload-start'),
+    path('upload-file/<uuid:upload_id>/', editorjs_views.file_upload_chunk, name='file-upload-chunk'),
+    path('upload-file/<uuid:upload_id>/finalize/', editorjs_views.finish_file_upload, name='file-upload-finish'),
 
 
 ]
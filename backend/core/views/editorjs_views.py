@@ -1,10 +1,19 @@
-import requests
-from bs4 import BeautifulSoup
-from cloudinary.uploader import upload
-from django.core.files.storage import FileSystemStorage
-from rest_framework.decorators import api_view
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import FileResponse, Http404, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from accounts.authenticate import CustomAuthentication
+from core import file_uploads, link_preview, uploads
+from core.models import ChunkedUpload, Upload, UploadKind, UploadStatus
+from core.serializers import UploadSerializer
+
 
 @api_view(['GET'])
 def fetch_url_metadata(request):
@@ -12,7 +21,8 @@ def fetch_url_metadata(request):
     View for fetching metadata from a URL.
 
     This view allows users to fetch metadata such as title, description,
-    and image from a provided URL while creating a post.
+    and image from a provided URL while creating a post. Previews are cached
+    and fetched with bounded time and size (see `core.link_preview`).
 
     Parameters:
         request: The request object containing the URL to fetch metadata from.
@@ -26,60 +36,170 @@ def fetch_url_metadata(request):
     if not url:
         return Response('Invalid URL', status=400)
 
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
+    try:
+        preview = link_preview.fetch_preview(url)
+    except ValueError:
+        return Response('Invalid URL', status=400)
 
-    title = soup.title.string if soup.title else ''
-    description_tag = soup.find('meta', attrs={'name': 'description'})
-    description = description_tag['content'] if description_tag else ''
-    image_tag = soup.find('meta', attrs={'property': 'og:image'})
-    image_url = image_tag['content'] if image_tag else ''
+    if preview is None:
+        return Response({'success': 0, 'meta': {}})
 
     return Response({
         'success': 1,
-        'meta': {
-            'title': title,
-            'description': description,
-            'image': {
-                'url': image_url,
-            },
-        },
+        'meta': preview,
+    })
+
+@require_GET
+async def fetch_url_metadata_async(request):
+    """
+    Async version of `fetch_url_metadata`, routed instead of it when `USE_ASYNC_VIEWS` is
+    enabled, with the same responses.
+
+    The page is fetched with the pooled async HTTP client, so a slow site holds no thread
+    while the preview downloads.
+    """
+
+    url = request.GET.get('url')
+
+    if not url:
+        return JsonResponse('Invalid URL', status=400, safe=False)
+
+    try:
+        preview = await link_preview.afetch_preview(url)
+    except ValueError:
+        return JsonResponse('Invalid URL', status=400, safe=False)
+
+    if preview is None:
+        return JsonResponse({'success': 0, 'meta': {}})
+
+    return JsonResponse({
+        'success': 1,
+        'meta': preview,
     })
 
 @api_view(['POST'])
+@authentication_classes([CustomAuthentication])
 def upload_image(request):
     """
     View for uploading images.
 
-    This view handles POST requests for uploading images. It expects an 'image' file in the request data
-    and returns the URL of the uploaded image. The image is stored on Cloudinary storage, which is the default
-    file storage of the project.
+    This view handles POST requests for uploading images. It expects an 'image' file in the request data.
+    The image is staged on local disk and pushed to the storage backend (Cloudinary by default) by a
+    background worker, so the response is returned without waiting for the remote storage. It contains
+    a provisional URL, which serves the staged image and then redirects to the stored one, and the id
+    of the upload, whose status can be polled (see `core.uploads`).
 
     Parameters:
         request: The request object containing the uploaded image file.
 
     Returns:
-        Response: Response containing the URL of the uploaded image.
+        Response: Response containing the URL of the uploaded image and the status of the upload.
     """
 
-    uploaded_file = request.FILES['image']
-    result = upload(uploaded_file)
-    file_url = result['secure_url']
+    uploaded_file = request.FILES.get('image')
+    if not uploaded_file or not (uploaded_file.content_type or '').startswith('image/'):
+        return Response('Invalid input', status=400)
 
+    upload = uploads.stage(uploaded_file, UploadKind.IMAGE, owner=request.user)
     return Response({
         'success': 1,
         'file': {
-            'url': file_url,
+            'url': uploads.provisional_url(upload, request),
         },
+        'upload': UploadSerializer(upload, context={'request': request}).data,
     })
 
+@csrf_exempt
+@require_POST
+async def upload_image_async(request):
+    """
+    Async version of `upload_image`, routed instead of it when `USE_ASYNC_VIEWS` is enabled,
+    with the same responses.
+
+    Authentication and staging the file (disk and database) run in a thread; the push to
+    the storage backend already happens in the background.
+    """
+
+    def stage():
+        try:
+            authenticated = CustomAuthentication().authenticate(request)
+        except APIException as e:
+            # Rejected tokens and CSRF failures carry a dict or a message, like DRF would render them
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return JsonResponse(detail, status=e.status_code)
+        owner = authenticated[0] if authenticated else AnonymousUser()
+
+        uploaded_file = request.FILES.get('image')
+        if not uploaded_file or not (uploaded_file.content_type or '').startswith('image/'):
+            return JsonResponse('Invalid input', status=400, safe=False)
+
+        upload = uploads.stage(uploaded_file, UploadKind.IMAGE, owner=owner)
+        return JsonResponse({
+            'success': 1,
+            'file': {
+                'url': uploads.provisional_url(upload, request),
+            },
+            'upload': UploadSerializer(upload, context={'request': request}).data,
+        })
+
+    return await sync_to_async(stage)()
+
+@api_view(['GET'])
+def upload_status(request, upload_id):
+    """
+    View for polling the status of an image upload.
+
+    Parameters:
+        request: The request object.
+        upload_id: The id of the upload returned by the upload endpoint.
+
+    Returns:
+        Response: Response containing the status of the upload and the URL to use for the image.
+    """
+
+    upload = get_object_or_404(Upload, id=upload_id)
+    return Response(UploadSerializer(upload, context={'request': request}).data)
+
+def upload_content(request, upload_id):
+    """
+    View serving an uploaded image at its provisional URL.
+
+    Serves the staged file while the upload is pending, and redirects to the stored file
+    once the upload is done.
+
+    Parameters:
+        request: The request object.
+        upload_id: The id of the upload.
+
+    Returns:
+        HttpResponse: The staged image or a redirect to the stored image.
+    """
+
+    upload = get_object_or_404(Upload, id=upload_id)
+    if upload.status == UploadStatus.DONE:
+        response = HttpResponseRedirect(upload.url)
+        response['Cache-Control'] = 'public, max-age=86400'
+        return response
+
+    try:
+        response = FileResponse(open(upload.staged_path, 'rb'), content_type=upload.content_type)
+    except OSError:
+        raise Http404('Upload not found')
+    response['X-Content-Type-Options'] = 'nosniff'
+    # Staged files are user content served from the API origin: never let them run scripts
+    response['Content-Security-Policy'] = "default-src 'none'; sandbox"
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 @api_view(['POST'])
 def upload_file(request):
     """
     View for uploading files.
 
     This view handles POST requests for uploading files. It expects a 'file' file in the request data
-    and returns the URL, name, and size of the uploaded file.
+    and returns the URL, name, and size of the uploaded file. Files are stored once per content: if a
+    file with the same content was uploaded before, the stored file is returned (see `core.file_uploads`).
+    Large files should be uploaded in chunks with the views below.
 
     Parameters:
         request: The request object containing the uploaded file.
@@ -88,16 +208,122 @@ def upload_file(request):
         Response: Response containing the URL, name, and size of the uploaded file.
     """
 
-    uploaded_file = request.FILES['file']
-    fs = FileSystemStorage()
-    filename = fs.save(uploaded_file.name, uploaded_file)
-    file_url = fs.url(filename)
-    file_size = fs.size(filename)
+    uploaded_file = request.FILES.get('file')
+    if not uploaded_file:
+        return Response('Invalid input', status=400)
+
+    try:
+        blob = file_uploads.store(uploaded_file)
+    except file_uploads.UploadError as e:
+        return Response(str(e), status=400)
+    return _file_response(blob, uploaded_file.name)
+
+def _file_response(blob, name):
     return Response({
         'success': 1,
         'file': {
-            'url': file_url,
-            'name': uploaded_file.name,
-            'size': file_size,
+            'url': file_uploads.file_url(blob),
+            'name': name,
+            'size': blob.size,
         },
     })
+
+def _chunked_upload_state(upload):
+    return {'id': upload.id, 'name': upload.name, 'size': upload.size, 'offset': upload.offset}
+
+@api_view(['POST'])
+@authentication_classes([CustomAuthentication])
+@permission_classes([IsAuthenticated])
+def start_file_upload(request):
+    """
+    View for starting a chunked file upload.
+
+    Expects the 'name' of the file and, optionally, its total 'size' in bytes. The chunks are then
+    sent in order with PUT requests to the upload, and the upload is finalized once all are sent.
+    Chunked uploads require authentication and are only accessible to the user who started them.
+
+    Parameters:
+        request: The request object containing the name and size of the file.
+
+    Returns:
+        Response: Response containing the id of the upload, its offset (0) and the largest chunk size accepted.
+    """
+
+    name = request.data.get('name')
+    size = request.data.get('size')
+    if not name:
+        return Response('Invalid input', status=400)
+
+    try:
+        upload = file_uploads.start(name, int(size) if size not in (None, '') else None, owner=request.user)
+    except (ValueError, file_uploads.UploadError):
+        return Response('Invalid input', status=400)
+    return Response({**_chunked_upload_state(upload), 'max_chunk_size': file_uploads.CHUNKED_UPLOAD_MAX_CHUNK},
+                    status=201)
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@authentication_classes([CustomAuthentication])
+@permission_classes([IsAuthenticated])
+def file_upload_chunk(request, upload_id):
+    """
+    View for resuming, appending to and cancelling a chunked file upload.
+
+    GET returns the number of bytes received so far, from which an interrupted upload resumes.
+    PUT appends the raw request body at the offset given by the 'Upload-Offset' header (or the
+    'offset' query parameter), which must be the current offset; otherwise the response is 409
+    with the current offset. DELETE cancels the upload.
+
+    Parameters:
+        request: The request object, whose body is the chunk for PUT.
+        upload_id: The id of the upload.
+
+    Returns:
+        Response: Response containing the state of the upload.
+    """
+
+    # Uploads are only visible to their owner
+    upload = get_object_or_404(ChunkedUpload, id=upload_id, owner=request.user)
+    if request.method == 'GET':
+        return Response(_chunked_upload_state(upload))
+    if request.method == 'DELETE':
+        file_uploads.discard(upload)
+        return Response(status=204)
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.query_params.get('offset', '')))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return Response('Invalid offset', status=400)
+
+    try:
+        # The body is streamed from the request, never loaded at once
+        file_uploads.append(upload, offset, request, length)
+    except file_uploads.OffsetMismatch as e:
+        return Response({**_chunked_upload_state(upload), 'offset': e.offset}, status=409)
+    except file_uploads.UploadError as e:
+        return Response(str(e), status=400)
+    return Response(_chunked_upload_state(upload))
+
+@api_view(['POST'])
+@authentication_classes([CustomAuthentication])
+@permission_classes([IsAuthenticated])
+def finish_file_upload(request, upload_id):
+    """
+    View for finalizing a chunked file upload.
+
+    Optionally expects the 'sha256' hex digest of the file, which is checked against the received data.
+
+    Parameters:
+        request: The request object.
+        upload_id: The id of the upload.
+
+    Returns:
+        Response: Response containing the URL, name, and size of the uploaded file.
+    """
+
+    upload = get_object_or_404(ChunkedUpload, id=upload_id, owner=request.user)
+    try:
+        blob = file_uploads.finish(upload, request.data.get('sha256'))
+    except file_uploads.UploadError as e:
+        return Response(str(e), status=400)
+    return _file_response(blob, upload.name)
@@ -1,16 +1,22 @@
+import json
+
 from accounts.authenticate import CustomAuthentication
-from django.core.cache import cache
-from django.db.models import Count, F, Q
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
 from rest_framework import generics, status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
+from core import comment_tree, feed_cache, memberships, ranking, search, timelines, vote_buffer, votes
 from core.models import Comment, CommentVote, Post, Subrabbit, Vote, VoteType
+from core.pagination import KeysetPagination
 from core.permissions import IsAuthenticatedOrReadOnly
-from core.serializers import CommentSerializer, PostSerializer
+from core.serializers import CommentSerializer, PostListSerializer, PostSerializer
 
 
 class CreatePostView(APIView):
@@ -34,15 +40,33 @@ class CreatePostView(APIView):
             title=title,
             content=content,
             subrabbit=subrabbit,
-            author=user
+            author=user,
+            hot_score=ranking.hot(0, timezone.now()),
+            search_text=search.extract_text(content)
         )
+        feed_cache.subrabbit_changed(subrabbit.id)
+        search.post_saved(post)
+        if timelines.enabled():
+            transaction.on_commit(lambda: timelines.publish(post))
         return Response({'message': 'successfully created'}, status=status.HTTP_204_NO_CONTENT)
 
+def vote_response(result):
+    """Body of the vote endpoints: the caller's vote after the change and the new counters."""
+
+    return {
+        'voteType': result.vote_type,
+        'score': result.score,
+        'upvotes': result.upvotes,
+        'downvotes': result.downvotes,
+    }
+
 class VoteView(APIView):
     """
     View for voting on a post.
 
     This view allows authenticated users to vote on a post (either upvote or downvote).
+    Voting again with the same type withdraws the vote. The response contains the
+    caller's vote and the post's score after the change.
 
     Requires authentication.
     """
@@ -58,65 +82,72 @@ class VoteView(APIView):
         if not post_id or not vote_type:
             return Response({'detail': 'Missing required fields'}, status=status.HTTP_400_BAD_REQUEST)
 
-        post = get_object_or_404(Post, id=post_id)
-
         if vote_type not in [VoteType.UP, VoteType.DOWN]:
             return Response({'detail': 'Invalid vote type'}, status=status.HTTP_400_BAD_REQUEST)
 
-        vote, created = Vote.objects.get_or_create(user=user, post=post, defaults={'type': vote_type})
-
-        if not created:
-            if vote.type == vote_type:
-                vote.delete()
-            else:
-                vote.type = vote_type
-                vote.save()
+        try:
+            post_id = int(post_id)
+        except ValueError:
+            return Response({'detail': 'Invalid post id'}, status=status.HTTP_400_BAD_REQUEST)
+        if vote_buffer.enabled():
+            result = vote_buffer.record(user, post_id, vote_type)
+        else:
+            result = votes.toggle_post_vote(user, post_id, vote_type)
+        if result is None:
+            raise NotFound('Post not found')
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(vote_response(result))
 
-class PostPagination(PageNumberPagination):
+class PostPagination(KeysetPagination):
     page_size = 3
 
+class CommentPagination(KeysetPagination):
+    page_size = 20
+
+class PostSearchPagination(KeysetPagination):
+    page_size = 10
+
+def with_list_fields(posts):
+    """
+    Prepare a post queryset for `PostListSerializer`: select the author and subrabbit.
+    """
+
+    return posts.select_related('author', 'subrabbit')
+
 class PostListView(generics.ListAPIView):
     """
     View for listing posts.
 
     This view allows users to retrieve a list of posts, optionally filtered by Subrabbit name.
-    Posts are ordered by the number of votes, number of comments, and if the user is authenticated,
-    the view retrieves posts that are in the communities the user has joined.
+    Posts are ordered according to the `sort` query parameter (hot, new, top or rising,
+    defaulting to hot), and if the user is authenticated, the view retrieves posts that
+    are in the communities the user has joined. Sorted by new, their pages are read
+    from the user's materialized timeline when Redis is available.
     """
 
-    serializer_class = PostSerializer
+    serializer_class = PostListSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     pagination_class = PostPagination
 
+    def get_sort(self):
+        sort = self.request.query_params.get('sort', ranking.DEFAULT_SORT)
+        if sort not in ranking.SORT_ORDERINGS:
+            raise ValidationError({'sort': f'Must be one of: {", ".join(ranking.SORT_ORDERINGS)}.'})
+        return sort
+
     def get_queryset(self):
         user = self.request.user
         subrabbit_name = self.request.query_params.get('subrabbitName')
-        page = self.request.query_params.get('page')
-
-        # Cache key based on user authentication and subrabbit_name
-        cache_key = f'posts:{subrabbit_name}:{user.id if user.is_authenticated else "anon"}:page{page}'
-
-        if page == '1':
-            cached_posts = cache.get(cache_key)
-            if cached_posts is not None:
-                return cached_posts
-
-        posts = self.fetch_posts(subrabbit_name, user)
-
-        if page == '1':
-            cache.set(cache_key, posts)
-
-        return posts
+        return self.fetch_posts(subrabbit_name, user, self.get_sort())
 
-    def fetch_posts(self, subrabbit_name, user):
+    def fetch_posts(self, subrabbit_name, user, sort=ranking.DEFAULT_SORT):
         """
         Fetch posts from the database.
 
         Parameters:
             subrabbit_name: Name of the Subrabbit to filter posts.
             user: User object representing the authenticated user.
+            sort: One of the sort modes in `core.ranking.SORT_ORDERINGS`.
 
         Returns:
             posts: List of posts fetched from the database.
@@ -126,25 +157,92 @@ class PostListView(generics.ListAPIView):
         if subrabbit_name:
             posts = posts.filter(subrabbit__name=subrabbit_name)
         if user.is_authenticated:
-            posts = posts.filter(subrabbit__subscribers=user)
-
-        # Annotate post objects based on their votes, number of comments, and net votes
-        posts = posts.annotate(
-            upvotes=Count('votes', filter=Q(votes__type=VoteType.UP)),
-            downvotes=Count('votes', filter=Q(votes__type=VoteType.DOWN)),
-            net_votes=F('upvotes') - F('downvotes'),
-            num_comments=Count('comments')
-        )
+            subscribed_ids = memberships.for_user(user).subscribed
+            if not subrabbit_name and sort == 'new' and timelines.enabled():
+                # The newest posts are paged from the user's materialized timeline
+                post_ids = self.timeline_page(user, subscribed_ids)
+                if post_ids is not None:
+                    posts = posts.filter(id__in=post_ids)
+            posts = posts.filter(subrabbit_id__in=subscribed_ids)
+
+        # Rising only lists posts that are still inside the rising window
+        if sort == 'rising':
+            posts = posts.filter(rising_score__gt=0)
+
+        # Every sort mode orders by stored, indexed columns
+        posts = posts.order_by(*ranking.SORT_ORDERINGS[sort])
 
-        # Order by net_votes descending, created_at descending, and num_comments descending
-        posts = posts.order_by('-net_votes', '-created_at', '-num_comments')
+        return with_list_fields(posts)
 
-        posts = posts.select_related('author', 'subrabbit')
+    def timeline_page(self, user, subscribed_ids):
+        """
+        Return the ids of the posts of the requested home feed page (sorted by new) from
+        the user's timeline, or None if the timeline does not reach that page.
+        """
 
-        return posts
+        paginator = self.paginator
+        paginator.ordering = ranking.SORT_ORDERINGS['new']
+        after = paginator.get_position(self.request, Post)
+        # One more than the page, for the paginator to detect a next page
+        limit = paginator.get_page_size(self.request) + 1
+        return timelines.home_post_ids(user.id, subscribed_ids, limit, after)
+
+    def list(self, request, *args, **kwargs):
+        # Serve the rendered page from the feed cache, keyed by feed, sort and cursor
+        self.get_sort()
+        cache_key = feed_cache.page_key(request, request.query_params.get('subrabbitName'))
+        content = feed_cache.get_page(cache_key)
+
+        if content is None:
+            response = super().list(request, *args, **kwargs)
+            content = JSONRenderer().render(response.data)
+            feed_cache.set_page(cache_key, content)
+
+        if vote_buffer.enabled():
+            # Cached pages only include written votes
+            page = json.loads(content)
+            vote_buffer.merge_posts(page['results'])
+            content = JSONRenderer().render(page)
+
+        return HttpResponse(content, content_type='application/json')
+
+class PostSearchView(generics.ListAPIView):
+    """
+    View for searching posts.
+
+    This view allows users to search the title and content of posts with the `q` query
+    parameter. Results are ranked by relevance (see `core.search`), can be restricted with
+    the `subrabbit` (name), `author` (username) and `t` (hour, day, week, month, year or
+    all) query parameters, and are cursor-paginated.
+    """
+
+    serializer_class = PostListSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = PostSearchPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        query = params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This query parameter is required.'})
+        window = params.get('t', 'all')
+        if window not in search.TIME_WINDOWS:
+            raise ValidationError({'t': f'Must be one of: {", ".join(search.TIME_WINDOWS)}.'})
+
+        posts = Post.objects.all()
+        if params.get('subrabbit'):
+            posts = posts.filter(subrabbit__name=params['subrabbit'])
+        if params.get('author'):
+            posts = posts.filter(author__username=params['author'])
+        if search.TIME_WINDOWS[window]:
+            posts = posts.filter(created_at__gte=timezone.now() - search.TIME_WINDOWS[window])
+
+        return with_list_fields(search.search_posts(posts, query))
 
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
+        if vote_buffer.enabled():
+            vote_buffer.merge_posts(response.data['results'])
         return response
 
 class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -154,10 +252,30 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
     This view allows users to retrieve, update, or delete a specific post by its primary key.
     """
 
-    queryset = Post.objects.select_related('author', 'subrabbit').all()
+    queryset = Post.objects.select_related('author', 'subrabbit__creator').all()
     serializer_class = PostSerializer
     lookup_url_kwarg = 'pk'
 
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        if vote_buffer.enabled():
+            vote_buffer.merge_posts([response.data])
+        return response
+
+    def perform_update(self, serializer):
+        post = serializer.save()
+        feed_cache.posts_updated(post.subrabbit_id)
+        search.post_saved(post)
+
+    def perform_destroy(self, instance):
+        subrabbit_id = instance.subrabbit_id
+        post_id = instance.id
+        instance.delete()
+        feed_cache.subrabbit_changed(subrabbit_id)
+        search.post_deleted(post_id)
+        if timelines.enabled():
+            transaction.on_commit(lambda: timelines.retract(subrabbit_id, [post_id]))
+
     # Handle DELETE request to delete a post.
     def delete(self, request, *args, **kwargs):
         response = super().delete(request, *args, **kwargs)
@@ -180,51 +298,136 @@ class CreateComment(generics.CreateAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
 
-    # Perform the creation of a new comment.
-    def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+    # Perform the creation of a new comment, threading it under its parent and bumping counters.
+    def perform_create(self, serializer, parent_comment=None):
+        votes.create_comment(serializer, parent=parent_comment, author=self.request.user)
 
     # Handle POST request to create a new comment.
     def create(self, request, *args, **kwargs):
         data = request.data.copy()  # Make a mutable copy
         post = Post.objects.get(id=data['postId'])
         parent_comment = None
-        if 'replyToId' in data:
+        if data.get('replyToId'):
             parent_comment = Comment.objects.get(id=data['replyToId'])
+            if parent_comment.parent_post_id != post.id:
+                raise ValidationError({'replyToId': 'The parent comment belongs to another post.'})
+            if parent_comment.depth + 1 >= comment_tree.MAX_DEPTH:
+                raise ValidationError({'replyToId': 'This thread is too deep to reply to.'})
         data['parent_post'] = post.id
         if parent_comment:
             data['parent_comment_id'] = parent_comment.id
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
 
-        self.perform_create(serializer)
+        self.perform_create(serializer, parent_comment)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class CommentListView(generics.ListAPIView):
+class PostCommentsMixin:
+    """
+    Mixin providing the comments of the post given by the `post_id` URL kwarg, ordered
+    according to the `sort` query parameter (best, top, new or controversial, defaulting
+    to best).
+    """
+
+    def get_sort(self):
+        sort = self.request.query_params.get('sort', ranking.DEFAULT_COMMENT_SORT)
+        if sort not in ranking.COMMENT_SORT_ORDERINGS:
+            raise ValidationError({'sort': f'Must be one of: {", ".join(ranking.COMMENT_SORT_ORDERINGS)}.'})
+        return sort
+
+    def get_queryset(self):
+        post_id = self.kwargs.get('post_id')
+        return Comment.objects.filter(parent_post_id=post_id) \
+                              .order_by(*ranking.COMMENT_SORT_ORDERINGS[self.get_sort()]) \
+                              .select_related('author')
+
+class CommentListView(PostCommentsMixin, generics.ListAPIView):
     """
     View for listing comments for a specific post.
-    This view allows users to retrieve a list of comments for a given post,
-    ordered by net votes and creation date.
+    This view allows users to retrieve a cursor-paginated list of comments for a given post,
+    in the order selected by the `sort` query parameter.
     """
 
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = CommentPagination
 
-    def get_queryset(self):
+class CommentTreeView(PostCommentsMixin, generics.GenericAPIView):
+    """
+    View for retrieving the comments of a post as a nested tree.
+
+    Only the comments returned are loaded: a keyset page of siblings, then one query per
+    level over the materialized paths of the comments shown (see `core.comment_tree`).
+    At most `depth` levels (default 4, max 10) and `limit` siblings per level (default
+    10, max 50) are returned. Collapsed branches carry a
+    `more` object with the number of hidden comments and a cursor; requesting this view
+    with `cursor` resumes the listing at that branch. Further top-level comments are
+    available through the `next` link.
+    """
+
+    serializer_class = CommentSerializer
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
+    def get_bound(self, name, default, maximum):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: 'Must be an integer.'})
+        return min(max(value, 1), maximum)
+
+    def get(self, request, *args, **kwargs):
+        depth = self.get_bound('depth', 4, 10)
+        limit = self.get_bound('limit', 10, 50)
         post_id = self.kwargs.get('post_id')
-        comments = Comment.objects.filter(parent_post_id=post_id).annotate(
-            upvotes=Count('comment_votes', filter=Q(comment_votes__type=VoteType.UP)),
-            downvotes=Count('comment_votes', filter=Q(comment_votes__type=VoteType.DOWN))
-        ).annotate(net_votes=F('upvotes') - F('downvotes')).order_by('-net_votes', '-created_at')
-        return comments
+        sort = self.get_sort()
+        parent, after, seen = None, None, 0
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                parent_id, path, sort, after, seen = comment_tree.parse_continuation(cursor)
+            except ValueError:
+                raise NotFound('Invalid cursor')
+            if sort not in ranking.COMMENT_SORT_ORDERINGS:
+                raise NotFound('Invalid cursor')
+            if parent_id is not None:
+                parent = Comment(id=parent_id, path=path, depth=path.count(comment_tree.SEPARATOR))
+        ordering = ranking.COMMENT_SORT_ORDERINGS[sort]
+
+        # Only the comments shown are loaded: a page of siblings, then their replies level by level
+        try:
+            children = comment_tree.fetch_thread(
+                Comment.objects.filter(parent_post_id=post_id).select_related('author'),
+                ordering, parent=parent, after=after, depth=depth, limit=limit,
+            )
+        except ValueError:
+            raise NotFound('Invalid cursor')
+        if parent:
+            total = Comment.objects.filter(id=parent.id).values_list('descendant_count', flat=True).first()
+        else:
+            total = Post.objects.filter(id=post_id).values_list('comment_count', flat=True).first()
+        serializer = self.get_serializer()
+
+        results, more = comment_tree.build_tree(
+            children, serializer.to_representation, parent=parent, depth=depth, limit=limit,
+            sort=sort, ordering=ordering, seen=seen, total=total or 0,
+        )
+        next_url = None
+        if more:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', more['cursor'])
+        return Response({
+            'next': next_url,
+            'more_count': more['count'] if more else 0,
+            'results': results,
+        })
 
 class CommentVoteView(APIView):
     """
     View for voting on a comment.
 
     This view allows authenticated users to vote on a comment by specifying the comment ID
-    and the type of vote (upvote or downvote).
+    and the type of vote (upvote or downvote). The response contains the caller's vote and
+    the comment's score after the change.
 
     Requires authentication.
     """
@@ -239,15 +442,71 @@ class CommentVoteView(APIView):
         vote_type = request.data.get('voteType')
         if not comment_id or not vote_type:
             return Response({'detail': 'Missing required fields'}, status=status.HTTP_400_BAD_REQUEST)
-        comment = get_object_or_404(Comment, id=comment_id)
         if vote_type not in [VoteType.UP, VoteType.DOWN]:
             return Response({'detail': 'Invalid vote type'}, status=status.HTTP_400_BAD_REQUEST)
-        vote, created = CommentVote.objects.get_or_create(user=user, comment=comment, defaults={'type': vote_type})
-        if not created:
-            if vote.type == vote_type:
-                vote.delete()
-            else:
-                vote.type = vote_type
-                vote.save()
-
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        try:
+            comment_id = int(comment_id)
+        except ValueError:
+            return Response({'detail': 'Invalid comment id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = votes.toggle_comment_vote(user, comment_id, vote_type)
+        if result is None:
+            raise NotFound('Comment not found')
+
+        return Response(vote_response(result))
+
+class ViewerStateView(APIView):
+    """
+    View for the requesting user's state on a page of items.
+
+    Post, comment and feed payloads are the same for every viewer, so they can be cached
+    and shared; the viewer's own votes and subscriptions are fetched here for the items
+    on screen. The `posts` and `comments` query parameters take comma-separated ids and
+    `subrabbits` comma-separated names, at most `max_items` of each. The response maps
+    every post and comment id to the user's vote type (or null), and every subrabbit
+    name to whether the user subscribes to it, with one indexed query per kind.
+
+    Requires authentication.
+    """
+
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomAuthentication]
+    max_items = 100
+
+    def get_items(self, name, convert=str):
+        values = [value for value in self.request.query_params.get(name, '').split(',') if value]
+        if len(values) > self.max_items:
+            raise ValidationError({name: f'At most {self.max_items} items are allowed.'})
+        try:
+            return list(dict.fromkeys(convert(value) for value in values))
+        except ValueError:
+            raise ValidationError({name: 'Must be a comma-separated list of ids.'})
+
+    def get(self, request, format=None):
+        user = request.user
+        post_ids = self.get_items('posts', int)
+        comment_ids = self.get_items('comments', int)
+        names = self.get_items('subrabbits')
+
+        post_votes = dict.fromkeys(post_ids)
+        if post_ids:
+            post_votes.update(Vote.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', 'type'))
+            if vote_buffer.enabled():
+                post_votes.update(vote_buffer.pending_votes(user, post_ids))
+
+        comment_votes = dict.fromkeys(comment_ids)
+        if comment_ids:
+            comment_votes.update(CommentVote.objects.filter(user=user, comment_id__in=comment_ids)
+                                 .values_list('comment_id', 'type'))
+
+        subscriptions = dict.fromkeys(names, False)
+        if names:
+            subscribed = memberships.for_user(user).subscribed
+            for name, subrabbit_id in Subrabbit.objects.filter(name__in=names).values_list('name', 'id'):
+                subscriptions[name] = subrabbit_id in subscribed
+
+        return Response({
+            'posts': post_votes,
+            'comments': comment_votes,
+            'subrabbits': subscriptions,
+        })
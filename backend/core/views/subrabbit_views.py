@@ -1,35 +1,52 @@
 from accounts.authenticate import CustomAuthentication
-from django.db.models import Count
+from accounts.models import User
 from rest_framework import generics, status
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
+from rest_framework.views import APIView
 
+from core import autocomplete, feed_cache, memberships, timelines
 from core.models import Subrabbit
+from core.pagination import KeysetPagination
 from core.permissions import IsAuthenticatedOrReadOnly
-from core.serializers import SubrabbitSerializer, SubrabbitSerializer_detailed
+from core.serializers import MemberSerializer, SubrabbitSerializer, SubrabbitSerializer_detailed
 
+from django.db import transaction
 from django.db.utils import IntegrityError
 
-class SubrabbitListCreateView(generics.ListCreateAPIView):
+class ViewerMembershipsMixin:
+    """
+    Mixin putting the requesting user's cached memberships in the serializer context,
+    from which subrabbit serializers compute the `joined` flag without queries. Anonymous
+    viewers get no memberships, so `joined` is None for them rather than False.
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        context['memberships'] = memberships.for_user(user) if user.is_authenticated else None
+        return context
+
+class SubrabbitListCreateView(ViewerMembershipsMixin, generics.ListCreateAPIView):
     """
     API view to list and create subrabbits.
 
-    GET: Returns a list of subrabbits.
+    GET: Returns a cursor-paginated list of subrabbits, largest first.
     POST: Creates a new subrabbit.
 
-    - For GET requests, returns detailed information.
+    - For GET requests, returns summary information.
     - For POST requests, validates input and creates a new subrabbit.
     """
 
     permission_classes = [IsAuthenticatedOrReadOnly]
     authentication_classes = [CustomAuthentication]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return Subrabbit.objects.annotate(num_members=Count('subscribers')) \
-                                .select_related('creator') \
-                                .prefetch_related('subscribers', 'moderators') \
-                                .order_by('-num_members', '-created_at')
+        return Subrabbit.objects.select_related('creator') \
+                                .order_by('-member_count', '-created_at', '-id')
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -42,8 +59,12 @@ class SubrabbitListCreateView(generics.ListCreateAPIView):
             serializer.save(
                 creator=self.request.user,
                 subscribers=[self.request.user],
-                moderators=[self.request.user]
+                moderators=[self.request.user],
+                member_count=1
             )
+            # The name may have been looked up (and cached as missing) before
+            feed_cache.forget_subrabbit_name(serializer.instance.name)
+            autocomplete.subrabbit_saved(serializer.instance)
         except ValidationError as e:
             raise ValidationError(e.message_dict)
 
@@ -78,7 +99,7 @@ class SubrabbitListCreateView(generics.ListCreateAPIView):
         return Response({"detail": "Database integrity error: " + str(e)}, status=status.HTTP_409_CONFLICT)
 
 
-class SubrabbitDetail(generics.RetrieveUpdateDestroyAPIView):
+class SubrabbitDetail(ViewerMembershipsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     API view for retrieving, updating, or deleting a Subrabbit instance.
 
@@ -90,9 +111,7 @@ class SubrabbitDetail(generics.RetrieveUpdateDestroyAPIView):
 
     permission_classes = [IsAuthenticatedOrReadOnly]
     authentication_classes = [CustomAuthentication]
-    queryset = Subrabbit.objects.select_related('creator') \
-                                .prefetch_related('subscribers', 'moderators') \
-                                .all()
+    queryset = Subrabbit.objects.select_related('creator').all()
     lookup_field = 'name'
 
     # Return the appropriate serializer class based on the HTTP method of the request.
@@ -101,17 +120,38 @@ class SubrabbitDetail(generics.RetrieveUpdateDestroyAPIView):
             return SubrabbitSerializer_detailed
         return SubrabbitSerializer
 
+    # Invalidate cached feeds, and the cached name lookup in case of a rename.
+    def perform_update(self, serializer):
+        name = serializer.instance.name
+        subrabbit = serializer.save()
+        feed_cache.forget_subrabbit_name(name)
+        feed_cache.subrabbit_changed(subrabbit.id)
+        autocomplete.subrabbit_saved(subrabbit)
+
+    # Invalidate cached feeds that contained the posts of the deleted Subrabbit.
+    def perform_destroy(self, instance):
+        subrabbit_id = instance.id
+        if timelines.enabled():
+            # The subscriptions are deleted with the subrabbit: read them first
+            post_ids = list(instance.posts.order_by('-created_at', '-id')
+                            .values_list('id', flat=True)[:timelines.TIMELINE_LENGTH])
+            subscriber_ids = list(instance.subscribers.values_list('id', flat=True))
+            transaction.on_commit(lambda: timelines.retract(subrabbit_id, post_ids, subscriber_ids))
+        instance.delete()
+        feed_cache.forget_subrabbit_name(instance.name)
+        feed_cache.subrabbit_changed(subrabbit_id)
+        autocomplete.subrabbit_deleted(subrabbit_id)
+
     # Retrieve detailed information about a Subrabbit instance.
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
         data = serializer.data
         if request.user.is_authenticated:
-            user = request.user
-            instance = self.get_object()
-            # Check if the authenticated user is a subscriber of the Subrabbit
-            is_subscriber = instance.subscribers.filter(id=user.id).exists()
-            data['isSubscriber'] = is_subscriber
+            # Viewer-relative flags come from the user's cached membership sets
+            viewer = memberships.for_user(request.user)
+            data['isSubscriber'] = instance.id in viewer.subscribed
+            data['isModerator'] = instance.id in viewer.moderated
         return Response(data)
 
 class SubscribeView(generics.UpdateAPIView):
@@ -132,7 +172,7 @@ class SubscribeView(generics.UpdateAPIView):
     # Handle PUT request to subscribe to a Subrabbit.
     def update(self, request, *args, **kwargs):
         subrabbit = self.get_object()
-        subrabbit.subscribers.add(request.user)
+        memberships.subscribe(request.user, subrabbit)
         return Response({'message': 'subscribed successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 class UnsubscribeView(generics.UpdateAPIView):
@@ -153,20 +193,53 @@ class UnsubscribeView(generics.UpdateAPIView):
     # Handle PUT request to unsubscribe from a Subrabbit.
     def update(self, request, *args, **kwargs):
         subrabbit = self.get_object()
-        subrabbit.subscribers.remove(request.user)
+        memberships.unsubscribe(request.user, subrabbit)
         return Response({'message': 'unsubscribed successfully'} ,status=status.HTTP_204_NO_CONTENT)
 
-class SearchView(generics.ListAPIView):
+class MemberPagination(KeysetPagination):
+    page_size = 20
+
+class SubrabbitMembersView(generics.ListAPIView):
     """
-    View for searching subrabbits.
+    View for listing the subscribers of a Subrabbit.
 
-    This view allows users to search for subrabbits by name. 
-    It returns a list of subrabbits whose names start with the specified query string.
+    Members are returned in cursor-paginated pages, most recent accounts first, so
+    the cost of a page does not depend on the size of the community.
     """
 
-    serializer_class = SubrabbitSerializer
+    serializer_class = MemberSerializer
+    pagination_class = MemberPagination
+    relation = 'subscriptions'
+
     def get_queryset(self):
-        q = self.request.query_params.get('q', None)
-        if q is not None:
-            return Subrabbit.objects.filter(name__startswith=q)[:5]
-        return Subrabbit.objects.none()
+        subrabbit_id = feed_cache.subrabbit_id_for(self.kwargs['name'])
+        if not subrabbit_id:
+            raise NotFound('Subrabbit not found')
+        return User.objects.filter(**{self.relation: subrabbit_id}).order_by('-id')
+
+class SubrabbitModeratorsView(SubrabbitMembersView):
+    """
+    View for listing the moderators of a Subrabbit, cursor-paginated like its members.
+    """
+
+    relation = 'moderates'
+
+class SearchView(APIView):
+    """
+    View for searching subrabbits.
+
+    This view allows users to search for subrabbits by name. It returns the subrabbits
+    whose names start with the specified query string, ignoring case, largest first,
+    answered from the in-memory autocomplete index (see `core.autocomplete`).
+    """
+
+    # Handle GET request with the `q` prefix and an optional `limit` (default 5, max 10).
+    def get(self, request, format=None):
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return Response([])
+        try:
+            limit = min(max(int(request.query_params.get('limit', 5)), 1), 10)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'})
+        return Response(autocomplete.suggest(q, limit))
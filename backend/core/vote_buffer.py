@@ -0,0 +1,468 @@
+"""
+Write-behind buffer for post votes.
+
+When `VOTE_WRITE_BEHIND` is enabled, voting on a post does not write to the database.
+`record()` stores the voter's intent (up, down or no vote) keyed by (user, post), and a
+later vote of the same user on the same post replaces it, so a burst of votes on a viral
+post collapses to one pending intent per voter. Per-post deltas of the vote counters are
+kept next to the intents.
+
+`flush()` writes the buffered intents in bulk, a batch at a time: the votes are created,
+switched and deleted with a few statements per batch, and each post's counters and
+ranking scores are updated once per batch, however many votes it received. Every worker
+runs a flusher thread that calls it every `VOTE_FLUSH_INTERVAL` seconds, and the
+`flush_votes` management command drains the buffer on demand. The write rate on the
+vote table and the post rows is thereby bounded by the flush interval, not by the
+number of incoming votes.
+
+Until a batch is written, reads merge the pending state into what they display:
+`merge_posts()` adds the pending deltas to the serialized counters, and
+`pending_votes()` gives the viewer's own pending votes to the viewer state endpoint.
+The deltas a batch applies to the posts are withdrawn from the buffered deltas as soon
+as its transaction commits, so that reads do not count them twice while the rest of the
+buffer is being written.
+
+A vote without a buffered intent toggles the vote stored in the database, which
+`record()` reads before buffering. Each completed flush bumps a generation counter, and
+the vote is buffered only if no flush completed since the stored vote was read;
+otherwise the stored vote is read again.
+
+The buffer is kept in Redis when the default cache is `django_redis`, and is then shared
+by every worker. Otherwise it is kept in process memory, which only suits development
+and single-process deployments: votes buffered by a process are lost if it is killed
+before its next flush.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from accounts.models import User
+from core import feed_cache, ranking, timelines
+from core.models import Post, Vote, VoteType
+from core.votes import VoteResult, vote_deltas
+
+logger = logging.getLogger(__name__)
+
+VOTE_WRITE_BEHIND = getattr(settings, 'VOTE_WRITE_BEHIND', False)
+VOTE_FLUSH_INTERVAL = getattr(settings, 'VOTE_FLUSH_INTERVAL', 5)
+# Intents written per transaction by flush()
+FLUSH_BATCH_SIZE = 500
+# Seconds after which the flush lock of a crashed flusher expires
+FLUSH_LOCK_TIMEOUT = 60
+
+INTENTS_KEY = 'votes:pending:intents'
+DELTAS_KEY = 'votes:pending:deltas'
+FLUSHING_INTENTS_KEY = 'votes:flushing:intents'
+FLUSHING_DELTAS_KEY = 'votes:flushing:deltas'
+FLUSH_LOCK_KEY = 'votes:flush-lock'
+GENERATION_KEY = 'votes:generation'
+
+# Replace the intent of a user on a post and count the change. The previous state is the
+# pending intent, else the intent being flushed, else the vote stored in the database,
+# unless a flush completed since it was read: nothing is recorded then (nil is returned).
+# KEYS are (intents, flushing intents, deltas, generation); ARGV is (user:post, stored
+# vote, vote type, post id, generation the stored vote was read at). Intents are 'UP',
+# 'DOWN', or '' for no vote.
+RECORD_SCRIPT = """
+local previous = redis.call('HGET', KEYS[1], ARGV[1])
+if not previous then previous = redis.call('HGET', KEYS[2], ARGV[1]) end
+if not previous then
+    if (redis.call('GET', KEYS[4]) or '0') ~= ARGV[5] then return nil end
+    previous = ARGV[2]
+end
+local current = ARGV[3]
+if previous == current then current = '' end
+redis.call('HSET', KEYS[1], ARGV[1], current)
+local up = (current == 'UP' and 1 or 0) - (previous == 'UP' and 1 or 0)
+local down = (current == 'DOWN' and 1 or 0) - (previous == 'DOWN' and 1 or 0)
+redis.call('HINCRBY', KEYS[3], ARGV[4] .. ':up', up)
+redis.call('HINCRBY', KEYS[3], ARGV[4] .. ':down', down)
+return current
+"""
+
+# Move the pending intents and deltas aside for flushing, unless a batch whose flush was
+# interrupted is still there, and return the batch.
+# KEYS are (intents, deltas, flushing intents, flushing deltas).
+TAKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[3])
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('RENAME', KEYS[2], KEYS[4])
+    end
+end
+return redis.call('HGETALL', KEYS[3])
+"""
+
+
+def enabled():
+    """Return True if post votes are buffered instead of written at once."""
+
+    return VOTE_WRITE_BEHIND
+
+
+def _field(user_id, post_id):
+    return f'{user_id}:{post_id}'
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class StoredVoteChanged(Exception):
+    """Raised by `record` when a flush completed since the stored vote was read."""
+
+
+class RedisBuffer:
+    """Buffer shared by every worker, in Redis hashes."""
+
+    def __init__(self):
+        self.redis = timelines._redis()
+        self.record_script = self.redis.register_script(RECORD_SCRIPT)
+        self.take_script = self.redis.register_script(TAKE_SCRIPT)
+        self.flush_lock = self.redis.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT)
+
+    def generation(self):
+        return _decode(self.redis.get(GENERATION_KEY)) or '0'
+
+    def record(self, user_id, post_id, vote_type, stored, generation):
+        current = self.record_script(
+            keys=[INTENTS_KEY, FLUSHING_INTENTS_KEY, DELTAS_KEY, GENERATION_KEY],
+            args=[_field(user_id, post_id), stored or '', vote_type, post_id, generation],
+        )
+        if current is None:
+            raise StoredVoteChanged
+        return _decode(current) or None
+
+    def deltas(self, post_ids):
+        fields = [f'{post_id}:{kind}' for post_id in post_ids for kind in ('up', 'down')]
+        pipe = self.redis.pipeline()
+        pipe.hmget(DELTAS_KEY, fields)
+        pipe.hmget(FLUSHING_DELTAS_KEY, fields)
+        pending, flushing = pipe.execute()
+        values = [int(a or 0) + int(b or 0) for a, b in zip(pending, flushing)]
+        return {post_id: (values[2 * i], values[2 * i + 1]) for i, post_id in enumerate(post_ids)}
+
+    def intents(self, user_id, post_ids):
+        fields = [_field(user_id, post_id) for post_id in post_ids]
+        pipe = self.redis.pipeline()
+        pipe.hmget(INTENTS_KEY, fields)
+        pipe.hmget(FLUSHING_INTENTS_KEY, fields)
+        pending, flushing = pipe.execute()
+        return {post_id: _decode(a if a is not None else b) or None
+                for post_id, a, b in zip(post_ids, pending, flushing) if a is not None or b is not None}
+
+    def acquire(self):
+        return self.flush_lock.acquire(blocking=False)
+
+    def release(self):
+        self.flush_lock.release()
+
+    def renew(self):
+        # Raises LockNotOwnedError if the lock expired, before another flusher can be misled
+        self.flush_lock.reacquire()
+
+    def take(self):
+        values = self.take_script(keys=[INTENTS_KEY, DELTAS_KEY, FLUSHING_INTENTS_KEY, FLUSHING_DELTAS_KEY])
+        intents = {}
+        for field, intent in zip(values[::2], values[1::2]):
+            user_id, post_id = _decode(field).split(':')
+            intents[int(user_id), int(post_id)] = _decode(intent) or None
+        return intents
+
+    def written(self, counters):
+        pipe = self.redis.pipeline(transaction=True)
+        for post_id, (up, down) in counters.items():
+            pipe.hincrby(FLUSHING_DELTAS_KEY, f'{post_id}:up', -up)
+            pipe.hincrby(FLUSHING_DELTAS_KEY, f'{post_id}:down', -down)
+        pipe.execute()
+
+    def done(self):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(FLUSHING_INTENTS_KEY, FLUSHING_DELTAS_KEY)
+        pipe.incr(GENERATION_KEY)
+        pipe.execute()
+
+
+class MemoryBuffer:
+    """Buffer of a single process, for development without Redis."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.flushing = {}
+        self.pending_deltas = defaultdict(lambda: [0, 0])
+        self.flushing_deltas = {}
+        self.flushes = 0
+
+    def generation(self):
+        with self.lock:
+            return self.flushes
+
+    def record(self, user_id, post_id, vote_type, stored, generation):
+        key = (user_id, post_id)
+        with self.lock:
+            if key in self.pending:
+                previous = self.pending[key]
+            elif key in self.flushing:
+                previous = self.flushing[key]
+            elif generation != self.flushes:
+                raise StoredVoteChanged
+            else:
+                previous = stored
+            current = None if previous == vote_type else vote_type
+            self.pending[key] = current
+            up, down = vote_deltas(previous, current)
+            self.pending_deltas[post_id][0] += up
+            self.pending_deltas[post_id][1] += down
+        return current
+
+    def deltas(self, post_ids):
+        result = {}
+        with self.lock:
+            for post_id in post_ids:
+                pending = self.pending_deltas.get(post_id, (0, 0))
+                flushing = self.flushing_deltas.get(post_id, (0, 0))
+                result[post_id] = (pending[0] + flushing[0], pending[1] + flushing[1])
+        return result
+
+    def intents(self, user_id, post_ids):
+        result = {}
+        with self.lock:
+            for post_id in post_ids:
+                key = (user_id, post_id)
+                if key in self.pending:
+                    result[post_id] = self.pending[key]
+                elif key in self.flushing:
+                    result[post_id] = self.flushing[key]
+        return result
+
+    def acquire(self):
+        return self.flush_lock.acquire(blocking=False)
+
+    def release(self):
+        self.flush_lock.release()
+
+    def renew(self):
+        pass
+
+    def take(self):
+        with self.lock:
+            if not self.flushing:
+                self.flushing, self.pending = self.pending, {}
+                self.flushing_deltas, self.pending_deltas = self.pending_deltas, defaultdict(lambda: [0, 0])
+            return dict(self.flushing)
+
+    def written(self, counters):
+        with self.lock:
+            for post_id, (up, down) in counters.items():
+                deltas = self.flushing_deltas.setdefault(post_id, [0, 0])
+                deltas[0] -= up
+                deltas[1] -= down
+
+    def done(self):
+        with self.lock:
+            self.flushing = {}
+            self.flushing_deltas = {}
+            self.flushes += 1
+
+
+_buffer = None
+_flusher = None
+_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _lock:
+        if _buffer is None:
+            _buffer = RedisBuffer() if timelines.enabled() else MemoryBuffer()
+        return _buffer
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(VOTE_FLUSH_INTERVAL)
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception('Flushing buffered votes failed')
+
+
+def start_flusher():
+    """Start the flusher thread of this process, and flush the buffer when the process exits."""
+
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, name='vote-flush', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+
+
+def record(user, post_id, vote_type):
+    """
+    Buffer a vote of a user on a post, with the toggling rules of `votes.toggle_post_vote`.
+
+    Parameters:
+        user: The voting user.
+        post_id: Id of the post.
+        vote_type: A `VoteType`.
+
+    Returns:
+        VoteResult or None: The user's vote and the post's counters including pending
+        votes, or None if the post does not exist.
+    """
+
+    buffer = get_buffer()
+    while True:
+        # Read the stored state after the generation: a flush completing in between makes
+        # the buffer refuse it
+        generation = buffer.generation()
+        counters = Post.objects.filter(id=post_id).values_list('score', 'upvotes', 'downvotes').first()
+        if counters is None:
+            return None
+        stored = Vote.objects.filter(user=user, post_id=post_id).values_list('type', flat=True).first()
+        try:
+            current = buffer.record(user.id, post_id, vote_type, stored, generation)
+        except StoredVoteChanged:
+            continue
+        break
+    up, down = buffer.deltas([post_id])[post_id]
+    start_flusher()
+
+    score, upvotes, downvotes = counters
+    return VoteResult(current, score + up - down, upvotes + up, downvotes + down)
+
+
+def merge_posts(posts):
+    """
+    Merge the counter deltas of buffered votes into serialized posts.
+
+    Parameters:
+        posts: List of post dicts with `id`, `score`, `upvotes` and `downvotes`, updated
+            in place.
+    """
+
+    post_ids = [post['id'] for post in posts]
+    if not post_ids:
+        return
+    deltas = get_buffer().deltas(post_ids)
+    for post in posts:
+        up, down = deltas[post['id']]
+        post['upvotes'] += up
+        post['downvotes'] += down
+        post['score'] += up - down
+
+
+def pending_votes(user, post_ids):
+    """
+    Return the buffered votes of a user on the given posts.
+
+    Returns:
+        dict: Vote type (or None for a withdrawn vote) by post id, for the posts the user
+        has a pending vote on.
+    """
+
+    return get_buffer().intents(user.id, post_ids)
+
+
+def flush():
+    """
+    Write the buffered votes to the database.
+
+    Only one flusher runs at a time; the others return at once. A batch whose write
+    fails stays set aside and is written by the next flush, before newer votes. If the
+    flusher dies between the commit of a batch and the withdrawal of its deltas, reads
+    count the batch twice until the next flush.
+
+    Returns:
+        int: The number of intents written.
+    """
+
+    buffer = get_buffer()
+    if not buffer.acquire():
+        return 0
+    try:
+        intents = list(buffer.take().items())
+        for start in range(0, len(intents), FLUSH_BATCH_SIZE):
+            buffer.renew()
+            _write(buffer, intents[start:start + FLUSH_BATCH_SIZE])
+        buffer.renew()
+        buffer.done()
+        return len(intents)
+    finally:
+        buffer.release()
+
+
+def _write(buffer, intents):
+    """
+    Apply a batch of intents. The counters change by the difference between each intent
+    and the vote actually stored, so writing a batch twice changes nothing. Once the
+    batch commits, the changes are withdrawn from the deltas of the buffer.
+    """
+
+    user_ids = {user_id for (user_id, _), _ in intents}
+    post_ids = {post_id for (_, post_id), _ in intents}
+    with transaction.atomic():
+        # Lock the posts, in a fixed order, against concurrent flushes and direct votes
+        posts = {post.id: post for post in Post.objects.select_for_update().filter(id__in=post_ids).order_by('id')
+                 .only('id', 'subrabbit_id', 'created_at', 'score', 'upvotes', 'downvotes')}
+        users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        stored = {
+            (user_id, post_id): (vote_id, vote_type)
+            for vote_id, user_id, post_id, vote_type in Vote.objects.filter(
+                user_id__in=user_ids, post_id__in=post_ids).values_list('id', 'user_id', 'post_id', 'type')
+        }
+
+        created = []
+        deleted = []
+        switched = {VoteType.UP: [], VoteType.DOWN: []}
+        counters = defaultdict(lambda: [0, 0])
+        for (user_id, post_id), current in intents:
+            # Votes on deleted posts, or of deleted users, are dropped
+            if post_id not in posts or user_id not in users:
+                continue
+            vote_id, previous = stored.get((user_id, post_id), (None, None))
+            if previous == current:
+                continue
+            if current is None:
+                deleted.append(vote_id)
+            elif previous is None:
+                created.append(Vote(user_id=user_id, post_id=post_id, type=current))
+            else:
+                switched[current].append(vote_id)
+            up, down = vote_deltas(previous, current)
+            counters[post_id][0] += up
+            counters[post_id][1] += down
+
+        if deleted:
+            Vote.objects.filter(id__in=deleted).delete()
+        for vote_type, vote_ids in switched.items():
+            if vote_ids:
+                Vote.objects.filter(id__in=vote_ids).update(type=vote_type)
+        Vote.objects.bulk_create(created)
+
+        changed = []
+        for post_id, (up, down) in counters.items():
+            if not up and not down:
+                continue
+            post = posts[post_id]
+            post.upvotes += up
+            post.downvotes += down
+            post.score += up - down
+            post.hot_score = ranking.hot(post.score, post.created_at)
+            post.rising_score = ranking.rising(post.score, post.created_at)
+            changed.append(post)
+        Post.objects.bulk_update(changed, ['upvotes', 'downvotes', 'score', 'hot_score', 'rising_score'])
+        for subrabbit_id in {post.subrabbit_id for post in changed}:
+            feed_cache.posts_updated(subrabbit_id)
+        applied = {post_id: tuple(deltas) for post_id, deltas in counters.items() if any(deltas)}
+        transaction.on_commit(lambda: buffer.written(applied))
@@ -0,0 +1,226 @@
+"""
+Write paths that keep the denormalized counters on `Post` and `Comment` in sync.
+
+Votes and comments are never counted at read time. Instead every write applies
+a delta to `Post.upvotes`, `Post.downvotes`, `Post.score` and `Post.comment_count`
+(or to the vote counters of a comment) inside the same transaction as the row it
+describes, and refreshes the stored ranking scores. The `reconcile_counters`
+management command recomputes the counters from scratch to repair any drift.
+
+Toggling a vote returns the resulting state (`VoteResult`), so the vote endpoints can
+answer with the new score instead of the client recomputing it.
+"""
+
+from typing import NamedTuple, Optional
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from core import comment_tree, feed_cache, ranking
+from core.models import Comment, CommentVote, Post, Vote, VoteType
+
+
+def vote_deltas(previous, current):
+    """
+    Compute the counter changes caused by a vote moving from one state to another.
+
+    Parameters:
+        previous: The vote type before the change, or None if there was no vote.
+        current: The vote type after the change, or None if the vote was removed.
+
+    Returns:
+        tuple: (upvotes delta, downvotes delta).
+    """
+
+    up = (current == VoteType.UP) - (previous == VoteType.UP)
+    down = (current == VoteType.DOWN) - (previous == VoteType.DOWN)
+    return up, down
+
+
+class VoteResult(NamedTuple):
+    """The state of a vote target after a vote: the user's vote type and the counters."""
+
+    vote_type: Optional[str]
+    score: int
+    upvotes: int
+    downvotes: int
+
+
+# Toggles a vote and applies its deltas to the target's counters, and recomputes the
+# target's ranking scores from the new counters, in one statement. The CTEs all read the
+# snapshot taken before the statement: `previous` is the vote before the change, `removed`
+# withdraws it if it has the requested type, and otherwise `upserted` inserts it or
+# switches its type.
+TOGGLE_VOTE_SQL = """
+WITH previous AS (
+    SELECT type FROM {votes} WHERE user_id = %(user)s AND {target}_id = %(target)s
+), removed AS (
+    DELETE FROM {votes} WHERE user_id = %(user)s AND {target}_id = %(target)s AND type = %(type)s
+    RETURNING type
+), upserted AS (
+    INSERT INTO {votes} (user_id, {target}_id, type)
+    SELECT %(user)s, %(target)s, %(type)s WHERE NOT EXISTS (SELECT 1 FROM removed)
+    ON CONFLICT (user_id, {target}_id){conflict_condition} DO UPDATE SET type = EXCLUDED.type
+    RETURNING type
+), state AS (
+    SELECT
+        (upserted.type IS NOT DISTINCT FROM 'UP')::int - (previous.type IS NOT DISTINCT FROM 'UP')::int AS up,
+        (upserted.type IS NOT DISTINCT FROM 'DOWN')::int - (previous.type IS NOT DISTINCT FROM 'DOWN')::int AS down,
+        upserted.type AS current
+    FROM (SELECT 1) AS one
+    LEFT JOIN previous ON true
+    LEFT JOIN upserted ON true
+)
+UPDATE {targets} SET
+    upvotes = upvotes + state.up,
+    downvotes = downvotes + state.down,
+    score = score + state.up - state.down,
+    {rankings}
+FROM state
+WHERE {targets}.id = %(target)s
+RETURNING state.current, {targets}.score, {targets}.upvotes, {targets}.downvotes
+"""
+
+
+# The counters after the vote, in the SET clause of TOGGLE_VOTE_SQL (which reads the old row)
+NEW_SCORE = 'score + state.up - state.down'
+NEW_UPVOTES = 'upvotes + state.up'
+NEW_DOWNVOTES = 'downvotes + state.down'
+
+POST_RANKINGS = {
+    'hot_score': ranking.hot_sql(NEW_SCORE, 'created_at'),
+    'rising_score': ranking.rising_sql(NEW_SCORE, 'created_at'),
+}
+COMMENT_RANKINGS = {
+    'best_score': ranking.best_sql(NEW_UPVOTES, NEW_DOWNVOTES),
+    'controversy': ranking.controversy_sql(NEW_UPVOTES, NEW_DOWNVOTES),
+}
+
+
+def _toggle_vote_statement(vote_model, target, target_model, user_id, target_id, vote_type, rankings,
+                           conflict_condition=''):
+    sql = TOGGLE_VOTE_SQL.format(
+        votes=connection.ops.quote_name(vote_model._meta.db_table),
+        targets=connection.ops.quote_name(target_model._meta.db_table),
+        target=target,
+        conflict_condition=conflict_condition,
+        rankings=',\n    '.join(f'{column} = {expression}' for column, expression in rankings.items()),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'user': user_id, 'target': target_id, 'type': vote_type})
+        return VoteResult(*cursor.fetchone())
+
+
+def _toggle_vote_rows(vote_model, target, target_model, user_id, target_id, vote_type):
+    """Toggle a vote with separate statements; the caller holds the write lock."""
+
+    lookup = {'user_id': user_id, f'{target}_id': target_id}
+    previous = vote_model.objects.filter(**lookup).values_list('type', flat=True).first()
+    if previous == vote_type:
+        vote_model.objects.filter(**lookup).delete()
+        current = None
+    elif previous is not None:
+        vote_model.objects.filter(**lookup).update(type=vote_type)
+        current = vote_type
+    else:
+        vote_model.objects.create(type=vote_type, **lookup)
+        current = vote_type
+
+    up, down = vote_deltas(previous, current)
+    if up or down:
+        target_model.objects.filter(id=target_id).update(
+            upvotes=F('upvotes') + up,
+            downvotes=F('downvotes') + down,
+            score=F('score') + up - down,
+        )
+    return VoteResult(current, *target_model.objects.filter(id=target_id).values_list(
+        'score', 'upvotes', 'downvotes').get())
+
+
+def toggle_post_vote(user, post_id, vote_type):
+    """
+    Cast, switch or withdraw a user's vote on a post.
+
+    Voting twice with the same type withdraws the vote, voting with the other
+    type switches it.
+
+    On PostgreSQL the post row is locked, which serializes votes on the post (its
+    counters are updated by every vote anyway), and the vote is then toggled, counted
+    and the post ranked by a single statement. Other databases lock the post with a
+    no-op update and run the same steps as separate statements.
+
+    Returns:
+        VoteResult or None: The user's vote type and the post's counters after the
+        change, or None if the post does not exist.
+    """
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            subrabbit_id = Post.objects.select_for_update().filter(id=post_id).values_list(
+                'subrabbit_id', flat=True).first()
+            if subrabbit_id is None:
+                return None
+            result = _toggle_vote_statement(Vote, 'post', Post, user.id, post_id, vote_type, POST_RANKINGS)
+        else:
+            if not Post.objects.filter(id=post_id).update(score=F('score')):
+                return None
+            subrabbit_id, created_at = Post.objects.filter(id=post_id).values_list(
+                'subrabbit_id', 'created_at').get()
+            result = _toggle_vote_rows(Vote, 'post', Post, user.id, post_id, vote_type)
+            Post.objects.filter(id=post_id).update(
+                hot_score=ranking.hot(result.score, created_at),
+                rising_score=ranking.rising(result.score, created_at),
+            )
+
+        feed_cache.posts_updated(subrabbit_id)
+
+    return result
+
+
+def toggle_comment_vote(user, comment_id, vote_type):
+    """
+    Cast, switch or withdraw a user's vote on a comment, with the same rules and
+    locking as `toggle_post_vote`.
+
+    Returns:
+        VoteResult or None: The user's vote type and the comment's counters after the
+        change, or None if the comment does not exist.
+    """
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            if Comment.objects.select_for_update().filter(id=comment_id).values_list('id', flat=True).first() is None:
+                return None
+            result = _toggle_vote_statement(CommentVote, 'comment', Comment, user.id, comment_id, vote_type,
+                                            COMMENT_RANKINGS, conflict_condition=' WHERE comment_id IS NOT NULL')
+        else:
+            if not Comment.objects.filter(id=comment_id).update(score=F('score')):
+                return None
+            result = _toggle_vote_rows(CommentVote, 'comment', Comment, user.id, comment_id, vote_type)
+            Comment.objects.filter(id=comment_id).update(
+                best_score=ranking.best(result.upvotes, result.downvotes),
+                controversy=ranking.controversy(result.upvotes, result.downvotes),
+            )
+
+    return result
+
+
+def create_comment(serializer, parent=None, **kwargs):
+    """
+    Save a comment and maintain the counters it affects, in one transaction.
+
+    The comment gets its materialized path and depth under `parent`, every ancestor's
+    descendant count is incremented, and so is the comment counter of the post.
+    """
+
+    with transaction.atomic():
+        comment = serializer.save(**kwargs)
+        comment.path = comment_tree.path_for(comment.id, parent.path if parent else '')
+        comment.depth = parent.depth + 1 if parent else 0
+        Comment.objects.filter(id=comment.id).update(path=comment.path, depth=comment.depth)
+        ancestors = comment_tree.ancestor_ids(comment.path)
+        if ancestors:
+            Comment.objects.filter(id__in=ancestors).update(descendant_count=F('descendant_count') + 1)
+        Post.objects.filter(id=comment.parent_post_id).update(comment_count=F('comment_count') + 1)
+        feed_cache.posts_updated(comment.parent_post.subrabbit_id)
+    return comment
@@ -130,6 +130,66 @@ CACHES = {
     }
 }
 
+# Seconds a rendered feed page stays cached (pages are also invalidated by writes)
+FEED_CACHE_TTL = int(os.getenv('FEED_CACHE_TTL', 60))
+
+# Seconds a user's cached subscribed/moderated subrabbit ids are kept (see core.memberships)
+MEMBERSHIP_CACHE_TTL = 60 * 60 * 24
+
+# Seconds an authenticated user's cached principal is kept (see accounts.principals)
+PRINCIPAL_CACHE_TTL = 60 * 60
+
+# Matches ranked by the in-memory search backend, used without PostgreSQL (see core.search)
+SEARCH_MAX_RESULTS = 1000
+
+# Seconds between checks for subrabbit changes made by other workers (see core.autocomplete)
+AUTOCOMPLETE_REFRESH_INTERVAL = 1
+
+# Raise on lazy queries issued while serializing lists (see core.serializers.GuardedListSerializer)
+SERIALIZER_QUERY_GUARD = DEBUG
+
+# Home timelines (Redis sorted sets): posts kept per timeline, subrabbit size above which
+# posts are merged at read time instead of fanned out, and idle seconds before expiry
+TIMELINE_LENGTH = 800
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', 10000))
+TIMELINE_TTL = 60 * 60 * 24 * 7
+
+# Link previews of the EditorJS Link tool (see core.link_preview): seconds previews and
+# failures stay cached, bytes read per page, (connect, read) timeouts and overall deadline
+LINK_PREVIEW_TTL = 60 * 60 * 24
+LINK_PREVIEW_NEGATIVE_TTL = 60 * 5
+LINK_PREVIEW_MAX_BYTES = 512 * 1024
+LINK_PREVIEW_TIMEOUT = (3, 5)
+LINK_PREVIEW_DEADLINE = 10
+
+# Image uploads (see core.uploads): storage backend ('core.uploads.LocalBackend' stores
+# under MEDIA_ROOT), background worker threads per process, and attempts per round with
+# the delay before the first retry
+UPLOAD_BACKEND = os.getenv('UPLOAD_BACKEND', 'core.uploads.CloudinaryBackend')
+UPLOAD_WORKERS = 4
+UPLOAD_MAX_ATTEMPTS = 5
+UPLOAD_RETRY_DELAY = 2
+
+# Chunked file uploads (see core.file_uploads): largest chunk and file accepted in bytes,
+# and idle seconds before an unfinished upload is discarded
+CHUNKED_UPLOAD_MAX_CHUNK = 16 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRY = 60 * 60 * 24
+
+# Write-behind post votes (see core.vote_buffer): buffer votes in Redis (or in process
+# memory without Redis) and write them in bulk every VOTE_FLUSH_INTERVAL seconds
+VOTE_WRITE_BEHIND = os.getenv('VOTE_WRITE_BEHIND', 'False').lower() in ('true', '1')
+VOTE_FLUSH_INTERVAL = 5
+
+# Async versions of the views waiting on remote services (link previews, GitHub sign-in,
+# image uploads), for when the ASGI application is served, e.g. with
+# `gunicorn rabbit.asgi:application -k uvicorn.workers.UvicornWorker`. Their outbound
+# requests share a pooled client (see core.async_http) of at most ASYNC_HTTP_MAX_CONNECTIONS
+# connections, with (connect, read) timeouts of ASYNC_HTTP_TIMEOUT seconds
+USE_ASYNC_VIEWS = os.getenv('USE_ASYNC_VIEWS', 'False').lower() in ('true', '1')
+ASYNC_HTTP_MAX_CONNECTIONS = 100
+ASYNC_HTTP_TIMEOUT = (5, 10)
+
 # REST_FRAMEWORK = {
 #     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
 #     'PAGE_SIZE': 3
@@ -177,7 +237,17 @@ SIMPLE_JWT = {
 GITHUB_CLIENT_ID=os.getenv('GITHUB_CLIENT_ID'),
 GITHUB_SECRET=os.getenv('GITHUB_SECRET'),
 
+# GitHub API requests (see accounts.github): (connect, read) timeouts in seconds, retries
+# of failed connections and 502-504 responses, and pooled connections per worker.
+# GITHUB_FIXTURES is a JSON file of recorded responses served instead of calling GitHub
+# (e.g. accounts/github_fixtures.json), for development and tests
+GITHUB_API_TIMEOUT = (3, 10)
+GITHUB_API_RETRIES = 2
+GITHUB_API_POOL_SIZE = 10
+GITHUB_FIXTURES = os.getenv('GITHUB_FIXTURES')
+
 WSGI_APPLICATION = 'rabbit.wsgi.application'
+ASGI_APPLICATION = 'rabbit.asgi.application'
 AUTH_USER_MODEL = 'accounts.User'
 
 
@@ -1,55 +1,102 @@
 import { useSelector } from 'react-redux';
 import { RootState } from '@/redux/store';
-import { Comment } from '@/types/post';
+import { Comment, CommentContinuation, ViewerState } from '@/types/post';
 import PostComment from './comments/PostComment';
 import CreateComment from './CreateComment';
-import { FC } from 'react';
+import { FC, useState } from 'react';
 import { useParams } from 'react-router-dom';
+import axios from 'axios';
+import { Loader2 } from 'lucide-react';
+import useViewerState from '@/hooks/useViewerState';
 
 type CommentsSectionProps = {
   comments?: Comment[];
+  more?: CommentContinuation | null;
 };
 
-const CommentsSection: FC<CommentsSectionProps> = ({ comments }) => {
-  const { id } = useParams();
+type CommentListProps = {
+  comments: Comment[];
+  more?: CommentContinuation | null;
+  postId?: string;
+  votes: ViewerState['comments'];
+};
+
+// Ids of the comments of a (sub)tree, to fetch the viewer's votes on them at once
+const commentIds = (comments: Comment[] = []): (string | undefined)[] =>
+  comments.flatMap((comment) => [comment.id, ...commentIds(comment.replies)]);
+
+// Fetches the comments hidden behind a continuation of the comment tree
+const LoadMoreComments: FC<{ more: CommentContinuation; postId?: string }> = ({ more, postId }) => {
+  const [page, setPage] = useState<{ results: Comment[]; more: CommentContinuation | null } | null>(null);
+  const [isLoading, setIsLoading] = useState(false);
+  const viewerState = useViewerState({ comments: commentIds(page?.results) });
+
+  if (page) {
+    return <CommentList comments={page.results} more={page.more} postId={postId} votes={viewerState.comments} />;
+  }
+
+  const loadMore = async () => {
+    setIsLoading(true);
+    try {
+      const { data } = await axios.get(`/api/posts/${postId}/comments/tree/?cursor=${more.cursor}`);
+      const next = data.next ? new URL(data.next).searchParams.get('cursor') : null;
+      setPage({ results: data.results, more: next ? { count: data.more_count, cursor: next } : null });
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
+  return (
+    <button
+      onClick={loadMore}
+      disabled={isLoading}
+      className='w-fit text-xs font-medium text-blue-600 hover:underline'>
+      {isLoading ? (
+        <Loader2 className='h-4 w-4 animate-spin text-zinc-500' />
+      ) : (
+        `${more.count} more ${more.count === 1 ? 'reply' : 'replies'}`
+      )}
+    </button>
+  );
+};
+
+const CommentList: FC<CommentListProps> = ({ comments, more, postId, votes }) => {
   const user = useSelector((state: RootState) => state.user);
 
-  const renderComments = (commentList: Comment[], parentId: string | null = null) => {
-    return commentList
-      .filter((comment) => comment.parent_comment_id === parentId)
-      .sort((a, b) => b.comment_votes.length - a.comment_votes.length)
-      .map((comment) => {
-        const votesAmt = comment.comment_votes.reduce((acc, vote) => {
-          if (vote.type === 'UP') return acc + 1;
-          if (vote.type === 'DOWN') return acc - 1;
-          return acc;
-        }, 0);
-        const currentVote = comment.comment_votes.find(
-          (vote) => vote.user === user?.user_id
-        );
+  return (
+    <>
+      {comments.map((comment) => {
+        const currentVote = user ? votes[String(comment.id)] ?? null : null;
 
         return (
           <div key={comment.id} className='flex flex-col'>
             <PostComment
               comment={comment}
               currentVote={currentVote}
-              votesAmt={votesAmt}
-              postId={id}
+              votesAmt={comment.score}
+              postId={postId}
             />
-            <div className='ml-2 py-2 pl-4 border-l-2 border-zinc-200'>
-              {renderComments(commentList, comment.id)}
+            <div className='ml-2 py-2 pl-4 border-l-2 border-zinc-200 flex flex-col gap-y-2'>
+              <CommentList comments={comment.replies || []} more={comment.more} postId={postId} votes={votes} />
             </div>
           </div>
         );
-      });
-  };
+      })}
+      {more && <LoadMoreComments more={more} postId={postId} />}
+    </>
+  );
+};
+
+const CommentsSection: FC<CommentsSectionProps> = ({ comments, more }) => {
+  const { id } = useParams();
+  const viewerState = useViewerState({ comments: commentIds(comments) });
 
   return (
     <div className='flex flex-col gap-y-4 mt-4'>
       <hr className='w-full h-px my-6' />
       {id && <CreateComment postId={id} />}
       <div className='flex flex-col gap-y-6 mt-4'>
-        {renderComments(comments || [])}
+        <CommentList comments={comments || []} more={more} postId={id} votes={viewerState.comments} />
       </div>
     </div>
   );
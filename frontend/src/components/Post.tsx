@@ -4,13 +4,13 @@ import { FC, useRef, useEffect, useState } from 'react'
 import EditorOutput from './EditorOutput'
 import { Link } from 'react-router-dom'
 import PostVote from './PostVote'
-import { Votes } from '@/types/post'
+import { VoteType } from '@/types/post'
 import { Post as PostType } from '@/types/post'
 
 
 interface PostProps {
   post: PostType
-  currentVote?: Votes
+  currentVote?: VoteType | null
   votesAmt: number
 }
 
@@ -44,7 +44,7 @@ const Post: FC<PostProps> = ({
                 <PostVote
                   postId={post.id}
                   initialVotesAmt={votesAmt}
-                  initialVote={currentVote?.type}
+                  initialVote={currentVote}
                 />
                 <div className='w-0 flex-1'>
                   <div className='max-h-40 mt-1 text-xs text-gray-500'>
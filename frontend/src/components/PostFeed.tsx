@@ -8,9 +8,9 @@ import { useEffect, useRef } from 'react'
 import { useInfiniteQuery } from '@tanstack/react-query'
 import axios from 'axios'
 import { useParams } from 'react-router-dom'
-import { Votes } from '@/types/post'
 import { getCsrfToken } from '@/lib/utils'
 import Loader from './Loader'
+import useViewerState from '@/hooks/useViewerState'
 
 
 const PostFeed = () => {
@@ -41,22 +41,27 @@ const PostFeed = () => {
     isPending
   } = useInfiniteQuery({
     queryKey: [`infinite-query ${slug}`],
-    queryFn: async ({ pageParam = 1 }) => {
+    queryFn: async ({ pageParam }) => {
         const query =
-            `/api/posts?&page=${pageParam}` +
-            (subrabbitName ? `&subrabbitName=${subrabbitName}` : '');
+            `/api/posts/?` +
+            (subrabbitName ? `subrabbitName=${subrabbitName}` : '') +
+            (pageParam ? `&cursor=${pageParam}` : '');
 
         const { data } = await axios.get(query, config);
         return data;
     },
-    initialPageParam: 1,
-    getNextPageParam: (_, pages) => {
-        return pages.length + 1;
+    initialPageParam: '',
+    getNextPageParam: (lastPage) => {
+        // The API returns an absolute `next` URL; only its opaque cursor is kept
+        return lastPage?.next ? new URL(lastPage.next).searchParams.get('cursor') : undefined;
     },
     // initialData: { pages: [initialPosts], pageParams: [1] },
   });
 
   const posts = data?.pages.flatMap((page) => page);
+  const viewerState = useViewerState({
+    posts: posts?.flatMap((page) => page?.results?.map((post: PostType) => post.id) ?? []),
+  });
   useEffect(() => {
     if (entry?.isIntersecting && posts && posts[posts?.length - 1]?.next) {
       fetchNextPage(); // Load more posts when the last post comes into view
@@ -71,14 +76,8 @@ const PostFeed = () => {
     ) : (
     <ul className='flex flex-col col-span-2 space-y-6'>
       {posts?.map((postItem, postIndex) => postItem?.results?.map((post: PostType, index: number) => {
-        const votesAmt = post.votes.reduce((acc: number, vote: Votes) => {
-          if (vote.type === 'UP') return acc + 1
-          if (vote.type === 'DOWN') return acc - 1
-          return acc
-        }, 0)
-        const currentVote = post.votes.find(
-          (vote: Votes) => vote.user === user?.user_id
-        )
+        const votesAmt = post.score
+        const currentVote = user ? viewerState.posts[String(post.id)] ?? null : null
   
         if (index === postItem.results.length - 1 && postIndex === posts.length - 1) {
           // Add a ref to the last post in the list
@@ -7,7 +7,7 @@ import { Button } from './ui/Button';
 import { useToast } from '@/hooks/useToast';
 import { ArrowBigDown, ArrowBigUp } from 'lucide-react';
 import { cn } from '@/lib/utils';
-import { VoteType } from '@/types/post';
+import { VoteResponse, VoteType } from '@/types/post';
 import { getCsrfToken } from '@/lib/utils';
 import { useDispatch, useSelector } from 'react-redux';
 import { useQueryClient } from '@tanstack/react-query';
@@ -56,11 +56,12 @@ const PostVote = ({
         },
       }
       try {
-        await axios.patch(
+        const { data } = await axios.patch(
           '/api/subrabbit/post/vote/',
            payload,
            config
         )
+        return data as VoteResponse
       } catch(err) {
         if (err instanceof AxiosError && err.response?.status === 401) {
           try {
@@ -76,7 +77,7 @@ const PostVote = ({
               payload, 
               config
             );
-            return data as string
+            return data as VoteResponse
           } catch (refreshErr) {
             if (refreshErr instanceof AxiosError && (
               refreshErr.response?.status === 401 || refreshErr.response?.status === 400)) {
@@ -90,7 +91,11 @@ const PostVote = ({
       }
 
     },
-    onSuccess: () => {
+    onSuccess: (data) => {
+        // the server's count also includes votes cast since the page was loaded
+        setVotesAmt(data.score);
+        setCurrentVote(data.voteType);
+        queryClient.invalidateQueries({ queryKey: ['viewerState'] });
         queryClient.invalidateQueries({ queryKey: queryKey, exact: true });
     },
     onError: (err, voteType) => {
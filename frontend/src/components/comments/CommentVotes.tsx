@@ -6,17 +6,17 @@ import { usePrevious } from '@mantine/hooks'
 import { useMutation, useQueryClient } from '@tanstack/react-query';
 import axios, { AxiosError } from 'axios'
 import { ArrowBigDown, ArrowBigUp } from 'lucide-react'
-import { FC, useState } from 'react'
+import { FC, useEffect, useState } from 'react'
 import { useDispatch, useSelector } from 'react-redux';
 import { getCsrfToken } from '@/lib/utils';
-import { Votes } from '@/types/post';
+import { VoteResponse, Votes } from '@/types/post';
 import { openModal, logout } from '@/redux/state';
 import { AppDispatch, RootState } from '@/redux/store';
 
 interface CommentVotesProps {
   commentId: string
   votesAmt: number
-  currentVote?: Votes | undefined
+  currentVote?: Votes['type'] | null
 }
 
 enum VoteType {
@@ -40,6 +40,10 @@ const CommentVotes: FC<CommentVotesProps> = ({
   const queryClient = useQueryClient();
   const queryKey = ['postDetail'];
 
+  useEffect(() => {
+    setCurrentVote(_currentVote)
+  }, [_currentVote])
+
   const { mutate: vote } = useMutation({
     mutationFn: async (type: VoteType) => {
       const payload: CommentVoteRequest = {
@@ -54,7 +58,8 @@ const CommentVotes: FC<CommentVotesProps> = ({
         },
       }
       try {
-        await axios.patch('/api/subrabbit/post/comment/vote/', payload, config)
+        const { data } = await axios.patch('/api/subrabbit/post/comment/vote/', payload, config)
+        return data as VoteResponse
       } catch(err) {
         if (err instanceof AxiosError && err.response?.status === 401) {
           try {
@@ -70,7 +75,7 @@ const CommentVotes: FC<CommentVotesProps> = ({
               payload, 
               config
             );
-            return data as string
+            return data as VoteResponse
           } catch (refreshErr) {
             if (refreshErr instanceof AxiosError && (
               refreshErr.response?.status === 401 || refreshErr.response?.status === 400)) {
@@ -107,19 +112,22 @@ const CommentVotes: FC<CommentVotesProps> = ({
         variant: 'destructive',
       })
     },
-    onSuccess: () => {
+    onSuccess: (data) => {
+        // the server's count also includes votes cast since the page was loaded
+        setVotesAmt(data.score)
+        setCurrentVote(data.voteType)
+        queryClient.invalidateQueries({ queryKey: ['viewerState'] })
         queryClient.invalidateQueries({ queryKey: queryKey, exact: true })
       },
     onMutate: (type: VoteType) => {
-      if (currentVote?.type === type) {
+      if (currentVote === type) {
         // User is voting the same way again, so remove their vote
-        setCurrentVote(undefined)
+        setCurrentVote(null)
         if (type === 'UP') setVotesAmt((prev) => prev - 1)
         else if (type === 'DOWN') setVotesAmt((prev) => prev + 1)
       } else {
         // User is voting in the opposite direction, so subtract 2
-        // @ts-expect-error __ _
-        setCurrentVote({ type })
+        setCurrentVote(type)
         if (type === 'UP') setVotesAmt((prev) => prev + (currentVote ? 2 : 1))
         else if (type === 'DOWN')
           setVotesAmt((prev) => prev - (currentVote ? 2 : 1))
@@ -147,7 +155,7 @@ const CommentVotes: FC<CommentVotesProps> = ({
         aria-label='upvote'>
         <ArrowBigUp
           className={cn('h-5 w-5 text-zinc-700', {
-            'text-emerald-500 fill-emerald-500': currentVote?.type === 'UP',
+            'text-emerald-500 fill-emerald-500': currentVote === 'UP',
           })}
         />
       </Button>
@@ -172,13 +180,13 @@ const CommentVotes: FC<CommentVotesProps> = ({
         }}
         size='xs'
         className={cn({
-          'text-emerald-500': currentVote?.type === 'DOWN',
+          'text-emerald-500': currentVote === 'DOWN',
         })}
         variant='ghost'
         aria-label='downvote'>
         <ArrowBigDown
           className={cn('h-5 w-5 text-zinc-700', {
-            'text-red-500 fill-red-500': currentVote?.type === 'DOWN',
+            'text-red-500 fill-red-500': currentVote === 'DOWN',
           })}
         />
       </Button>
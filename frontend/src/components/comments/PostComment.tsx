@@ -21,7 +21,7 @@ import CommentVotes from './CommentVotes'
 interface PostCommentProps {
     comment: Comment
     votesAmt: number
-    currentVote?: Votes | undefined
+    currentVote?: Votes['type'] | null
     postId?: string | undefined | null
 }
 
@@ -0,0 +1,67 @@
+import { useQueries } from '@tanstack/react-query';
+import axios from 'axios';
+import { useSelector } from 'react-redux';
+import { RootState } from '@/redux/store';
+import { getCsrfToken } from '@/lib/utils';
+import { ViewerState } from '@/types/post';
+
+type ViewerStateItems = {
+  posts?: (string | null | undefined)[];
+  comments?: (string | null | undefined)[];
+  subrabbits?: string[];
+};
+
+// Items per kind accepted by one request to the viewer state endpoint
+const MAX_ITEMS = 100;
+
+const chunk = (items: (string | null | undefined)[] = []) => {
+  const ids = Array.from(new Set(items.filter(Boolean).map(String)));
+  const chunks: string[][] = [];
+  for (let i = 0; i < ids.length; i += MAX_ITEMS) chunks.push(ids.slice(i, i + MAX_ITEMS));
+  return chunks;
+};
+
+// Fetches the current user's votes and subscriptions for the items on screen. Posts and
+// comments are served the same to every viewer, so this small overlay is fetched apart.
+const useViewerState = ({ posts, comments, subrabbits }: ViewerStateItems): ViewerState => {
+  const user = useSelector((state: RootState) => state.user);
+  const postChunks = chunk(posts);
+  const commentChunks = chunk(comments);
+  const subrabbitChunks = chunk(subrabbits);
+  const requests = Array.from(
+    { length: Math.max(postChunks.length, commentChunks.length, subrabbitChunks.length) },
+    (_, i) => ({
+      posts: (postChunks[i] || []).join(','),
+      comments: (commentChunks[i] || []).join(','),
+      subrabbits: (subrabbitChunks[i] || []).join(','),
+    })
+  );
+
+  return useQueries({
+    queries: requests.map((params) => ({
+      queryKey: ['viewerState', params],
+      queryFn: async () => {
+        const { data } = await axios.get('/api/viewer-state/', {
+          params,
+          withCredentials: true,
+          headers: {
+            "Content-Type": "application/json",
+            "x-csrftoken": getCsrfToken()
+          },
+        });
+        return data as ViewerState;
+      },
+      enabled: !!user,
+    })),
+    combine: (results) => results.reduce<ViewerState>(
+      (state, { data }) => ({
+        posts: { ...state.posts, ...data?.posts },
+        comments: { ...state.comments, ...data?.comments },
+        subrabbits: { ...state.subrabbits, ...data?.subrabbits },
+      }),
+      { posts: {}, comments: {}, subrabbits: {} }
+    ),
+  });
+};
+
+export default useViewerState;
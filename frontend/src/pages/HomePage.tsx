@@ -69,7 +69,7 @@ const HomePage = () => {
       }
       const response = await axios.get(`/api/subrabbits/`, config);
       const res = await response.data;
-      return res;
+      return res.results;
     },
   });
 
@@ -15,7 +15,8 @@ import axios from 'axios';
 import { Post } from '@/types/post'
 import CommentsSection from '@/components/CommentsSection';
 import { useEffect } from 'react';
-import { Comment } from '@/types/post';
+import { CommentTree } from '@/types/post';
+import useViewerState from '@/hooks/useViewerState';
 
 const Loader = () => {
   return (
@@ -47,7 +48,7 @@ const PostDetailPage = () => {
     });
 
     const commentQueryKey = [`postComments ${id}`];
-    const { data: comments } = useQuery<Comment[]>({
+    const { data: comments } = useQuery<CommentTree>({
       queryKey: commentQueryKey,
       queryFn: async () => {
         const config = {
@@ -57,21 +58,15 @@ const PostDetailPage = () => {
             "x-csrftoken": getCsrfToken()
           },
         }
-        const response = await axios.get(`/api/posts/${id}/comments/`, config);
+        const response = await axios.get(`/api/posts/${id}/comments/tree/`, config);
         const res = await response.data
         return res;
       },
     });
 
-    const votesAmt = post?.votes.reduce((acc, vote) => {
-      if (vote.type === 'UP') return acc + 1
-      if (vote.type === 'DOWN') return acc - 1
-      return acc
-      }, 0)
-
-      const currentVote = post?.votes.find(
-        (vote) => vote.user === user?.user_id
-      )
+    const viewerState = useViewerState({ posts: [id] });
+    const votesAmt = post?.score
+    const currentVote = user && id ? viewerState.posts[id] ?? null : null
 
       useEffect(() => {
         window.scrollTo(0, 0);
@@ -101,7 +96,7 @@ const PostDetailPage = () => {
             <PostVote
               postId={post?.id}
               initialVotesAmt={votesAmt}
-              initialVote={currentVote?.type}
+              initialVote={currentVote}
             />
           </Suspense>
         </div>
@@ -120,7 +115,7 @@ const PostDetailPage = () => {
             <PostVote
               postId={post?.id}
               initialVotesAmt={votesAmt}
-              initialVote={currentVote?.type}
+              initialVote={currentVote}
             />
           </Suspense>
         </div>
@@ -128,7 +123,10 @@ const PostDetailPage = () => {
            fallback={
              <Loader2 className='h-5 w-5 animate-spin text-zinc-500' />
            }>
-           <CommentsSection comments={comments} />
+           <CommentsSection
+             comments={comments?.results}
+             more={comments?.next ? { count: comments.more_count, cursor: new URL(comments.next).searchParams.get('cursor') || '' } : null}
+           />
          </Suspense>
         </div>
           </div>
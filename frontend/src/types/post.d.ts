@@ -7,19 +7,47 @@ type Votes = {
 
 type VoteType = 'UP' | 'DOWN';
 
+type ViewerState = {
+    posts: Record<string, VoteType | null>;
+    comments: Record<string, VoteType | null>;
+    subrabbits: Record<string, boolean>;
+}
+
+type VoteResponse = {
+    voteType: VoteType | null;
+    score: number;
+    upvotes: number;
+    downvotes: number;
+}
+
 type Author = {
     username: string;
     profile_picture: string;
 }
 
+type CommentContinuation = {
+    count: number;
+    cursor: string;
+}
+
 type Comment = {
     id: string | undefined;
     text: string;
     parent_comment_id?: string;
-    comment_votes: Votes[];
+    score: number;
+    upvotes: number;
+    downvotes: number;
     created_at: string;
     content: any;
     author: Author;
+    replies: Comment[];
+    more: CommentContinuation | null;
+}
+
+type CommentTree = {
+    next: string | null;
+    more_count: number;
+    results: Comment[];
 }
 
 export type Post = {
@@ -30,7 +58,9 @@ export type Post = {
     comments_count: number;
     content: string;
     subrabbit: SubrabbitData;
-    votes: Votes[];
+    score: number;
+    upvotes: number;
+    downvotes: number;
     created_at: string;
     members_count: string;
 };
@@ -9,6 +9,8 @@ export type Subrabbit = {
     members_count: string;
     creator: Creator;
     isSubscriber: string;
+    isModerator?: boolean;
+    joined?: boolean | null;
 };
 
 export interface SubrabbitData {
@@ -18,5 +20,7 @@ export interface SubrabbitData {
     members_count: string;
     creator: Creator;
     isSubscriber: string;
+    isModerator?: boolean;
+    joined?: boolean | null;
   }
   
\ No newline at end of file